@@ -0,0 +1,123 @@
+"""Measure RAG query latency under concurrency, with and without embedding micro-batching.
+
+For each mode and each caller count, N threads each run ``--queries``
+retrievals against the configured RAG store.  Every query text is unique and
+the embedding/result caches are disabled, so each call pays for a real
+forward pass and a real k-NN search.  ``direct`` is the old behaviour (every
+thread calls the encoder itself); ``batched`` coalesces concurrent calls
+through ``EmbeddingBatcher``.
+
+Usage (from agentic_assistant/):
+    python scripts/bench_embedding_batching.py
+    python scripts/bench_embedding_batching.py --callers 1,2,4,8,16 --queries 20 --wait-ms 2
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parents[1]
+_SRC = _ROOT / "src"
+if str(_SRC) not in sys.path:
+    sys.path.insert(0, str(_SRC))
+
+from assistant.config import settings  # noqa: E402
+from assistant.rag.store import RagStore  # noqa: E402
+
+_QUESTIONS = [
+    "How do I keep the Raspberry Pi from overheating?",
+    "Which environment variable sets the model path?",
+    "What does the embedding router do?",
+    "How are documents chunked during ingestion?",
+    "Why did my Telegram bot reply that it is busy?",
+    "How can I switch the vector backend?",
+    "Where is conversation memory stored?",
+    "What happens when the Groq API is unavailable?",
+]
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_round(store: RagStore, callers: int, queries: int, mode: str) -> tuple[float, list[float]]:
+    """Run *callers* concurrent threads; return (wall seconds, per-query latencies in ms)."""
+    latencies: list[float] = []
+    guard = threading.Lock()
+    start_gate = threading.Barrier(callers)
+
+    def worker(idx: int) -> None:
+        start_gate.wait()
+        for n in range(queries):
+            text = f"{_QUESTIONS[(idx + n) % len(_QUESTIONS)]} (caller {idx}, query {n})"
+            started = time.perf_counter()
+            store.query(text, top_k=settings.rag_top_k, mode=mode)
+            elapsed = (time.perf_counter() - started) * 1000
+            with guard:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(callers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark RAG query latency vs concurrency")
+    parser.add_argument("--callers", default="1,2,4,8,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--queries", type=int, default=20, help="Queries per caller per round")
+    parser.add_argument("--max-batch", type=int, default=settings.rag_embed_batch_max)
+    parser.add_argument("--wait-ms", type=float, default=settings.rag_embed_batch_wait_ms)
+    parser.add_argument(
+        "--mode", default="vector", help="Retrieval mode (vector keeps BM25 out of the numbers)"
+    )
+    args = parser.parse_args()
+
+    levels = [int(x) for x in args.callers.split(",") if x.strip()]
+    rows: list[tuple[str, int, float, list[float], dict]] = []
+    for label, max_batch in (("direct", 1), ("batched", args.max_batch)):
+        store = RagStore(
+            settings.rag_data_dir,
+            settings.embedding_model,
+            embedding_cache_size=0,
+            result_cache_size=0,
+            vector_backend=settings.rag_vector_backend,
+            quantized_dtype=settings.rag_quantized_dtype,
+            quantized_rescore=settings.rag_quantized_rescore,
+            embedding_backend=settings.embedding_backend,
+            onnx_dir=settings.embedding_onnx_dir,
+            embed_batch_max=max_batch,
+            embed_batch_wait_ms=args.wait_ms,
+        )
+        store.query("warm-up", mode=args.mode)
+        for callers in levels:
+            print(f"[{label}] {callers} caller(s) ...", flush=True)
+            before = store.cache_stats()["embed_batches"]
+            elapsed, latencies = run_round(store, callers, args.queries, args.mode)
+            after = store.cache_stats()["embed_batches"]
+            batches = after["batches"] - before["batches"]
+            requests = after["requests"] - before["requests"]
+            rows.append((label, callers, elapsed, latencies, {"batches": batches, "requests": requests}))
+        del store
+
+    print()
+    print(f"{'mode':<9}{'callers':>8}{'p50 ms':>9}{'p99 ms':>9}{'mean ms':>9}{'q/s':>8}{'req/batch':>11}")
+    for label, callers, elapsed, latencies, batching in rows:
+        per_batch = batching["requests"] / batching["batches"] if batching["batches"] else 0.0
+        print(
+            f"{label:<9}{callers:>8}{percentile(latencies, 50):>9.1f}{percentile(latencies, 99):>9.1f}"
+            f"{statistics.fmean(latencies):>9.1f}{len(latencies) / elapsed:>8.1f}{per_batch:>11.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Measure aggregate local generation throughput at several concurrency levels.
+
+Compares the one-process-per-call engine (``llama-cli``) with the resident
+multi-slot ``llama-server`` engine.  For each engine and each user count, N
+threads each send ``--requests`` prompts; aggregate tokens/sec is the total
+number of generated tokens divided by the wall-clock time of the round.
+
+Generated text is tokenized with the server's ``/tokenize`` endpoint so both
+engines are measured in the same unit.
+
+Usage (from agentic_assistant/):
+    python scripts/bench_local_throughput.py --users 1,2,4,8 --slots 4
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import threading
+import time
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parents[1]
+_SRC = _ROOT / "src"
+if str(_SRC) not in sys.path:
+    sys.path.insert(0, str(_SRC))
+
+from assistant.config import settings  # noqa: E402
+from assistant.llm.llama_cpp_runner import LlamaCppRunner  # noqa: E402
+from assistant.llm.llama_server import LlamaServerRunner  # noqa: E402
+
+_PROMPTS = [
+    "Explain in two sentences why the sky is blue.",
+    "Give three tips for keeping a Raspberry Pi cool.",
+    "What is the difference between a list and a tuple in Python?",
+    "Summarise the plot of Romeo and Juliet in one paragraph.",
+    "Describe how a hash map works.",
+    "Why do cats purr?",
+    "Write a haiku about autumn rain.",
+    "What does HTTP status code 429 mean?",
+]
+
+
+def run_round(runner: LlamaCppRunner, users: int, requests: int, max_tokens: int) -> tuple[float, list[str]]:
+    """Run *users* concurrent workers; return (wall seconds, generated texts)."""
+    outputs: list[str] = []
+    errors: list[str] = []
+    guard = threading.Lock()
+
+    def worker(idx: int) -> None:
+        for n in range(requests):
+            prompt = _PROMPTS[(idx + n) % len(_PROMPTS)]
+            try:
+                text = runner.generate(prompt, max_tokens_override=max_tokens)
+            except Exception as exc:  # noqa: BLE001
+                with guard:
+                    errors.append(str(exc))
+                continue
+            with guard:
+                outputs.append(text)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(users)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    for err in errors[:3]:
+        print(f"  ! {err}")
+    return elapsed, outputs
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark local LLM throughput vs concurrency")
+    parser.add_argument("--users", default="1,2,4,8", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=2, help="Requests per user per round")
+    parser.add_argument("--max-tokens", type=int, default=64, help="Tokens generated per request")
+    parser.add_argument(
+        "--slots", type=int, default=settings.llama_server_slots, help="llama-server parallel slots"
+    )
+    parser.add_argument(
+        "--engines", default="subprocess,server", help="Engines to measure (subprocess, server)"
+    )
+    args = parser.parse_args()
+
+    levels = [int(x) for x in args.users.split(",") if x.strip()]
+    engines = [e.strip() for e in args.engines.split(",") if e.strip()]
+
+    common = dict(
+        model_path=settings.model_path,
+        threads=settings.inference_threads,
+        max_tokens=args.max_tokens,
+        temperature=settings.llm_temperature,
+        timeout_seconds=settings.llama_timeout_seconds * 4,
+    )
+    subprocess_runner = LlamaCppRunner(
+        executable_path=settings.llama_main_path,
+        context_tokens=settings.llm_context_tokens,
+        **common,
+    )
+    server_runner = LlamaServerRunner(
+        executable_path=settings.llama_server_path,
+        context_tokens=settings.llama_server_slot_context or settings.llm_context_tokens,
+        host=settings.llama_server_host,
+        port=settings.llama_server_port,
+        startup_timeout_seconds=settings.llama_server_startup_seconds,
+        parallel_slots=args.slots,
+        **common,
+    )
+
+    # Run every round first, then tokenize: the subprocess rounds must not
+    # compete with a resident server for CPU and RAM.
+    results: list[tuple[str, int, float, list[str]]] = []
+    try:
+        for engine in engines:
+            runner = server_runner if engine == "server" else subprocess_runner
+            if engine == "server":
+                server_runner.start()
+            for users in levels:
+                print(f"[{engine}] {users} user(s) ...", flush=True)
+                elapsed, outputs = run_round(runner, users, args.requests, args.max_tokens)
+                results.append((engine, users, elapsed, outputs))
+            if engine == "server":
+                server_runner.stop()
+
+        server_runner.start()
+        print()
+        print(f"{'engine':<12}{'users':>6}{'replies':>9}{'tokens':>8}{'seconds':>9}{'tok/s':>8}")
+        for engine, users, elapsed, outputs in results:
+            tokens = sum(server_runner.count_tokens(text) for text in outputs)
+            rate = tokens / elapsed if elapsed > 0 else 0.0
+            print(f"{engine:<12}{users:>6}{len(outputs):>9}{tokens:>8}{elapsed:>9.1f}{rate:>8.2f}")
+    finally:
+        server_runner.stop()
+
+
+if __name__ == "__main__":
+    main()
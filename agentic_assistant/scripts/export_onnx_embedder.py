@@ -0,0 +1,181 @@
+"""Export the embedding model to ONNX (int8 by default) and check it against torch.
+
+Run once on any machine with torch installed (the Pi itself is fine, just
+slow); afterwards ``EMBEDDING_BACKEND=onnx`` needs only onnxruntime and
+tokenizers.  The transformer is exported with dynamic batch and sequence
+axes; pooling and normalisation are re-done in numpy by
+:class:`~assistant.rag.embedders.OnnxEmbedder`, following the model's own
+Pooling module.
+
+The parity check embeds sample texts with both backends and fails (exit
+code 1) if any pair's cosine similarity is below ``--min-cosine``.  The
+dimension is always the same, so existing indexes keep working; the check
+guards retrieval quality.
+
+Usage (from agentic_assistant/):
+    python scripts/export_onnx_embedder.py
+    python scripts/export_onnx_embedder.py --out data/embedder-onnx --no-quantize
+    python scripts/export_onnx_embedder.py --check-only --samples docs/faq.txt
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parents[1]
+_SRC = _ROOT / "src"
+if str(_SRC) not in sys.path:
+    sys.path.insert(0, str(_SRC))
+
+from assistant.config import settings  # noqa: E402
+from assistant.rag.embedders import (  # noqa: E402
+    ONNX_CONFIG_NAME,
+    OnnxEmbedder,
+    SentenceTransformerEmbedder,
+)
+
+_SAMPLES = [
+    "hello there",
+    "How do I keep the Raspberry Pi from overheating?",
+    "LLAMA_MAIN_PATH points at the llama-cli binary.",
+    "Summarise the plot of Romeo and Juliet in one paragraph.",
+    "Why did my Telegram bot reply that it is busy?",
+    "Der schnelle braune Fuchs springt über den faulen Hund.",
+    "def add(a, b):\n    return a + b",
+    " ".join(["A long paragraph about retrieval, chunking and embeddings."] * 40),
+]
+
+
+def export(model_name: str, out: Path, quantize: bool, opset: int) -> None:
+    import torch  # type: ignore[import]
+
+    reference = SentenceTransformerEmbedder(model_name)
+    model = reference.model
+    module_names = [type(module).__name__ for module in model]
+    if module_names[1:] not in (["Pooling"], ["Pooling", "Normalize"]):
+        raise SystemExit(
+            f"Unsupported module stack {module_names}: only Transformer → Pooling "
+            "(→ Normalize) models can be exported."
+        )
+    pooling = model[1].get_pooling_mode_str()
+    if pooling not in ("mean", "cls"):
+        raise SystemExit(f"Unsupported pooling mode {pooling!r} (need mean or cls).")
+
+    transformer = model[0].auto_model.eval()
+    tokenizer = model[0].tokenizer
+    dummy = tokenizer(["an example sentence", "two"], padding=True, return_tensors="pt")
+    input_names = [
+        name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy
+    ]
+
+    class _Hidden(torch.nn.Module):
+        """Positional-argument wrapper returning only the last hidden state."""
+
+        def __init__(self) -> None:
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, *tensors: "torch.Tensor") -> "torch.Tensor":
+            return self.transformer(**dict(zip(input_names, tensors))).last_hidden_state
+
+    out.mkdir(parents=True, exist_ok=True)
+    fp32_path = out / "model.onnx"
+    axes = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            _Hidden(),
+            tuple(dummy[name] for name in input_names),
+            str(fp32_path),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={name: axes for name in [*input_names, "last_hidden_state"]},
+            opset_version=opset,
+        )
+    print(f"Exported {fp32_path} ({fp32_path.stat().st_size / 1e6:.1f} MB)")
+
+    model_file = fp32_path.name
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic  # type: ignore[import]
+
+        int8_path = out / "model.int8.onnx"
+        quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8)
+        model_file = int8_path.name
+        print(f"Quantized  {int8_path} ({int8_path.stat().st_size / 1e6:.1f} MB)")
+
+    tokenizer.save_pretrained(str(out))
+    if not (out / "tokenizer.json").exists():
+        raise SystemExit(f"{model_name} has no fast tokenizer (tokenizer.json); cannot export.")
+    config = {
+        "model": model_name,
+        "model_file": model_file,
+        "dimension": reference.dimension,
+        "pooling": pooling,
+        "max_seq_length": int(model.max_seq_length),
+        "pad_id": int(tokenizer.pad_token_id or 0),
+        "pad_token": tokenizer.pad_token or "[PAD]",
+    }
+    with (out / ONNX_CONFIG_NAME).open("w", encoding="utf-8") as handle:
+        json.dump(config, handle, indent=2)
+
+
+def parity(model_name: str, out: Path, samples: list[str], min_cosine: float) -> bool:
+    import numpy as np
+
+    reference = SentenceTransformerEmbedder(model_name)
+    candidate = OnnxEmbedder(out, model_name)
+    if candidate.dimension != reference.dimension:
+        print(f"Dimension mismatch: onnx {candidate.dimension}, torch {reference.dimension}")
+        return False
+
+    timings = {}
+    vectors = {}
+    for label, embedder in (("torch", reference), ("onnx", candidate)):
+        embedder.encode(samples[:1])  # warm-up
+        started = time.perf_counter()
+        vectors[label] = embedder.encode(samples)
+        timings[label] = (time.perf_counter() - started) * 1000 / len(samples)
+
+    cosines = np.sum(vectors["torch"] * vectors["onnx"], axis=1)
+    worst = int(np.argmin(cosines))
+    print(f"Parity on {len(samples)} texts (dimension {candidate.dimension}):")
+    print(f"  cosine min {cosines.min():.4f}, mean {cosines.mean():.4f}")
+    print(f"  worst: {samples[worst][:60]!r}")
+    print(f"  ms/text: torch {timings['torch']:.1f}, onnx {timings['onnx']:.1f}")
+    ok = float(cosines.min()) >= min_cosine
+    print("PASS" if ok else f"FAIL: below --min-cosine {min_cosine}")
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export the embedder to ONNX and check parity")
+    parser.add_argument("--model", default=settings.embedding_model, help="sentence-transformers model")
+    parser.add_argument("--out", type=Path, default=settings.embedding_onnx_dir, help="Export directory")
+    parser.add_argument("--no-quantize", action="store_true", help="Keep float32 weights")
+    parser.add_argument("--opset", type=int, default=14, help="ONNX opset version")
+    parser.add_argument("--check-only", action="store_true", help="Skip export, run the parity check")
+    parser.add_argument("--samples", type=Path, help="Text file, one parity sample per line")
+    parser.add_argument(
+        "--min-cosine", type=float, default=0.99, help="Fail if any sample falls below this"
+    )
+    args = parser.parse_args()
+
+    if not args.check_only:
+        export(args.model, args.out, quantize=not args.no_quantize, opset=args.opset)
+
+    samples = _SAMPLES
+    if args.samples:
+        samples = [
+            line.strip()
+            for line in args.samples.read_text(encoding="utf-8").splitlines()
+            if line.strip()
+        ]
+    if not parity(args.model, args.out, samples, args.min_cosine):
+        raise SystemExit(1)
+    print(f"Set EMBEDDING_BACKEND=onnx and EMBEDDING_ONNX_DIR={args.out} to use it.")
+
+
+if __name__ == "__main__":
+    main()
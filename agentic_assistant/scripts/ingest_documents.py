@@ -1,7 +1,46 @@
+"""Ingest documents into the local RAG store.
+
+Extraction and chunking run in a process pool (PDF parsing is the slow,
+single-threaded part) while the main process embeds and indexes.  Chunks
+from many files are gathered into batches: each batch is embedded in one
+``encode`` call, inserted into the HNSW index in one ``add_items`` and
+written to SQLite in one transaction.
+
+Workers stream each document page by page (PDF) or block by block (text)
+through :mod:`assistant.rag.chunking`: chunks end on sentence boundaries,
+start afresh at headings, hold at most ``--chunk-tokens`` tokens of the
+embedding model's own tokenizer (so nothing is truncated at its 256-token
+limit) and repeat ``--overlap-tokens`` of trailing sentences.
+
+Re-running is incremental: each file's content hash is compared with the one
+stored at the last run, so unchanged files are skipped before they are even
+parsed, and only the changed chunks of changed files are re-embedded.
+Sources are named ``<--source>:<path relative to docs_path>``; ``--prune``
+deletes sources under that prefix whose file no longer exists.
+
+``--collection`` picks the knowledge base: ``shared`` (the default, searched
+for every user) or a private one such as ``user:tg:123456``, which only that
+user's conversations retrieve from.
+
+This script opens the store itself: a running API keeps serving the index
+it loaded and does not see the changes until it restarts.  To add or remove
+documents while the API runs, use its ``POST /rag/documents`` and
+``DELETE /rag/sources/{source}`` endpoints instead.
+
+Usage (from agentic_assistant/):
+    python scripts/ingest_documents.py ./docs
+    python scripts/ingest_documents.py ./docs --workers 4 --batch-size 512 --embed-batch-size 32
+    python scripts/ingest_documents.py ./docs --prune
+    python scripts/ingest_documents.py ./docs --chunk-tokens 200 --overlap-tokens 30
+    python scripts/ingest_documents.py ./notes --collection user:tg:123456
+"""
 from __future__ import annotations
 
 import argparse
+import os
 import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
 from pathlib import Path
 
 # Allow running as `python scripts/ingest_documents.py` from the project root
@@ -11,59 +50,194 @@ _SRC = _ROOT / "src"
 if str(_SRC) not in sys.path:
     sys.path.insert(0, str(_SRC))
 
-from pypdf import PdfReader  # noqa: E402
-
 from assistant.config import settings  # noqa: E402
-from assistant.rag.store import RagStore  # noqa: E402
-
-
-def chunk_text(text: str, chunk_size_words: int = 500) -> list[str]:
-    words = text.split()
-    if not words:
-        return []
-
-    chunks: list[str] = []
-    for idx in range(0, len(words), chunk_size_words):
-        chunks.append(" ".join(words[idx : idx + chunk_size_words]))
-    return chunks
-
-
-def extract_text(path: Path) -> str:
-    suffix = path.suffix.lower()
-    if suffix in {".txt", ".md", ".log"}:
-        return path.read_text(encoding="utf-8", errors="ignore")
-    if suffix == ".pdf":
-        reader = PdfReader(str(path))
-        return "\n".join((page.extract_text() or "") for page in reader.pages)
-    return ""
+from assistant.prompt_budget import estimate_tokens  # noqa: E402
+from assistant.rag.chunking import (  # noqa: E402
+    CountFn,
+    chunk_file,
+    chunking_signature,
+    embedding_token_counter,
+    file_digest,
+)
+from assistant.rag.store import (  # noqa: E402
+    DEFAULT_COLLECTION,
+    IngestStats,
+    RagStore,
+    content_hash,
+)
+
+
+_count_tokens: CountFn = estimate_tokens
+
+
+def init_worker(model_name: str, onnx_dir: Path | None) -> None:
+    """Load the embedding tokenizer once per extraction process."""
+    global _count_tokens
+    _count_tokens = embedding_token_counter(model_name, onnx_dir)
+
+
+def extract_chunks(
+    path: Path, known_hash: str, max_tokens: int, overlap_tokens: int
+) -> tuple[Path, str, list[str] | None, str]:
+    """Worker: hash, extract and chunk one file.
+
+    Returns ``(path, file_hash, chunks, error)``; *chunks* is None when the
+    file is unchanged since *known_hash* and was not parsed.  The hash covers
+    the chunking settings too, so changing them re-chunks every file.
+    """
+    try:
+        file_hash = content_hash(
+            f"{file_digest(path)}:{chunking_signature(max_tokens, overlap_tokens)}"
+        )
+        if file_hash == known_hash:
+            return path, file_hash, None, ""
+        chunks = list(chunk_file(path, _count_tokens, max_tokens, overlap_tokens))
+        return path, file_hash, chunks, ""
+    except Exception as exc:  # noqa: BLE001
+        return path, "", [], str(exc)
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Ingest docs into local RAG store")
     parser.add_argument("docs_path", type=Path, help="File or directory to ingest")
     parser.add_argument("--source", default="local_docs", help="Source label")
-    parser.add_argument("--chunk-size", type=int, default=500, help="Chunk size in words")
+    parser.add_argument(
+        "--collection",
+        default=DEFAULT_COLLECTION,
+        help="Knowledge base to ingest into (e.g. shared, user:<user_id>)",
+    )
+    parser.add_argument(
+        "--chunk-tokens",
+        type=int,
+        default=settings.rag_chunk_tokens,
+        help="Max embedding-model tokens per chunk (keep below the model's 256-token limit)",
+    )
+    parser.add_argument(
+        "--overlap-tokens",
+        type=int,
+        default=settings.rag_chunk_overlap_tokens,
+        help="Tokens of trailing sentences repeated",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="Extraction processes"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=512, help="Chunks per index insert / SQLite transaction"
+    )
+    parser.add_argument(
+        "--embed-batch-size", type=int, default=32, help="Chunks per embedding forward pass"
+    )
+    parser.add_argument(
+        "--prune", action="store_true", help="Delete sources whose file no longer exists"
+    )
     args = parser.parse_args()
 
-    store = RagStore(settings.rag_data_dir, settings.embedding_model)
+    store = RagStore.from_settings(settings)
 
     candidates: list[Path]
     if args.docs_path.is_dir():
+        base = args.docs_path
         candidates = [p for p in args.docs_path.rglob("*") if p.is_file()]
     else:
+        base = args.docs_path.parent
         candidates = [args.docs_path]
 
-    total_chunks = 0
-    for file_path in candidates:
-        text = extract_text(file_path)
-        if not text.strip():
-            continue
-        chunks = chunk_text(text, chunk_size_words=args.chunk_size)
-        added = store.add_chunks(source=f"{args.source}:{file_path.name}", chunks=chunks)
-        total_chunks += added
-        print(f"Ingested {added} chunks from {file_path}")
-
-    print(f"Done. Total chunks added: {total_chunks}")
+    def source_of(path: Path) -> str:
+        return f"{args.source}:{path.relative_to(base).as_posix()}"
+
+    known = store.file_hashes(args.collection)
+
+    total_bytes = sum(path.stat().st_size for path in candidates)
+    print(
+        f"Found {len(candidates)} files ({total_bytes / 1e6:.1f} MB) for collection "
+        f"{args.collection!r}, {args.workers} workers"
+    )
+
+    started = time.monotonic()
+    batch: list[tuple[str, str, list[str]]] = []
+    batch_chunks = 0
+    files_done = 0
+    bytes_done = 0
+    totals = IngestStats()
+
+    def flush() -> None:
+        nonlocal batch_chunks
+        if not batch:
+            return
+        stats = store.add_documents(
+            batch, batch_size=args.embed_batch_size, collection=args.collection
+        )
+        totals.chunks_added += stats.chunks_added
+        totals.chunks_kept += stats.chunks_kept
+        totals.chunks_deleted += stats.chunks_deleted
+        batch.clear()
+        batch_chunks = 0
+        elapsed = max(time.monotonic() - started, 1e-9)
+        print(
+            f"[{files_done}/{len(candidates)} files] {totals.chunks_added} chunks embedded — "
+            f"{totals.chunks_added / elapsed:.1f} chunks/s, {bytes_done / 1e6 / elapsed:.2f} MB/s"
+        )
+
+    # Keep a bounded number of files in flight so extracted text does not pile
+    # up in memory while the main process is busy embedding.
+    max_in_flight = max(1, args.workers) * 4
+    pending_paths = iter(candidates)
+    in_flight: set[Future] = set()
+
+    with ProcessPoolExecutor(
+        max_workers=max(1, args.workers),
+        initializer=init_worker,
+        initargs=(settings.embedding_model, settings.embedding_onnx_dir),
+    ) as pool:
+        while True:
+            for path in pending_paths:
+                in_flight.add(
+                    pool.submit(
+                        extract_chunks,
+                        path,
+                        known.get(source_of(path), ""),
+                        args.chunk_tokens,
+                        args.overlap_tokens,
+                    )
+                )
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                break
+
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, file_hash, chunks, error = future.result()
+                files_done += 1
+                bytes_done += path.stat().st_size
+                if error:
+                    print(f"  skipped {path}: {error}")
+                    continue
+                if chunks is None:
+                    totals.files_skipped += 1
+                    continue
+                batch.append((source_of(path), file_hash, chunks))
+                batch_chunks += len(chunks)
+            if batch_chunks >= args.batch_size:
+                flush()
+        flush()
+
+    if args.prune:
+        present = {source_of(path) for path in candidates}
+        for source in sorted(known):
+            if source.startswith(f"{args.source}:") and source not in present:
+                deleted = store.delete_source(source, args.collection)
+                totals.chunks_deleted += deleted
+                print(f"  pruned {source} ({deleted} chunks)")
+
+    # One full snapshot at the end instead of one per file
+    store.checkpoint()
+    elapsed = time.monotonic() - started
+    print(
+        f"Done in {elapsed:.1f}s: {totals.chunks_added} chunks embedded, "
+        f"{totals.chunks_kept} unchanged, {totals.chunks_deleted} deleted; "
+        f"{totals.files_skipped} of {files_done} files unchanged"
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,169 @@
+"""Maintain the RAG vector index without re-embedding anything.
+
+Every embedding is also kept, as float32 by label, in ``vectors.raw.npy``
+next to the index, so the index itself can be rebuilt from that sidecar.
+The embedder is never loaded.
+
+Subcommands:
+
+* ``compact`` — rebuild from live chunks only and renumber labels densely,
+  reclaiming the slots of deleted chunks (HNSW keeps deleted nodes in its
+  graph, and label-indexed files keep their rows).
+* ``rebuild`` — rebuild with new HNSW parameters (``--M``,
+  ``--ef-construction``); add ``--compact`` to renumber as well.  The new
+  parameters are recorded in ``index_meta.json``.
+* ``verify`` — cross-check SQLite (chunks, files, FTS), the index and the
+  sidecar; exits 1 if anything disagrees.
+* ``stats`` — file sizes, slot usage, collections, and recall@k of the index
+  against exact search over the sidecar.
+* ``tune`` — sweep HNSW ``ef`` and keep the smallest value reaching the
+  recall target (the store also does this by itself on start and growth).
+
+Stop the API and any ingest run first: ``compact`` and ``rebuild`` replace
+the index and SQLite files underneath them.
+
+Usage (from agentic_assistant/):
+    python scripts/maintain_index.py stats
+    python scripts/maintain_index.py verify
+    python scripts/maintain_index.py tune --target 0.98 --k 20
+    python scripts/maintain_index.py compact
+    python scripts/maintain_index.py rebuild --M 32 --ef-construction 200
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parents[1]
+_SRC = _ROOT / "src"
+if str(_SRC) not in sys.path:
+    sys.path.insert(0, str(_SRC))
+
+from assistant.config import settings  # noqa: E402
+from assistant.rag.embedders import NullEmbedder  # noqa: E402
+from assistant.rag.store import RagStore  # noqa: E402
+
+
+def open_store() -> RagStore:
+    """Open the configured store with the dimension from ``index_meta.json``, no model."""
+    meta_path = settings.rag_data_dir / "index_meta.json"
+    if not meta_path.exists():
+        raise SystemExit(f"No index in {settings.rag_data_dir} (missing {meta_path.name}).")
+    with meta_path.open("r", encoding="utf-8") as handle:
+        dimension = int(json.load(handle)["dimension"])
+    return RagStore.from_settings(settings, embedder=NullEmbedder(dimension))
+
+
+def _size(path: Path) -> str:
+    return f"{path.stat().st_size / 1e6:.1f} MB"
+
+
+def cmd_stats(store: RagStore, args: argparse.Namespace) -> int:
+    index = store.index
+    print(f"Data dir: {store.data_dir}")
+    for path in sorted(store.data_dir.iterdir()):
+        if path.is_file():
+            print(f"  {path.name:<24}{_size(path):>12}")
+    live = len(store.live_labels())
+    slots = index.count()
+    print(f"Backend:  {index.name} {json.dumps(index.params())}")
+    print(f"Chunks:   {live} live, {store.free_label_count()} deleted labels awaiting reuse")
+    print(f"Index:    {slots} slots in use of {index.capacity()} allocated")
+    for name, size in store.collection_sizes().items():
+        print(f"  collection {name:<28}{size:>8}")
+    if store.ef_tuning:
+        tuned = store.ef_tuning
+        print(
+            f"ef tuned: {tuned['ef']} for recall@{tuned['k']} {tuned['recall']} "
+            f"(target {tuned['target']}) at {tuned['live']} chunks, {tuned['tuned_at']}"
+        )
+    measured = store.measure_recall(args.k, args.queries) if args.queries > 0 else None
+    if measured is not None:
+        print(
+            f"Recall@{args.k}: {measured['recall']:.4f} over {measured['samples']} held-out "
+            f"queries ({measured['ms_per_query']:.2f} ms/query)"
+        )
+    return 0
+
+
+def cmd_tune(store: RagStore, args: argparse.Namespace) -> int:
+    result = store.tune_ef(target=args.target, k=args.k, samples=args.samples)
+    if result is None:
+        print(f"Nothing to tune ({store.index.name} backend, or too few chunks).")
+        return 0
+    print(f"{'ef':>6}{'recall':>10}{'ms/query':>10}")
+    for row in result["sweep"]:
+        print(f"{row['ef']:>6}{row['recall']:>10.4f}{row['ms_per_query']:>10.3f}")
+    print(f"ef = {result['ef']} (target recall@{result['k']} {result['target']}), saved to index_meta.json")
+    if (args.target, args.k) != (store.target_recall, store.tune_k):
+        print(
+            "Note: the server re-tunes on start unless RAG_HNSW_TARGET_RECALL / RAG_HNSW_TUNE_K "
+            "match these values."
+        )
+    return 0
+
+
+def cmd_verify(store: RagStore, args: argparse.Namespace) -> int:
+    problems = store.verify(sample=args.sample)
+    for problem in problems:
+        print(f"  PROBLEM: {problem}")
+    print("OK" if not problems else f"{len(problems)} problem(s) found")
+    return 1 if problems else 0
+
+
+def cmd_rebuild(store: RagStore, args: argparse.Namespace) -> int:
+    params = {}
+    if getattr(args, "M", None) is not None:
+        params["M"] = args.M
+    if getattr(args, "ef_construction", None) is not None:
+        params["ef_construction"] = args.ef_construction
+    if params and store.index.name != "hnsw":
+        print(f"Note: {store.index.name} backend ignores {', '.join(params)}")
+    started = time.monotonic()
+    report = store.rebuild_index(compact=args.compact, **params)
+    before, after = report["before"], report["after"]
+    print(
+        f"Rebuilt in {time.monotonic() - started:.1f}s: {report['live']} live chunks; "
+        f"slots {before['slots']} -> {after['slots']}, "
+        f"capacity {before['capacity']} -> {after['capacity']}; {json.dumps(after['params'])}"
+    )
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="RAG index maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    stats = commands.add_parser("stats", help="Sizes, slot usage and recall@k")
+    stats.add_argument("--queries", type=int, default=200, help="Recall sample size (0 to skip)")
+    stats.add_argument("--k", type=int, default=10, help="Neighbours per recall query")
+    stats.set_defaults(handler=cmd_stats)
+
+    verify = commands.add_parser("verify", help="Check SQLite, index and sidecar agree")
+    verify.add_argument("--sample", type=int, default=1000, help="Vectors compared with the sidecar")
+    verify.set_defaults(handler=cmd_verify)
+
+    tune = commands.add_parser("tune", help="Pick the smallest HNSW ef meeting a recall target")
+    tune.add_argument("--target", type=float, default=settings.rag_hnsw_target_recall)
+    tune.add_argument("--k", type=int, default=settings.rag_hnsw_tune_k, help="Recall@k")
+    tune.add_argument("--samples", type=int, default=200, help="Held-out query vectors")
+    tune.set_defaults(handler=cmd_tune)
+
+    compact = commands.add_parser("compact", help="Drop deleted slots and renumber labels")
+    compact.set_defaults(handler=cmd_rebuild, compact=True)
+
+    rebuild = commands.add_parser("rebuild", help="Rebuild with new HNSW parameters")
+    rebuild.add_argument("--M", type=int, help="HNSW links per node (default: keep)")
+    rebuild.add_argument("--ef-construction", type=int, help="HNSW build beam width (default: keep)")
+    rebuild.add_argument("--compact", action="store_true", help="Also renumber labels densely")
+    rebuild.set_defaults(handler=cmd_rebuild)
+
+    args = parser.parse_args()
+    raise SystemExit(args.handler(open_store(), args))
+
+
+if __name__ == "__main__":
+    main()
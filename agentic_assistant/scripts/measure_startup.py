@@ -0,0 +1,113 @@
+"""Measure API start-up: process spawn → first /health byte, and → RAG ready.
+
+Starts Uvicorn as a child process once with ``RAG_BACKGROUND_LOAD=false``
+(the old behaviour: the embedder and index load before the port is bound)
+and once with background loading, polling ``/health`` every few
+milliseconds.  Reported per mode:
+
+* **first byte** — spawn until ``/health`` first answers;
+* **RAG ready** — spawn until ``/health`` reports ``rag.state`` ``ready``
+  (or ``failed``).
+
+Polling bots are disabled (``BOT_MODE=webhook``) so they do not skew the run.
+
+Usage (from agentic_assistant/):
+    python scripts/measure_startup.py
+    python scripts/measure_startup.py --runs 3 --port 8765
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+_ROOT = Path(__file__).resolve().parents[1]
+_SRC = _ROOT / "src"
+
+
+def measure(port: int, background: bool, timeout: float) -> tuple[float | None, float | None, str]:
+    """One cold start; returns (first byte s, RAG ready s, final RAG state)."""
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join([str(_SRC), os.environ.get("PYTHONPATH", "")]),
+        "RAG_BACKGROUND_LOAD": "true" if background else "false",
+        "BOT_MODE": "webhook",
+    }
+    command = [
+        sys.executable, "-m", "uvicorn", "assistant.api:app",
+        "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+    ]
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=_ROOT, env=env)
+    first_byte: float | None = None
+    ready: float | None = None
+    state = "unknown"
+    try:
+        with httpx.Client(timeout=2.0) as client:
+            while time.perf_counter() - started < timeout:
+                if process.poll() is not None:
+                    state = f"exited ({process.returncode})"
+                    break
+                try:
+                    body = client.get(f"http://127.0.0.1:{port}/health").json()
+                except httpx.HTTPError:
+                    time.sleep(0.02)
+                    continue
+                now = time.perf_counter() - started
+                if first_byte is None:
+                    first_byte = now
+                state = body.get("rag", {}).get("state", "ready")
+                if state in ("ready", "failed"):
+                    ready = now
+                    break
+                time.sleep(0.02)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return first_byte, ready, state
+
+
+def _fmt(values: list[float | None]) -> str:
+    known = [value for value in values if value is not None]
+    if not known:
+        return "—"
+    return f"{statistics.median(known):.2f}s"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure API import-to-first-byte time")
+    parser.add_argument("--runs", type=int, default=1, help="Cold starts per mode (median reported)")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the child server")
+    parser.add_argument("--timeout", type=float, default=180.0, help="Seconds to wait per start")
+    args = parser.parse_args()
+
+    rows = []
+    for label, background in (("blocking", False), ("background", True)):
+        first_bytes: list[float | None] = []
+        readies: list[float | None] = []
+        states: list[str] = []
+        for run in range(args.runs):
+            print(f"[{label}] start {run + 1}/{args.runs} ...", flush=True)
+            first_byte, ready, state = measure(args.port, background, args.timeout)
+            first_bytes.append(first_byte)
+            readies.append(ready)
+            states.append(state)
+        rows.append((label, _fmt(first_bytes), _fmt(readies), ",".join(sorted(set(states)))))
+
+    print()
+    print(f"{'mode':<12}{'first byte':>12}{'RAG ready':>12}  rag state")
+    for label, first_byte, ready, state in rows:
+        print(f"{label:<12}{first_byte:>12}{ready:>12}  {state}")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,8 @@ from __future__ import annotations
 
 import json
 import sys
+import tempfile
+import types
 import unittest.mock
 from dataclasses import asdict, dataclass
 from pathlib import Path
@@ -36,7 +38,64 @@ for _mod in (
     if _mod not in sys.modules:
         sys.modules[_mod] = unittest.mock.MagicMock()  # type: ignore[assignment]
 
+
+class _FakeLlamaModel:
+    """``llama_cpp.Llama`` stand-in: one token per word, fixed ids for the route labels.
+
+    Like llama-cpp-python 0.3.x built without ``logits_all``, ``eval`` leaves
+    ``scores`` zeroed; the last position's logits are only available through
+    ``llama_get_logits_ith`` (set by the tests in ``_FAKE_LOGITS``).
+    """
+
+    LABEL_IDS = {"LOCAL": 1, "GROQ": 2, "GEMINI": 3, "KIMI": 4}
+    VOCAB = 8
+
+    def __init__(self, **kwargs: Any) -> None:
+        self.ctx = object()
+        self.n_tokens = 0
+        self.scores = [[0.0] * self.VOCAB for _ in range(kwargs.get("n_ctx", 512))]
+
+    def tokenize(self, text: bytes, add_bos: bool = False, special: bool = False) -> list[int]:
+        words = text.decode("utf-8").split()
+        return ([0] if add_bos else []) + [self.LABEL_IDS.get(word, 5) for word in words]
+
+    def reset(self) -> None:
+        self.n_tokens = 0
+
+    def eval(self, tokens: list[int]) -> None:
+        self.n_tokens += len(tokens)
+
+    def set_cache(self, cache: Any) -> None:
+        pass
+
+    def create_completion(self, prompt: str, **kwargs: Any):
+        yield {"choices": [{"text": "INPROCESS_RESPONSE"}]}
+
+
+# label → logit of the last evaluated position; every other token gets 0
+_FAKE_LOGITS: dict[str, float] = {}
+
+
+def _fake_logits_ith(ctx: Any, index: int) -> list[float]:
+    row = [0.0] * _FakeLlamaModel.VOCAB
+    for label, value in _FAKE_LOGITS.items():
+        row[_FakeLlamaModel.LABEL_IDS[label]] = value
+    return row
+
+
+sys.modules["llama_cpp"] = types.SimpleNamespace(  # type: ignore[assignment]
+    Llama=_FakeLlamaModel,
+    llama_get_logits_ith=_fake_logits_ith,
+    LlamaRAMCache=lambda **kwargs: None,
+    StoppingCriteriaList=list,
+)
+
+from assistant.llm.llama_inprocess import LlamaInProcessRunner  # noqa: E402
+from assistant.memory import ConversationMemory  # noqa: E402
 from assistant.orchestrator import AgentOrchestrator  # noqa: E402
+from assistant.rag.lazy import RagWarmingError  # noqa: E402
+from assistant.rag.store import looks_like_keywords  # noqa: E402
+from assistant.response_cache import ResponseCache  # noqa: E402
 
 
 # ---------------------------------------------------------------------------
@@ -46,29 +105,103 @@ from assistant.orchestrator import AgentOrchestrator  # noqa: E402
 class FakeRag:
     """Returns a result only for messages that contain 'doc' or 'source'."""
 
-    def query(self, text: str, top_k: int = 3) -> list[dict]:
+    generation = 0
+
+    def __init__(self, content: str = "retrieved context") -> None:
+        self.content = content
+        self.last_collections: list[str] | None = None
+        self.last_vector: Any = None
+        self.embed_calls = 0
+
+    def embed(self, text: str) -> list[float]:
+        self.embed_calls += 1
+        return [float(len(text))]
+
+    def prefers_lexical(self, text: str) -> bool:
+        return looks_like_keywords(text)
+
+    def collection_size(self, collection: str) -> int:
+        return 0
+
+    def query(
+        self, text: str, top_k: int = 3, vector: Any = None, collections: Any = None
+    ) -> list[dict]:
+        self.last_collections = list(collections) if collections is not None else None
+        self.last_vector = vector
         if "doc" in text.lower() or "source" in text.lower():
-            return [{"source": "kb", "chunk_index": 0, "content": "retrieved context"}]
+            return [{"source": "kb", "chunk_index": 0, "content": self.content}]
         return []
 
 
+class WarmingRag(FakeRag):
+    """A RAG store that is still loading its embedder and index."""
+
+    generation = -1
+
+    def embed(self, text: str) -> list[float]:
+        raise RagWarmingError("RAG store is still loading")
+
+    def query(self, *args: Any, **kwargs: Any) -> list[dict]:
+        raise RagWarmingError("RAG store is still loading")
+
+
 class FakeLlama:
     """Mimics LlamaCppRunner without spawning a subprocess."""
 
     def __init__(self) -> None:
         self.calls: list[str] = []
 
-    def generate(self, prompt: str, max_tokens_override: int | None = None) -> str:
+    def generate(
+        self, prompt: str, max_tokens_override: int | None = None, cache_key: Any = None
+    ) -> str:
         self.calls.append(prompt)
         # New prompt format uses 'Retrieved knowledge:' for RAG context
         if "Retrieved knowledge:" in prompt:
             return "LOCAL_RAG_RESPONSE"
         return "LOCAL_SIMPLE_RESPONSE"
 
+    def generate_stream(
+        self, prompt: str, max_tokens_override: int | None = None, cache_key: Any = None
+    ):
+        text = self.generate(prompt, max_tokens_override)
+        # Emit in small pieces to exercise delta re-assembly
+        for idx in range(0, len(text), 5):
+            yield text[idx : idx + 5]
+
+    def count_tokens(self, text: str) -> int:
+        """One token per whitespace-separated word."""
+        return len(text.split())
+
     def classify(self, prompt: str) -> str:
         """Always returns LOCAL (tests use use_llm_routing=False anyway)."""
         return "LOCAL"
 
+    def classify_labels(self, prompt: str, labels: Any) -> dict[str, float]:
+        """Confident GROQ for 'why' questions, an uncertain split otherwise."""
+        if "why" in prompt.lower():
+            return {"LOCAL": 0.05, "GROQ": 0.9, "GEMINI": 0.03, "KIMI": 0.02}
+        return {"LOCAL": 0.3, "GROQ": 0.35, "GEMINI": 0.2, "KIMI": 0.15}
+
+
+class FakeResponseCache:
+    """Exact-vector stand-in for ResponseCache (numpy is mocked out here)."""
+
+    def __init__(self) -> None:
+        self.entries: dict[tuple, str] = {}
+
+    def lookup(self, vector: Any, route: str, generation: int) -> str | None:
+        return self.entries.get((tuple(vector), route, generation))
+
+    def store(self, vector: Any, route: str, generation: int, response: str) -> None:
+        self.entries[(tuple(vector), route, generation)] = response
+
+
+class FakeEmbeddingRouter:
+    """Confident about one known message (KIMI), unsure about everything else."""
+
+    def classify(self, vector: Any) -> tuple[str, float]:
+        return ("KIMI", 0.9) if vector and vector[0] == len("grow tomatoes on a balcony") else ("GROQ", 0.4)
+
 
 class FakeCloud:
     """Mimics CloudRouter, with optional failure injection per provider."""
@@ -205,6 +338,244 @@ def run() -> tuple[bool, list[CaseResult]]:
         )
     )
 
+    # Tier 3: constrained classifier with confidence threshold
+    llm_orch = AgentOrchestrator(
+        rag=cast(Any, FakeRag()),
+        llm=cast(Any, FakeLlama()),
+        cloud=cloud,
+        memory=None,
+        top_k=3,
+        long_context_threshold_chars=120,
+        short_message_threshold_chars=10,
+        use_llm_routing=True,
+        llm_routing_min_confidence=0.6,
+    )
+    classifier_cases = [
+        ("llm_confident", "why is the sky blue at noon", "groq", "llm_classifier", "GROQ_RESPONSE"),
+        ("llm_low_confidence", "tell me about the moon", "local_simple", "llm_classifier_local", "LOCAL_SIMPLE_RESPONSE"),
+    ]
+    for name, message, exp_route, exp_reason, exp_resp in classifier_cases:
+        out = llm_orch.respond_with_route(message, user_id="test")
+        ok = out.route == exp_route and out.reason == exp_reason and out.response == exp_resp
+        all_ok = all_ok and ok
+        results.append(
+            CaseResult(name=name, route=out.route, reason=out.reason, response=out.response, ok=ok)
+        )
+
+    # In-process engine: label probabilities follow the last position's logits
+    model_file = tempfile.NamedTemporaryFile(suffix=".gguf", delete=False)
+    model_file.close()
+    inprocess = LlamaInProcessRunner(model_path=Path(model_file.name))
+    labels = ("LOCAL", "GROQ", "GEMINI", "KIMI")
+    for favoured in ("GROQ", "KIMI"):
+        _FAKE_LOGITS.clear()
+        _FAKE_LOGITS[favoured] = 3.0
+        probabilities = inprocess.classify_labels("route this message", labels)
+        best = max(probabilities, key=probabilities.__getitem__)
+        ok = best == favoured and probabilities[best] > 0.8 and abs(sum(probabilities.values()) - 1) < 1e-6
+        all_ok = all_ok and ok
+        results.append(
+            CaseResult(
+                name=f"inprocess_logits_{favoured.lower()}",
+                route=best,
+                reason=json.dumps({label: round(p, 3) for label, p in probabilities.items()}),
+                response="",
+                ok=ok,
+            )
+        )
+
+    # The constrained classifier routes through the in-process engine's interface
+    inprocess_orch = AgentOrchestrator(
+        rag=cast(Any, FakeRag()),
+        llm=cast(Any, inprocess),
+        cloud=cloud,
+        memory=None,
+        short_message_threshold_chars=10,
+        use_llm_routing=True,
+        llm_routing_min_confidence=0.5,
+    )
+    inprocess_cases = [
+        ("inprocess_route_groq", {"GROQ": 4.0}, "groq", "llm_classifier", "GROQ_RESPONSE"),
+        ("inprocess_route_gemini", {"GEMINI": 4.0}, "gemini", "llm_classifier", "GEMINI_RESPONSE"),
+        ("inprocess_route_local", {"LOCAL": 4.0}, "local_simple", "llm_classifier_local", "INPROCESS_RESPONSE"),
+        ("inprocess_route_unsure", {"GROQ": 0.5, "KIMI": 0.5}, "local_simple", "llm_classifier_local", "INPROCESS_RESPONSE"),
+    ]
+    for name, logits, exp_route, exp_reason, exp_resp in inprocess_cases:
+        _FAKE_LOGITS.clear()
+        _FAKE_LOGITS.update(logits)
+        out = inprocess_orch.respond_with_route("tell me about the moon", user_id="test")
+        ok = out.route == exp_route and out.reason == exp_reason and out.response == exp_resp
+        all_ok = all_ok and ok
+        results.append(
+            CaseResult(name=name, route=out.route, reason=out.reason, response=out.response, ok=ok)
+        )
+    Path(model_file.name).unlink()
+
+    # Tier 3a: embedding router short-circuits the classifier when confident
+    router_orch = AgentOrchestrator(
+        rag=cast(Any, FakeRag()),
+        llm=cast(Any, FakeLlama()),
+        cloud=cloud,
+        memory=None,
+        short_message_threshold_chars=10,
+        use_llm_routing=True,
+        llm_routing_min_confidence=0.6,
+        embedding_router=cast(Any, FakeEmbeddingRouter()),
+        embedding_router_min_confidence=0.6,
+    )
+    router_cases = [
+        ("router_confident", "Grow tomatoes on a balcony?", "kimi", "embedding_router", "KIMI_RESPONSE"),
+        ("router_unsure", "why is the sky blue at noon", "groq", "llm_classifier", "GROQ_RESPONSE"),
+    ]
+    for name, message, exp_route, exp_reason, exp_resp in router_cases:
+        out = router_orch.respond_with_route(message, user_id="test")
+        ok = out.route == exp_route and out.reason == exp_reason and out.response == exp_resp
+        all_ok = all_ok and ok
+        results.append(
+            CaseResult(name=name, route=out.route, reason=out.reason, response=out.response, ok=ok)
+        )
+
+    # Token budget: a 600-word chunk is trimmed to fit a 200-token window
+    budget_llm = FakeLlama()
+    budget_orch = AgentOrchestrator(
+        rag=cast(Any, FakeRag(content=" ".join(["word"] * 600))),
+        llm=cast(Any, budget_llm),
+        cloud=cloud,
+        memory=None,
+        short_message_threshold_chars=10,
+        use_llm_routing=False,
+        local_context_tokens=200,
+        local_reserved_tokens=50,
+    )
+    out = budget_orch.respond_with_route("look up the docs on this", user_id="test")
+    prompt_tokens = budget_llm.count_tokens(budget_llm.calls[-1])
+    ok = out.route == "local_rag" and out.response == "LOCAL_RAG_RESPONSE" and prompt_tokens <= 150
+    all_ok = all_ok and ok
+    results.append(
+        CaseResult(
+            name="token_budget",
+            route=out.route,
+            reason=f"{out.reason} ({prompt_tokens} prompt tokens)",
+            response=out.response,
+            ok=ok,
+        )
+    )
+
+    # Retrieval is scoped to the shared collections plus the user's own
+    scoped_rag = FakeRag()
+    scoped_orch = AgentOrchestrator(
+        rag=cast(Any, scoped_rag),
+        llm=cast(Any, FakeLlama()),
+        cloud=cloud,
+        memory=None,
+        short_message_threshold_chars=10,
+        use_llm_routing=False,
+        rag_collections=["shared", "handbook"],
+    )
+    out = scoped_orch.respond_with_route("check the docs for this", user_id="tg:42")
+    ok = out.route == "local_rag" and scoped_rag.last_collections == [
+        "shared", "handbook", "user:tg:42",
+    ]
+    all_ok = all_ok and ok
+    results.append(
+        CaseResult(
+            name="collection_scope",
+            route=out.route,
+            reason=f"{out.reason} {scoped_rag.last_collections}",
+            response=out.response,
+            ok=ok,
+        )
+    )
+
+    # RAG still loading: answer without retrieved context instead of blocking
+    warming_orch = AgentOrchestrator(
+        rag=cast(Any, WarmingRag()),
+        llm=cast(Any, FakeLlama()),
+        cloud=cloud,
+        memory=None,
+        short_message_threshold_chars=10,
+        use_llm_routing=False,
+        response_cache=ResponseCache(),
+    )
+    out = warming_orch.respond_with_route("based on source docs, explain this", user_id="test")
+    ok = out.route == "local_rag" and out.response == "LOCAL_SIMPLE_RESPONSE"
+    all_ok = all_ok and ok
+    results.append(
+        CaseResult(name="rag_warming", route=out.route, reason=out.reason, response=out.response, ok=ok)
+    )
+
+    # Identifier-style queries go to BM25 without an embedding, even with the response cache on
+    keyword_rag = FakeRag()
+    keyword_orch = AgentOrchestrator(
+        rag=cast(Any, keyword_rag),
+        llm=cast(Any, FakeLlama()),
+        cloud=cloud,
+        memory=None,
+        short_message_threshold_chars=10,
+        use_llm_routing=False,
+        response_cache=ResponseCache(),
+    )
+    for name, message, expected_embeds in (
+        ("keyword_skips_embedder", "LLAMA_MAIN_PATH source", 0),
+        ("prose_uses_embedder", "where does the source doc say the model lives", 1),
+    ):
+        keyword_rag.embed_calls = 0
+        out = keyword_orch.respond_with_route(message, user_id="test")
+        ok = keyword_rag.embed_calls == expected_embeds and (
+            keyword_rag.last_vector is None if expected_embeds == 0 else keyword_rag.last_vector is not None
+        )
+        all_ok = all_ok and ok
+        results.append(
+            CaseResult(
+                name=name,
+                route=out.route,
+                reason=f"{out.reason} ({keyword_rag.embed_calls} embed calls)",
+                response=out.response,
+                ok=ok,
+            )
+        )
+
+    # Shared replies are keyed by the message alone: a user with earlier turns
+    # neither gets another user's cached answer nor seeds the cache
+    with tempfile.TemporaryDirectory() as memory_dir:
+        history_orch = AgentOrchestrator(
+            rag=cast(Any, FakeRag()),
+            llm=cast(Any, FakeLlama()),
+            cloud=cloud,
+            memory=ConversationMemory(Path(memory_dir)),
+            short_message_threshold_chars=10,
+            use_llm_routing=False,
+            response_cache=cast(Any, FakeResponseCache()),
+        )
+        question = "what is the capital of france"
+        history_cases = [
+            ("cache_history_seeds", "alice", "local_simple"),
+            ("cache_history_fresh_hit", "carol", "cache_hit"),
+            ("cache_history_skips", "alice", "local_simple"),
+        ]
+        for name, user_id, exp_route in history_cases:
+            out = history_orch.respond_with_route(question, user_id=user_id)
+            ok = out.route == exp_route and out.response == "LOCAL_SIMPLE_RESPONSE"
+            all_ok = all_ok and ok
+            results.append(
+                CaseResult(name=name, route=out.route, reason=out.reason, response=out.response, ok=ok)
+            )
+
+    # Streaming counterpart: same routing decision, reply delivered as deltas
+    stream_cases = [
+        ("stream_local", orchestrator, "hi", "local_simple", "short_message", "LOCAL_SIMPLE_RESPONSE"),
+        ("stream_cloud", orchestrator, "analyze tradeoff between A and B", "groq", "kw_reasoning", "GROQ_RESPONSE"),
+        ("stream_fallback", fallback_orch, "analyze this deeply", "local_fallback", "groq_unavailable", "LOCAL_SIMPLE_RESPONSE"),
+    ]
+    for name, orch, message, exp_route, exp_reason, exp_resp in stream_cases:
+        stream = orch.respond_with_route_stream(message, user_id="test")
+        text = "".join(stream.chunks)
+        ok = stream.route == exp_route and stream.reason == exp_reason and text == exp_resp
+        all_ok = all_ok and ok
+        results.append(
+            CaseResult(name=name, route=stream.route, reason=stream.reason, response=text, ok=ok)
+        )
+
     return all_ok, results
 
 
@@ -0,0 +1,107 @@
+"""Chunker unit tests: sentence and heading boundaries, overlap, token limits.
+
+Runs offline.  Tokens are counted as whitespace-separated words, so every
+expected chunk can be worked out by hand.
+"""
+from __future__ import annotations
+
+import json
+import sys
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+# Support both `python scripts/test_chunking.py` (from project root)
+# and `PYTHONPATH=src python scripts/test_chunking.py`
+_ROOT = Path(__file__).resolve().parents[1]
+_SRC = _ROOT / "src"
+for _p in (_SRC, _ROOT):
+    if str(_p) not in sys.path:
+        sys.path.insert(0, str(_p))
+
+from assistant.rag.chunking import chunk_text, chunking_signature, iter_segments  # noqa: E402
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+# Six words each, numbered so their order can be checked
+SENTENCES = [f"Sentence{i} has six words in it." for i in range(1, 11)]
+
+
+@dataclass
+class CaseResult:
+    name: str
+    detail: str
+    ok: bool
+
+
+def run() -> tuple[bool, list[CaseResult]]:
+    results: list[CaseResult] = []
+    all_ok = True
+
+    def record(name: str, ok: bool, detail: object) -> None:
+        nonlocal all_ok
+        all_ok = all_ok and ok
+        results.append(CaseResult(name=name, detail=json.dumps(detail), ok=ok))
+
+    # Whole sentences only: three fit in 20 words, the fourth starts a new chunk
+    chunks = list(chunk_text(" ".join(SENTENCES), count_words, max_tokens=20, overlap_tokens=0))
+    expected = [" ".join(SENTENCES[i : i + 3]) for i in range(0, 10, 3)]
+    record("sentence_boundaries", chunks == expected, chunks)
+
+    # Overlap: the last sentence (6 words <= 6) is repeated at the start of the next chunk
+    chunks = list(chunk_text(" ".join(SENTENCES), count_words, max_tokens=20, overlap_tokens=6))
+    expected = [" ".join(SENTENCES[i : i + 3]) for i in range(0, 9, 2)]
+    ok = chunks == expected and all(count_words(chunk) <= 20 for chunk in chunks)
+    record("overlap", ok, chunks)
+
+    # A sentence never partially overlaps: 5 words of overlap budget keeps none of a 6-word one
+    chunks = list(chunk_text(" ".join(SENTENCES[:4]), count_words, max_tokens=20, overlap_tokens=5))
+    record("overlap_whole_sentences", chunks == [" ".join(SENTENCES[:3]), SENTENCES[3]], chunks)
+
+    # Headings start a chunk (without overlap) once the current one is half full
+    # (14 of 24 words before "## Details", only 8 before "## Tiny").
+    text = (
+        "# Intro\n\n" + " ".join(SENTENCES[:2]) + "\n\n"
+        "## Details\n\n" + SENTENCES[2] + "\n\n"
+        "## Tiny\n\n" + SENTENCES[3]
+    )
+    chunks = list(chunk_text(text, count_words, max_tokens=24, overlap_tokens=6))
+    expected = [
+        "# Intro " + " ".join(SENTENCES[:2]),
+        "## Details " + SENTENCES[2] + " ## Tiny " + SENTENCES[3],
+    ]
+    record("heading_boundaries", chunks == expected, chunks)
+
+    # A sentence split across read blocks (or PDF pages) is joined back together
+    segments = list(iter_segments(["First sentence is spl", "it across blocks. Second one."]))
+    expected_segments = [("First sentence is split across blocks.", False), ("Second one.", False)]
+    record("block_boundaries", segments == expected_segments, segments)
+
+    # A sentence longer than the limit is cut at word boundaries
+    long_sentence = " ".join(f"w{i}" for i in range(25)) + "."
+    chunks = list(chunk_text(long_sentence, count_words, max_tokens=10, overlap_tokens=0))
+    ok = [count_words(chunk) for chunk in chunks] == [10, 10, 5] and " ".join(chunks) == long_sentence
+    record("oversized_sentence", ok, chunks)
+
+    # Changing the limits changes the stored file hash, so files are re-chunked
+    signatures = {chunking_signature(240, 40), chunking_signature(200, 40), chunking_signature(240, 0)}
+    record("signature", len(signatures) == 3, sorted(signatures))
+
+    return all_ok, results
+
+
+def main() -> int:
+    ok, results = run()
+    print(
+        json.dumps(
+            {"ok": ok, "results": [asdict(item) for item in results]},
+            indent=2,
+        )
+    )
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,158 @@
+"""Prompt packing unit tests: what is kept, dropped or trimmed for a token budget.
+
+Runs offline.  Tokens are counted as whitespace-separated words, so each
+budget below can be followed by hand (history turns cost one token more than
+their words, RAG chunks two).
+"""
+from __future__ import annotations
+
+import json
+import sys
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+# Support both `python scripts/test_prompt_budget.py` (from project root)
+# and `PYTHONPATH=src python scripts/test_prompt_budget.py`
+_ROOT = Path(__file__).resolve().parents[1]
+_SRC = _ROOT / "src"
+for _p in (_SRC, _ROOT):
+    if str(_p) not in sys.path:
+        sys.path.insert(0, str(_p))
+
+from assistant.prompt_budget import PromptPacker, TokenCounter, estimate_tokens  # noqa: E402
+
+
+class WordCounter:
+    """Counts words, and how often it was asked."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def __call__(self, text: str) -> int:
+        self.calls += 1
+        return len(text.split())
+
+
+def words(prefix: str, n: int) -> str:
+    return " ".join(f"{prefix}{i}" for i in range(n))
+
+
+MESSAGE = words("m", 5)
+HISTORY = [words(f"h{turn}_", 10) for turn in range(1, 5)]  # oldest first
+
+
+@dataclass
+class CaseResult:
+    name: str
+    detail: str
+    ok: bool
+
+
+def run() -> tuple[bool, list[CaseResult]]:
+    results: list[CaseResult] = []
+    all_ok = True
+
+    def record(name: str, ok: bool, detail: object) -> None:
+        nonlocal all_ok
+        all_ok = all_ok and ok
+        results.append(CaseResult(name=name, detail=json.dumps(detail), ok=ok))
+
+    # Budget 80 - 1 (fixed) - 5 (message) = 74: the two newest turns (22),
+    # both chunks (44), then the third-newest turn no longer fits (11 > 8)
+    # and the oldest is dropped with it, never leaving a gap.
+    words_counted = WordCounter()
+    packer = PromptPacker(TokenCounter(words_counted), context_tokens=100, reserved_output_tokens=20)
+    chunks = [words("r1_", 20), words("r2_", 20)]
+    packed = packer.pack("SYS", MESSAGE, HISTORY, chunks)
+    ok = (
+        packed.message == MESSAGE
+        and packed.history == HISTORY[2:]
+        and packed.rag_chunks == chunks
+        and (packed.dropped_history, packed.dropped_chunks, packed.trimmed) == (2, 0, False)
+        and packed.tokens == 72
+    )
+    record("priority_order", ok, asdict(packed))
+
+    # Re-packing the same parts is served from the count cache
+    calls = words_counted.calls
+    again = packer.pack("SYS", MESSAGE, HISTORY, chunks)
+    record("counts_cached", again == packed and words_counted.calls == calls, words_counted.calls - calls)
+
+    # 20 more tokens of budget: the second chunk (52) no longer fits the 50
+    # left, so it is trimmed to a word-aligned prefix of at most 48 words.
+    packer = PromptPacker(TokenCounter(WordCounter()), context_tokens=120, reserved_output_tokens=20)
+    long_chunks = [words("r1_", 20), words("r2_", 50)]
+    packed = packer.pack("SYS", MESSAGE, HISTORY, long_chunks)
+    second = packed.rag_chunks[1] if len(packed.rag_chunks) == 2 else ""
+    ok = (
+        packed.rag_chunks[:1] == long_chunks[:1]
+        and 32 <= len(second.split()) <= 48
+        and long_chunks[1].startswith(second)
+        and packed.trimmed
+        and packed.history == HISTORY[2:]
+        and packed.tokens <= packer.prompt_budget
+    )
+    record("chunk_trimmed", ok, asdict(packed))
+
+    # A chunk that would be cut below the 32-token floor (28 left) is dropped
+    # instead, and the older turns use the room
+    packer = PromptPacker(TokenCounter(WordCounter()), context_tokens=100, reserved_output_tokens=20)
+    packed = packer.pack("SYS", MESSAGE, HISTORY, long_chunks)
+    ok = (
+        packed.rag_chunks == long_chunks[:1]
+        and packed.dropped_chunks == 1
+        and not packed.trimmed
+        and packed.history == HISTORY
+    )
+    record("chunk_dropped", ok, asdict(packed))
+
+    # The message alone overflowing the window is trimmed, and nothing else is kept
+    long_message = words("m", 200)
+    packed = packer.pack("SYS", long_message, HISTORY, chunks)
+    ok = (
+        packed.trimmed
+        and long_message.startswith(packed.message)
+        and 0 < len(packed.message.split()) <= 79
+        and packed.history == []
+        and packed.rag_chunks == []
+    )
+    record("message_trimmed", ok, {"message_words": len(packed.message.split()), "tokens": packed.tokens})
+
+    # Wrapper text is paid for once, and only when something it wraps is kept:
+    # 10 words of history wrapper leave 20 after the first chunk, too few for
+    # the second (22, and 18 is below the trim floor), enough for one more turn.
+    packer = PromptPacker(TokenCounter(WordCounter()), context_tokens=100, reserved_output_tokens=20)
+    overhead = words("wrap", 10)
+    with_overhead = packer.pack("SYS", MESSAGE, HISTORY, chunks, history_overhead=overhead)
+    ok = (
+        with_overhead.tokens == 71
+        and with_overhead.history == HISTORY[1:]
+        and with_overhead.rag_chunks == chunks[:1]
+    )
+    empty = packer.pack("SYS", MESSAGE, [], [], history_overhead=overhead, rag_overhead=overhead)
+    ok = ok and empty.tokens == 6
+    record("overhead_once", ok, {"with_history": with_overhead.tokens, "without": empty.tokens})
+
+    # Without a tokenizer the pessimistic character estimate is used
+    def broken(text: str) -> int:
+        raise RuntimeError("no tokenizer")
+
+    estimated = TokenCounter(broken).count("abcdefg")
+    record("estimate_fallback", estimated == estimate_tokens("abcdefg") == 2, estimated)
+
+    return all_ok, results
+
+
+def main() -> int:
+    ok, results = run()
+    print(
+        json.dumps(
+            {"ok": ok, "results": [asdict(item) for item in results]},
+            indent=2,
+        )
+    )
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
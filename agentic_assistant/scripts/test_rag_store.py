@@ -0,0 +1,310 @@
+"""RagStore unit tests on a real index with a fake embedder.
+
+Runs offline: embeddings are pseudo-random unit vectors seeded by a hash of
+the text, so a chunk's own text is its nearest neighbour and nothing else is
+close.  Needs numpy and hnswlib (requirements.txt), but no embedding model.
+The index cases run against both vector backends.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+# Support both `python scripts/test_rag_store.py` (from project root)
+# and `PYTHONPATH=src python scripts/test_rag_store.py`
+_ROOT = Path(__file__).resolve().parents[1]
+_SRC = _ROOT / "src"
+for _p in (_SRC, _ROOT):
+    if str(_p) not in sys.path:
+        sys.path.insert(0, str(_p))
+
+import numpy as np  # noqa: E402
+
+from assistant.rag.batcher import EmbeddingBatcher  # noqa: E402
+from assistant.rag.embedders import Embedder  # noqa: E402
+from assistant.rag.store import RagStore  # noqa: E402
+
+
+class FakeEmbedder(Embedder):
+    """Deterministic unit vectors seeded by the MD5 of each text."""
+
+    name = "fake"
+    dimension = 32
+
+    def encode(self, texts: list[str], batch_size: int = 32) -> Any:
+        rows = []
+        for text in texts:
+            seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+            row = np.random.default_rng(seed).normal(size=self.dimension).astype(np.float32)
+            rows.append(row / np.linalg.norm(row))
+        return np.stack(rows)
+
+
+@dataclass
+class CaseResult:
+    name: str
+    detail: str
+    ok: bool
+
+
+def _chunks(source: str, count: int) -> list[str]:
+    return [f"{source} chunk {index}" for index in range(count)]
+
+
+def _open(data_dir: Path, backend: str) -> RagStore:
+    # No automatic checkpoint: everything after the first open lives in the log
+    return RagStore(
+        data_dir,
+        "fake",
+        checkpoint_log_bytes=1 << 30,
+        collapse_adjacent=False,
+        vector_backend=backend,
+        embedder=FakeEmbedder(),
+    )
+
+
+def _top(store: RagStore, text: str, collections: list[str] | None = None) -> dict | None:
+    results = store.query(text, top_k=1, mode="vector", collections=collections)
+    return results[0] if results else None
+
+
+def run_backend(backend: str) -> tuple[bool, list[CaseResult]]:
+    results: list[CaseResult] = []
+    all_ok = True
+
+    def record(name: str, ok: bool, detail: Any) -> None:
+        nonlocal all_ok
+        all_ok = all_ok and ok
+        results.append(CaseResult(name=f"{backend}_{name}", detail=str(detail), ok=ok))
+
+    data_dir = Path(tempfile.mkdtemp(prefix="rag_store_test_"))
+    try:
+        store = _open(data_dir, backend)
+        documents = [(source, f"hash-{source}", _chunks(source, 5)) for source in ("a", "b", "c")]
+
+        # Add: every chunk is embedded once and is its own nearest neighbour
+        stats = store.add_documents(documents)
+        top = _top(store, "b chunk 3")
+        ok = stats.chunks_added == 15 and top is not None and top["content"] == "b chunk 3"
+        record("add", ok, asdict(stats))
+
+        # Re-add: an unchanged file hash skips the file; an edit embeds only the new chunk
+        stats = store.add_documents(documents)
+        ok = stats.files_skipped == 3 and stats.chunks_added == 0
+        edited = _chunks("a", 5)
+        edited[2] = "a chunk 2, edited"
+        edit_stats = store.add_documents([("a", "hash-a2", edited)])
+        ok = ok and (edit_stats.chunks_kept, edit_stats.chunks_added, edit_stats.chunks_deleted) == (4, 1, 1)
+        top = _top(store, "a chunk 2")
+        ok = ok and (top is None or top["content"] != "a chunk 2")
+        record("re_add_dedup", ok, {"unchanged": asdict(stats), "edited": asdict(edit_stats)})
+
+        # Delete: labels are freed, then handed to the next chunks instead of growing the index
+        slots = store.index.count()
+        deleted = store.delete_source("c")
+        freed = store.free_label_count()
+        gone = _top(store, "c chunk 1")
+        store.add_chunks("d", _chunks("d", 6))
+        ok = (
+            deleted == 5
+            and freed == 6  # c's five chunks plus a's replaced chunk 2
+            and (gone is None or gone["source"] != "c")
+            and store.free_label_count() == 0
+            and store.index.count() == slots
+        )
+        record("delete_label_reuse", ok, {"deleted": deleted, "freed": freed, "slots": store.index.count()})
+
+        # Scoped query: a private collection is only searched when asked for
+        store.add_chunks("notes", ["alice private note"], collection="user:alice")
+        shared = _top(store, "alice private note", collections=["shared"])
+        private = _top(store, "alice private note", collections=["shared", "user:alice"])
+        ok = (
+            (shared is None or shared["collection"] == "shared")
+            and private is not None
+            and private["content"] == "alice private note"
+            and private["collection"] == "user:alice"
+        )
+        record("scoped_query", ok, {"shared": shared, "private": private})
+
+        # Crash: the process dies without a checkpoint, mid-way through a log record
+        expected = store.collection_sizes()
+        with store.log_path.open("ab") as handle:
+            handle.write(b"\x01\x02\x03")
+        del store
+        store = _open(data_dir, backend)
+        top = _top(store, "d chunk 4")
+        ok = (
+            store.collection_sizes() == expected
+            and top is not None
+            and top["content"] == "d chunk 4"
+            and store.verify() == []
+        )
+        record("reopen_log_replay", ok, {"collections": store.collection_sizes(), "verify": store.verify()})
+
+        # Compacting rebuild: labels renumbered 0..n-1 from the raw sidecar, nothing lost
+        store.delete_source("b")
+        live = sum(expected.values()) - 5
+        report = store.rebuild_index(compact=True)
+        problems = store.verify()
+        top = _top(store, "alice private note", collections=["user:alice"])
+        ok = (
+            report["live"] == live
+            and report["after"]["slots"] == live
+            and store.free_label_count() == 0
+            and problems == []
+            and top is not None
+            and top["content"] == "alice private note"
+        )
+        record("rebuild_compact", ok, {"report": report, "verify": problems})
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return all_ok, results
+
+
+def run_caches() -> tuple[bool, list[CaseResult]]:
+    """Query embeddings and results are reused until the index changes."""
+    results: list[CaseResult] = []
+    data_dir = Path(tempfile.mkdtemp(prefix="rag_store_test_"))
+    try:
+        store = _open(data_dir, "hnsw")
+        store.add_chunks("a", _chunks("a", 3))
+        store.add_chunks("z", _chunks("z", 3))
+
+        # Same question modulo case and spacing: one embedding, one search
+        first = store.query("a chunk 1", top_k=1, mode="vector")
+        second = store.query("  A   Chunk 1 ", top_k=1, mode="vector")
+        stats = store.cache_stats()
+        ok = (
+            first == second
+            and stats["embeddings"]["hits"] == 1
+            and stats["embeddings"]["misses"] == 1
+            and stats["results"]["hits"] == 1
+        )
+        results.append(CaseResult(name="cache_hit", detail=str(stats), ok=ok))
+
+        # Deleting bumps the generation: the cached hit is not served again
+        generation = store.generation
+        store.delete_source("a")
+        third = store.query("a chunk 1", top_k=1, mode="vector")
+        stats = store.cache_stats()
+        ok = (
+            store.generation == generation + 1
+            and all(item["source"] != "a" for item in third)
+            and (stats["results"]["hits"], stats["results"]["misses"]) == (1, 2)
+        )
+        results.append(
+            CaseResult(name="cache_invalidated", detail=f"{third} {stats['results']}", ok=ok)
+        )
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return all(item.ok for item in results), results
+
+
+def run_batcher() -> tuple[bool, list[CaseResult]]:
+    """Concurrent encode calls share forward passes and still get their own rows."""
+    results: list[CaseResult] = []
+    embedder = FakeEmbedder()
+    passes: list[list[str]] = []
+    gate = threading.Event()
+
+    def encode(texts: list[str], batch_size: int) -> Any:
+        passes.append(list(texts))
+        if len(passes) == 1:
+            gate.wait(5)  # hold the first pass while the others queue up
+        if any(text == "boom" for text in texts):
+            raise RuntimeError("encoder failed")
+        return embedder.encode(texts)
+
+    def call(texts: list[str], out: dict[str, Any]) -> threading.Thread:
+        def body() -> None:
+            try:
+                out[texts[0]] = batcher.encode(texts)
+            except RuntimeError as exc:
+                out[texts[0]] = exc
+
+        thread = threading.Thread(target=body, daemon=True)
+        thread.start()
+        return thread
+
+    # While one pass runs, six callers (two asking the same thing) queue up
+    # and are then served by a single pass over the five distinct texts.
+    batcher = EmbeddingBatcher(encode, max_batch=32, max_wait_ms=2.0)
+    out: dict[str, Any] = {}
+    threads = [call(["first"], out)]
+    time.sleep(0.05)
+    texts = ["same question", "q1", "q2", "q3", "q4"]
+    threads += [call([text], out) for text in texts]
+    threads.append(call(["same question"], {}))
+    time.sleep(0.2)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+    ok = (
+        [len(texts_in_pass) for texts_in_pass in passes] == [1, 5]
+        and all(np.allclose(out[text], embedder.encode([text])) for text in ["first", *texts])
+        and batcher.stats()["requests"] == 7
+    )
+    results.append(CaseResult(name="batcher_coalesces", detail=f"{passes} {batcher.stats()}", ok=ok))
+
+    # An encoder error reaches every caller in the failed pass, and the worker carries on
+    passes.clear()
+    gate.clear()
+    out = {}
+    threads = [call(["first"], out)]
+    time.sleep(0.05)
+    threads += [call(["boom"], out), call(["fine"], out)]
+    time.sleep(0.2)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+    after = batcher.encode(["after"])
+    ok = (
+        isinstance(out.get("boom"), RuntimeError)
+        and isinstance(out.get("fine"), RuntimeError)
+        and np.allclose(after, embedder.encode(["after"]))
+    )
+    results.append(
+        CaseResult(
+            name="batcher_errors",
+            detail=f"{passes} { {text: type(value).__name__ for text, value in out.items()} }",
+            ok=ok,
+        )
+    )
+    batcher.close()
+    return all(item.ok for item in results), results
+
+
+def run() -> tuple[bool, list[CaseResult]]:
+    all_ok = True
+    results: list[CaseResult] = []
+    for backend in ("hnsw", "quantized"):
+        ok, backend_results = run_backend(backend)
+        all_ok = all_ok and ok
+        results.extend(backend_results)
+    ok, cache_results = run_caches()
+    all_ok = all_ok and ok
+    ok, batcher_results = run_batcher()
+    return all_ok and ok, results + cache_results + batcher_results
+
+
+def main() -> int:
+    ok, results = run()
+    print(
+        json.dumps(
+            {"ok": ok, "results": [asdict(item) for item in results]},
+            indent=2,
+        )
+    )
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
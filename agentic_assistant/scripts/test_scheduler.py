@@ -0,0 +1,211 @@
+"""InferenceScheduler unit tests: priority admission and the busy (HTTP 429) path.
+
+Runs offline against a stub runner whose first call holds the only slot
+until the test releases it, so queue order and rejections are deterministic.
+"""
+from __future__ import annotations
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest.mock
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+# Support both `python scripts/test_scheduler.py` (from project root)
+# and `PYTHONPATH=src python scripts/test_scheduler.py`
+_ROOT = Path(__file__).resolve().parents[1]
+_SRC = _ROOT / "src"
+for _p in (_SRC, _ROOT):
+    if str(_p) not in sys.path:
+        sys.path.insert(0, str(_p))
+
+from assistant.llm.scheduler import (  # noqa: E402
+    InferenceScheduler,
+    Priority,
+    SchedulerBusyError,
+    inference_priority,
+)
+
+
+class BlockingRunner:
+    """Records calls in the order they run; the first one blocks until released."""
+
+    def __init__(self) -> None:
+        self.calls: list[str] = []
+        self.holding = threading.Event()
+        self.release = threading.Event()
+
+    def _run(self, name: str) -> str:
+        first = not self.calls
+        self.calls.append(name)
+        if first:
+            self.holding.set()
+            self.release.wait(5)
+        return name
+
+    def generate(self, prompt: str, max_tokens_override: int | None = None, cache_key: Any = None) -> str:
+        return self._run(prompt)
+
+    def classify_labels(self, prompt: str, labels: Any) -> dict[str, float]:
+        self._run(prompt)
+        return {label: 1.0 / len(labels) for label in labels}
+
+
+@dataclass
+class CaseResult:
+    name: str
+    detail: str
+    ok: bool
+
+
+def _start(target: Callable[[], Any], errors: list[str]) -> threading.Thread:
+    def body() -> None:
+        try:
+            target()
+        except SchedulerBusyError as exc:
+            errors.append(exc.reason)
+
+    thread = threading.Thread(target=body, daemon=True)
+    thread.start()
+    return thread
+
+
+def _wait_for(predicate: Callable[[], bool], timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+def _interactive(scheduler: InferenceScheduler, prompt: str) -> Callable[[], Any]:
+    def call() -> Any:
+        with inference_priority(Priority.INTERACTIVE):
+            return scheduler.generate(prompt)
+
+    return call
+
+
+def _check_priority_order() -> CaseResult:
+    """Waiters run classify, then interactive, then bot — not in arrival order."""
+    runner = BlockingRunner()
+    scheduler = InferenceScheduler(runner, slots=1, max_queue=8, max_wait_seconds=5)
+    errors: list[str] = []
+    threads = [_start(lambda: scheduler.generate("holder"), errors)]
+    runner.holding.wait(5)
+    waiters = [
+        lambda: scheduler.generate("bot"),
+        _interactive(scheduler, "interactive"),
+        lambda: scheduler.classify_labels("classify", ("LOCAL", "GROQ")),
+    ]
+    for depth, waiter in enumerate(waiters, start=1):
+        threads.append(_start(waiter, errors))
+        _wait_for(lambda: scheduler.stats()["queue_depth"] == depth)
+    runner.release.set()
+    for thread in threads:
+        thread.join(5)
+    expected = ["holder", "classify", "interactive", "bot"]
+    ok = runner.calls == expected and not errors and scheduler.stats()["completed"] == 4
+    return CaseResult(name="priority_order", detail=f"{runner.calls} errors={errors}", ok=ok)
+
+
+def _check_queue_full() -> CaseResult:
+    """Past max_queue waiters a call is rejected at once, without running."""
+    runner = BlockingRunner()
+    scheduler = InferenceScheduler(runner, slots=1, max_queue=1, max_wait_seconds=5)
+    errors: list[str] = []
+    threads = [_start(lambda: scheduler.generate("holder"), errors)]
+    runner.holding.wait(5)
+    threads.append(_start(lambda: scheduler.generate("queued"), errors))
+    _wait_for(lambda: scheduler.stats()["queue_depth"] == 1)
+    try:
+        scheduler.generate("rejected")
+        reason, retry_after = "admitted", 0
+    except SchedulerBusyError as exc:
+        reason, retry_after = exc.reason, exc.retry_after_seconds
+    runner.release.set()
+    for thread in threads:
+        thread.join(5)
+    stats = scheduler.stats()
+    ok = (
+        reason == "queue_full"
+        and retry_after >= 1
+        and runner.calls == ["holder", "queued"]
+        and stats["rejected"] == 1
+        and not errors
+    )
+    return CaseResult(name="queue_full", detail=f"{reason} retry_after={retry_after} {stats}", ok=ok)
+
+
+def _check_wait_timeout() -> CaseResult:
+    """A waiter whose slot never frees gives up after max_wait_seconds."""
+    runner = BlockingRunner()
+    scheduler = InferenceScheduler(runner, slots=1, max_queue=4, max_wait_seconds=0.1)
+    errors: list[str] = []
+    holder = _start(lambda: scheduler.generate("holder"), errors)
+    runner.holding.wait(5)
+    try:
+        scheduler.generate("late")
+        reason = "admitted"
+    except SchedulerBusyError as exc:
+        reason = exc.reason
+    runner.release.set()
+    holder.join(5)
+    ok = reason == "wait_timeout" and runner.calls == ["holder"] and scheduler.stats()["queue_depth"] == 0
+    return CaseResult(name="wait_timeout", detail=reason, ok=ok)
+
+
+def _check_api_429() -> CaseResult:
+    """The API answers a rejected call with 429, its reason and Retry-After."""
+    os.environ["RAG_DATA_DIR"] = tempfile.mkdtemp(prefix="scheduler_test_")
+    sys.modules.setdefault("sentence_transformers", unittest.mock.MagicMock())
+    from fastapi.testclient import TestClient
+
+    import assistant.api as api
+
+    runner = BlockingRunner()
+    scheduler = api.llm_scheduler
+    scheduler.runner, scheduler.max_queue = runner, 0
+    errors: list[str] = []
+    holder = _start(lambda: scheduler.generate("holder"), errors)
+    runner.holding.wait(5)
+    response = TestClient(api.app).post("/query", json={"message": "hello"})
+    runner.release.set()
+    holder.join(5)
+    body = response.json()
+    ok = (
+        response.status_code == 429
+        and body.get("reason") == "queue_full"
+        and int(response.headers.get("Retry-After", "0")) >= 1
+    )
+    return CaseResult(
+        name="api_busy_429",
+        detail=f"{response.status_code} {body} Retry-After={response.headers.get('Retry-After')}",
+        ok=ok,
+    )
+
+
+def run() -> tuple[bool, list[CaseResult]]:
+    results = [_check_priority_order(), _check_queue_full(), _check_wait_timeout(), _check_api_429()]
+    return all(item.ok for item in results), results
+
+
+def main() -> int:
+    ok, results = run()
+    print(
+        json.dumps(
+            {"ok": ok, "results": [asdict(item) for item in results]},
+            indent=2,
+        )
+    )
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
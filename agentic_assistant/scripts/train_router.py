@@ -0,0 +1,104 @@
+"""Train the embedding router from labelled JSONL examples.
+
+Each line is ``{"text": "...", "label": "LOCAL|GROQ|GEMINI|KIMI"}``.  Examples
+are embedded with the configured RAG embedding model (normalised exactly as
+the orchestrator normalises live messages; the RAG index itself is not
+opened), one centroid per label is
+computed, and the result is saved as a compact ``.npz`` file.
+
+Usage (from agentic_assistant/):
+    python scripts/train_router.py router_examples.jsonl.example
+    python scripts/train_router.py my_examples.jsonl --out data/rag/router.npz --holdout 0.2
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+from collections import Counter
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parents[1]
+_SRC = _ROOT / "src"
+if str(_SRC) not in sys.path:
+    sys.path.insert(0, str(_SRC))
+
+from assistant.config import settings  # noqa: E402
+from assistant.embedding_router import EmbeddingRouter  # noqa: E402
+from assistant.rag.embedders import create_embedder  # noqa: E402
+from assistant.response_cache import normalize_message  # noqa: E402
+
+_LABELS = {"LOCAL", "GROQ", "GEMINI", "KIMI"}
+
+
+def load_examples(path: Path) -> list[tuple[str, str]]:
+    examples: list[tuple[str, str]] = []
+    with path.open("r", encoding="utf-8") as handle:
+        for line_no, line in enumerate(handle, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            record = json.loads(line)
+            label = str(record.get("label", "")).strip().upper()
+            text = str(record.get("text", "")).strip()
+            if label not in _LABELS or not text:
+                print(f"  skipping line {line_no}: need text and one of {sorted(_LABELS)}")
+                continue
+            examples.append((text, label))
+    return examples
+
+
+def accuracy(router: EmbeddingRouter, vectors: list, labels: list[str]) -> float:
+    if not labels:
+        return 0.0
+    hits = sum(router.classify(vec)[0] == label for vec, label in zip(vectors, labels))
+    return hits / len(labels)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Train the embedding router")
+    parser.add_argument("examples", type=Path, help="Labelled JSONL examples")
+    parser.add_argument(
+        "--out", type=Path, default=settings.embedding_router_path, help="Output .npz path"
+    )
+    parser.add_argument(
+        "--holdout", type=float, default=0.0, help="Fraction held out to report accuracy"
+    )
+    parser.add_argument("--seed", type=int, default=7, help="Shuffle seed for --holdout")
+    args = parser.parse_args()
+
+    examples = load_examples(args.examples)
+    counts = Counter(label for _, label in examples)
+    print(f"Loaded {len(examples)} examples: {dict(sorted(counts.items()))}")
+    if len(counts) < 2:
+        raise SystemExit("Need examples for at least two labels.")
+
+    # The embedder alone: opening the RAG store would migrate, tune and write
+    # the live index a running API or ingest may be using.
+    embedder = create_embedder(
+        settings.embedding_backend, settings.embedding_model, settings.embedding_onnx_dir
+    )
+    vectors = list(embedder.encode([normalize_message(text) for text, _ in examples]))
+    labels = [label for _, label in examples]
+
+    if args.holdout > 0:
+        order = list(range(len(examples)))
+        random.Random(args.seed).shuffle(order)
+        cut = int(len(order) * (1 - args.holdout))
+        train, test = order[:cut], order[cut:]
+        trial = EmbeddingRouter.fit(
+            [vectors[i] for i in train], [labels[i] for i in train], settings.embedding_model
+        )
+        held_out = accuracy(trial, [vectors[i] for i in test], [labels[i] for i in test])
+        print(f"Held-out accuracy: {held_out:.1%} on {len(test)} examples")
+
+    router = EmbeddingRouter.fit(vectors, labels, settings.embedding_model)
+    print(f"Training accuracy: {accuracy(router, vectors, labels):.1%}")
+    print(f"Temperature: {router.temperature}")
+    router.save(args.out)
+    print(f"Saved router to {args.out} ({args.out.stat().st_size} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,41 @@
 from __future__ import annotations
 
 import asyncio
+import hmac
 import logging
 import json
+import threading
 
 from contextlib import asynccontextmanager
+from typing import Any, Callable
 
 from fastapi import FastAPI, Header, HTTPException, Request
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
 
 from assistant.config import settings
+from assistant.embedding_router import EmbeddingRouter
 from assistant.llm.cloud_router import CloudConfig, CloudRouter
 from assistant.llm.llama_cpp_runner import LlamaCppRunner
+from assistant.llm.llama_inprocess import LlamaInProcessRunner
+from assistant.llm.llama_server import LlamaServerRunner
+from assistant.llm.prompt_cache import PromptCache
+from assistant.llm.scheduler import (
+    InferenceScheduler,
+    Priority,
+    SchedulerBusyError,
+    inference_priority,
+)
 from assistant.memory import ConversationMemory
 from assistant.messaging.parsers import parse_discord, parse_telegram
 from assistant.messaging.senders import OutboundSenders
 from assistant.orchestrator import AgentOrchestrator
 from assistant.personality import Personality
-from assistant.rag.store import RagStore
+from assistant.rag.chunking import embedding_token_counter
+from assistant.rag.ingest_queue import IngestQueue, IngestQueueFullError
+from assistant.rag.lazy import BackgroundRagStore
+from assistant.rag.store import DEFAULT_COLLECTION, RagStore
+from assistant.response_cache import ResponseCache
 
 logger = logging.getLogger(__name__)
 
@@ -25,16 +43,102 @@ logger = logging.getLogger(__name__)
 # Singleton service objects
 # ---------------------------------------------------------------------------
 
-rag_store = RagStore(settings.rag_data_dir, settings.embedding_model)
+def _on_rag_ready(store: RagStore) -> None:
+    """Attach the embedding router once the embedder (and its dimension) exists."""
+    router = EmbeddingRouter.load(
+        settings.embedding_router_path,
+        embedding_model=settings.embedding_model,
+        dimension=store.dimension,
+    )
+    if router is not None:
+        logger.info("Embedding router loaded (%s)", ", ".join(router.labels))
+    orchestrator.embedding_router = router
+
+
+# Loading the embedder and the index takes seconds; it happens on a background
+# thread (started in the lifespan hook) so the port is bound immediately.
+rag_store = BackgroundRagStore(lambda: RagStore.from_settings(settings), on_ready=_on_rag_ready)
+
+# POST /rag/documents and DELETE /rag/sources/… run here, against the same
+# store the queries read, so new documents are searchable without a restart.
+ingest_queue = IngestQueue(
+    rag_store.wait,
+    lambda: embedding_token_counter(settings.embedding_model, settings.embedding_onnx_dir),
+    max_tokens=settings.rag_chunk_tokens,
+    overlap_tokens=settings.rag_chunk_overlap_tokens,
+    max_queued=settings.rag_ingest_queue_size,
+)
+
+
+def _build_prompt_cache() -> PromptCache | None:
+    if not settings.prompt_cache_enabled:
+        return None
+    return PromptCache(
+        cache_dir=settings.prompt_cache_dir,
+        model_path=settings.model_path,
+        max_files=settings.prompt_cache_max_files,
+        max_bytes=settings.prompt_cache_max_mb * 1024 * 1024,
+    )
+
+
+def _build_llm_runner() -> LlamaCppRunner:
+    """Pick the local inference engine selected by ``LLM_ENGINE``."""
+    engine = settings.llm_engine.lower()
+    prompt_cache = _build_prompt_cache()
+    if engine == "server":
+        return LlamaServerRunner(
+            executable_path=settings.llama_server_path,
+            model_path=settings.model_path,
+            threads=settings.inference_threads,
+            context_tokens=settings.llama_server_slot_context or settings.llm_context_tokens,
+            max_tokens=settings.max_response_tokens,
+            temperature=settings.llm_temperature,
+            timeout_seconds=settings.llama_timeout_seconds,
+            host=settings.llama_server_host,
+            port=settings.llama_server_port,
+            startup_timeout_seconds=settings.llama_server_startup_seconds,
+            prompt_cache=prompt_cache,
+            parallel_slots=settings.llama_server_slots,
+        )
+    if engine == "inprocess":
+        return LlamaInProcessRunner(
+            model_path=settings.model_path,
+            threads=settings.inference_threads,
+            context_tokens=settings.llm_context_tokens,
+            max_tokens=settings.max_response_tokens,
+            temperature=settings.llm_temperature,
+            timeout_seconds=settings.llama_timeout_seconds,
+            prompt_cache=prompt_cache,
+        )
+    if engine != "subprocess":
+        logger.warning("Unknown LLM_ENGINE=%r — falling back to subprocess", settings.llm_engine)
+    return LlamaCppRunner(
+        executable_path=settings.llama_main_path,
+        model_path=settings.model_path,
+        threads=settings.inference_threads,
+        context_tokens=settings.llm_context_tokens,
+        max_tokens=settings.max_response_tokens,
+        temperature=settings.llm_temperature,
+        timeout_seconds=settings.llama_timeout_seconds,
+        prompt_cache=prompt_cache,
+    )
+
 
-llm_runner = LlamaCppRunner(
-    executable_path=settings.llama_main_path,
-    model_path=settings.model_path,
-    threads=settings.inference_threads,
-    context_tokens=settings.llm_context_tokens,
-    max_tokens=settings.max_response_tokens,
-    temperature=settings.llm_temperature,
-    timeout_seconds=settings.llama_timeout_seconds,
+llm_runner = _build_llm_runner()
+
+# Every local call (API, webhooks, polling bots) goes through one scheduler so
+# a burst cannot spawn more llama processes than the CPU can serve.
+llm_scheduler = InferenceScheduler(
+    llm_runner,
+    # A multi-slot llama-server batches concurrent requests, so let that
+    # many through at once.
+    slots=(
+        max(settings.inference_slots, llm_runner.parallel_slots)
+        if isinstance(llm_runner, LlamaServerRunner)
+        else settings.inference_slots
+    ),
+    max_queue=settings.inference_max_queue,
+    max_wait_seconds=settings.inference_max_wait_seconds,
 )
 
 cloud_router = CloudRouter(
@@ -47,6 +151,7 @@ cloud_router = CloudRouter(
         kimi_base_url=settings.kimi_base_url,
         kimi_model=settings.kimi_model,
         timeout_seconds=settings.cloud_timeout_seconds,
+        max_output_tokens=settings.cloud_max_output_tokens,
     )
 )
 
@@ -57,9 +162,19 @@ memory = ConversationMemory(
 
 personality = Personality.from_settings(settings)
 
+response_cache = (
+    ResponseCache(
+        max_entries=settings.response_cache_max_entries,
+        ttl_seconds=settings.response_cache_ttl_seconds,
+        min_similarity=settings.response_cache_min_similarity,
+    )
+    if settings.response_cache_enabled
+    else None
+)
+
 orchestrator = AgentOrchestrator(
     rag=rag_store,
-    llm=llm_runner,
+    llm=llm_scheduler,
     cloud=cloud_router,
     memory=memory,
     personality=personality,
@@ -67,8 +182,30 @@ orchestrator = AgentOrchestrator(
     long_context_threshold_chars=settings.long_context_threshold_chars,
     short_message_threshold_chars=settings.local_short_threshold_chars,
     use_llm_routing=settings.use_llm_routing,
+    per_user_prompt_cache=settings.prompt_cache_per_user,
+    llm_routing_min_confidence=settings.llm_routing_min_confidence,
+    # Per-slot context for llama-server, LLM_CONTEXT_TOKENS for llama-cli
+    local_context_tokens=llm_runner.context_tokens,
+    local_reserved_tokens=settings.max_response_tokens,
+    cloud_context_tokens={
+        "groq": settings.groq_context_tokens,
+        "gemini": settings.gemini_context_tokens,
+        "kimi": settings.kimi_context_tokens,
+    },
+    cloud_reserved_tokens=settings.cloud_max_output_tokens,
+    response_cache=response_cache,
+    # Attached by _on_rag_ready: the router needs the embedder's dimension
+    embedding_router=None,
+    embedding_router_min_confidence=settings.embedding_router_min_confidence,
+    rag_collections=list(settings.rag_shared_collections),
 )
 
+if not settings.rag_background_load:
+    try:
+        rag_store.wait()
+    except Exception as exc:  # noqa: BLE001
+        logger.error("Continuing without RAG: %s", exc)
+
 senders = OutboundSenders(
     telegram_bot_token=settings.telegram_bot_token,
     discord_bot_token=settings.discord_bot_token,
@@ -81,9 +218,25 @@ senders = OutboundSenders(
 _bot_tasks: list[asyncio.Task] = []  # type: ignore[type-arg]
 
 
+# Engines that keep the model resident and can load it ahead of the first request
+_RESIDENT_ENGINES = (LlamaServerRunner, LlamaInProcessRunner)
+
+
+def _warm_llm_server() -> None:
+    """Load the model into the resident engine before the first request."""
+    try:
+        llm_runner.start()  # type: ignore[attr-defined]
+    except Exception as exc:  # noqa: BLE001
+        logger.error("%s warm-up failed (will retry on first request): %s", llm_runner.engine, exc)
+
+
 @asynccontextmanager
 async def _lifespan(application: FastAPI):  # type: ignore[type-arg]
     """Start polling bots on startup; cancel them cleanly on shutdown."""
+    rag_store.start()
+    if isinstance(llm_runner, _RESIDENT_ENGINES):
+        threading.Thread(target=_warm_llm_server, name="llama_server_warmup", daemon=True).start()
+
     if settings.bot_mode.lower() == "polling":
         if settings.telegram_bot_token:
             from assistant.bots.telegram_polling import TelegramPoller
@@ -115,10 +268,22 @@ async def _lifespan(application: FastAPI):  # type: ignore[type-arg]
             pass
     _bot_tasks.clear()
 
+    if isinstance(llm_runner, _RESIDENT_ENGINES):
+        llm_runner.stop()
+
 
 app = FastAPI(title="Agentic Assistant", version="2.0.0", lifespan=_lifespan)
 
 
+@app.exception_handler(SchedulerBusyError)
+async def _busy_handler(request: Request, exc: SchedulerBusyError) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "busy", "reason": exc.reason},
+        headers={"Retry-After": str(exc.retry_after_seconds)},
+    )
+
+
 # ---------------------------------------------------------------------------
 # Request / response models
 # ---------------------------------------------------------------------------
@@ -127,6 +292,16 @@ class QueryRequest(BaseModel):
     message: str
 
 
+class IngestDocument(BaseModel):
+    source: str = Field(min_length=1, max_length=512)
+    text: str
+
+
+class IngestRequest(BaseModel):
+    documents: list[IngestDocument] = Field(min_length=1)
+    collection: str = Field(default=DEFAULT_COLLECTION, min_length=1, max_length=128)
+
+
 # ---------------------------------------------------------------------------
 # Internal helpers
 # ---------------------------------------------------------------------------
@@ -140,6 +315,28 @@ def _validate_message_or_400(message: str) -> str:
     return cleaned
 
 
+def _require_ingest_token(authorization: str | None) -> None:
+    """The /rag endpoints change what every user retrieves: bearer token or nothing."""
+    if not settings.rag_ingest_token:
+        raise HTTPException(status_code=403, detail="ingestion API disabled (set RAG_INGEST_TOKEN)")
+    expected = f"Bearer {settings.rag_ingest_token}"
+    if not hmac.compare_digest((authorization or "").encode(), expected.encode()):
+        raise HTTPException(status_code=401, detail="invalid ingest token")
+
+
+def _submit_or_429(submit: Callable[..., dict], *args: Any) -> JSONResponse:
+    try:
+        job = submit(*args)
+    except IngestQueueFullError as exc:
+        raise HTTPException(status_code=429, detail=str(exc), headers={"Retry-After": "10"})
+    return JSONResponse(status_code=202, content=job)
+
+
+def _sse(event: str, data: dict) -> str:
+    """Format one Server-Sent-Events frame."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 def _safe_delivery(delivery: dict) -> dict:
     if settings.expose_delivery_errors or delivery.get("sent") is True:
         return delivery
@@ -159,9 +356,17 @@ def health() -> dict:
         "ok": True,
         "model_path": str(settings.model_path),
         "llama_main_path": str(settings.llama_main_path),
+        "llm_engine": llm_runner.engine,
         "use_llm_routing": settings.use_llm_routing,
+        "embedding_router": orchestrator.embedding_router is not None,
         "bot_mode": settings.bot_mode,
         "agent_name": personality.name,
+        "scheduler": llm_scheduler.stats(),
+        "response_cache": response_cache.stats() if response_cache is not None else None,
+        "rag": rag_store.status(),
+        "rag_cache": rag_store.cache_stats(),
+        "rag_index": rag_store.index_stats(),
+        "rag_ingest": ingest_queue.stats(),
         "hybrid": {
             "groq_enabled": cloud_router.is_groq_available(),
             "gemini_enabled": cloud_router.is_gemini_available(),
@@ -173,10 +378,92 @@ def health() -> dict:
 @app.post("/query")
 def query(req: QueryRequest) -> dict:
     message = _validate_message_or_400(req.message)
-    result = orchestrator.respond_with_route(message, user_id="api")
+    with inference_priority(Priority.INTERACTIVE):
+        result = orchestrator.respond_with_route(message, user_id="api")
     return {"route": result.route, "reason": result.reason, "response": result.response}
 
 
+@app.post("/query/stream")
+def query_stream(req: QueryRequest) -> StreamingResponse:
+    """Like ``/query`` but streams the reply as Server-Sent Events.
+
+    Emits one ``route`` event, then ``token`` events carrying text deltas, and
+    finally ``done`` (or ``error`` if generation fails mid-stream).
+    """
+    message = _validate_message_or_400(req.message)
+    with inference_priority(Priority.INTERACTIVE):
+        stream = orchestrator.respond_with_route_stream(message, user_id="api")
+
+    def _events():
+        yield _sse("route", {"route": stream.route, "reason": stream.reason})
+        try:
+            for delta in stream.chunks:
+                yield _sse("token", {"delta": delta})
+        except Exception as exc:  # noqa: BLE001
+            logger.error("Streaming generation failed: %s", exc)
+            yield _sse("error", {"detail": "generation failed"})
+            return
+        yield _sse("done", {})
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        # Disable proxy buffering so nginx forwards each token immediately.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ---------------------------------------------------------------------------
+# Online ingestion
+# ---------------------------------------------------------------------------
+
+@app.post("/rag/documents", status_code=202)
+def ingest_documents(
+    req: IngestRequest, authorization: str | None = Header(default=None)
+) -> JSONResponse:
+    """Queue documents for chunking, embedding and indexing; returns the job.
+
+    Each document replaces whatever its ``source`` held in the collection.
+    """
+    _require_ingest_token(authorization)
+    sources = [document.source for document in req.documents]
+    if len(set(sources)) != len(sources):
+        raise HTTPException(status_code=400, detail="duplicate source in request")
+    total = sum(len(document.text) for document in req.documents)
+    if total > settings.rag_ingest_max_chars:
+        raise HTTPException(
+            status_code=413, detail=f"documents exceed {settings.rag_ingest_max_chars} chars"
+        )
+    documents = [(document.source, document.text) for document in req.documents]
+    return _submit_or_429(ingest_queue.submit_documents, documents, req.collection)
+
+
+@app.delete("/rag/sources/{source:path}", status_code=202)
+def delete_source(
+    source: str,
+    collection: str = DEFAULT_COLLECTION,
+    authorization: str | None = Header(default=None),
+) -> JSONResponse:
+    """Queue the removal of every chunk of *source* (after any queued ingest)."""
+    _require_ingest_token(authorization)
+    return _submit_or_429(ingest_queue.submit_delete, source, collection)
+
+
+@app.get("/rag/jobs")
+def ingest_jobs(authorization: str | None = Header(default=None)) -> dict:
+    _require_ingest_token(authorization)
+    return {"counts": ingest_queue.stats(), "jobs": ingest_queue.jobs()}
+
+
+@app.get("/rag/jobs/{job_id}")
+def ingest_job(job_id: str, authorization: str | None = Header(default=None)) -> dict:
+    _require_ingest_token(authorization)
+    job = ingest_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="unknown job")
+    return job
+
+
 # ---------------------------------------------------------------------------
 # Telegram webhook
 # ---------------------------------------------------------------------------
@@ -32,11 +32,15 @@ import asyncio
 import logging
 from typing import TYPE_CHECKING
 
+from assistant.llm.scheduler import SchedulerBusyError
+
 if TYPE_CHECKING:
     from assistant.orchestrator import AgentOrchestrator
 
 logger = logging.getLogger(__name__)
 
+_BUSY_REPLY = "I'm handling a lot of requests right now — please try again in a minute."
+
 _MAX_CHARS = 1900   # Discord message limit with some headroom
 
 
@@ -92,6 +96,9 @@ class DiscordBot:
                         f"dc:{user_id}",
                     )
                     reply = result.response
+                except SchedulerBusyError as exc:
+                    logger.warning("Local inference busy, rejecting Discord message: %s", exc)
+                    reply = _BUSY_REPLY
                 except Exception as exc:  # noqa: BLE001
                     logger.error("Orchestrator error for Discord message: %s", exc)
                     reply = "Sorry, I encountered an error processing your message."
@@ -25,11 +25,15 @@ from typing import TYPE_CHECKING, Any
 
 import httpx
 
+from assistant.llm.scheduler import SchedulerBusyError
+
 if TYPE_CHECKING:
     from assistant.orchestrator import AgentOrchestrator
 
 logger = logging.getLogger(__name__)
 
+_BUSY_REPLY = "I'm handling a lot of requests right now — please try again in a minute."
+
 _BASE = "https://api.telegram.org/bot{token}/{method}"
 _POLL_TIMEOUT = 30   # seconds — server-side long-poll window
 _RETRY_DELAY = 5     # seconds to wait before retrying on error
@@ -108,6 +112,9 @@ class TelegramPoller:
                 f"tg:{user_id}",
             )
             reply = result.response
+        except SchedulerBusyError as exc:
+            logger.warning("Local inference busy, rejecting Telegram message: %s", exc)
+            reply = _BUSY_REPLY
         except Exception as exc:  # noqa: BLE001
             logger.error("Orchestrator error for Telegram message: %s", exc)
             reply = "Sorry, I encountered an error processing your message."
@@ -23,6 +23,11 @@ _DEFAULT_LLAMA_PATH = (
     if _IS_WINDOWS
     else "/home/pi/llama.cpp/build/bin/llama-cli"
 )
+_DEFAULT_LLAMA_SERVER_PATH = (
+    r"C:\llama.cpp\build\bin\llama-server.exe"
+    if _IS_WINDOWS
+    else "/home/pi/llama.cpp/build/bin/llama-server"
+)
 
 
 def _env_int(name: str, default: int) -> int:
@@ -70,13 +75,74 @@ class Settings:
     llm_temperature: float = _env_float("LLM_TEMPERATURE", 0.2)
 
     embedding_model: str = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+    # "torch" (sentence-transformers) or "onnx" (ONNX Runtime export of the
+    # same model, created once with scripts/export_onnx_embedder.py)
+    embedding_backend: str = os.getenv("EMBEDDING_BACKEND", "torch").strip().lower()
+    embedding_onnx_dir: Path = Path(os.getenv("EMBEDDING_ONNX_DIR", "./data/embedder-onnx"))
     rag_top_k: int = _env_int("RAG_TOP_K", 3)
     rag_data_dir: Path = Path(os.getenv("RAG_DATA_DIR", "./data/rag"))
+    # Load the embedder and index on a background thread so the API serves
+    # (without RAG context) while they load; false blocks startup instead
+    rag_background_load: bool = _env_bool("RAG_BACKGROUND_LOAD", True)
+    # New vectors are appended to vectors.log; the full vectors.bin snapshot is
+    # only rewritten once the log grows past this size (or on ingest completion)
+    rag_checkpoint_log_mb: int = _env_int("RAG_CHECKPOINT_LOG_MB", 16)
+    # LRU caches in front of the embedder and the kNN search (0 disables)
+    rag_embedding_cache_size: int = _env_int("RAG_EMBEDDING_CACHE_SIZE", 1024)
+    rag_result_cache_size: int = _env_int("RAG_RESULT_CACHE_SIZE", 256)
+    # Concurrent embedding requests are coalesced for up to WAIT_MS (or until
+    # MAX texts are queued) into one forward pass; MAX=1 disables batching
+    rag_embed_batch_max: int = _env_int("RAG_EMBED_BATCH_MAX", 32)
+    rag_embed_batch_wait_ms: float = _env_float("RAG_EMBED_BATCH_WAIT_MS", 2.0)
+    # "vector" (HNSW only), "lexical" (FTS5/BM25 only), "hybrid" (both, fused
+    # by reciprocal rank) or "auto" (lexical for identifier-heavy queries)
+    rag_retrieval_mode: str = os.getenv("RAG_RETRIEVAL_MODE", "auto").strip().lower()
+    # Post-retrieval selection: drop vector hits beyond this cosine distance
+    # (0 disables), diversify with MMR (1.0 = pure relevance) and skip chunks
+    # adjacent to one already selected from the same source
+    rag_max_distance: float = _env_float("RAG_MAX_DISTANCE", 0.8)
+    rag_mmr_lambda: float = _env_float("RAG_MMR_LAMBDA", 0.7)
+    rag_collapse_adjacent: bool = _env_bool("RAG_COLLAPSE_ADJACENT", True)
+    # Vector index: "hnsw" (hnswlib graph) or "quantized" (exact search over an
+    # int8/float16 memmap; switching migrates the existing index on start)
+    rag_vector_backend: str = os.getenv("RAG_VECTOR_BACKEND", "hnsw").strip().lower()
+    rag_quantized_dtype: str = os.getenv("RAG_QUANTIZED_DTYPE", "int8").strip().lower()
+    # Re-score quantized candidates against float32 copies (a disk memmap)
+    rag_quantized_rescore: bool = _env_bool("RAG_QUANTIZED_RESCORE", True)
+    # HNSW ef is tuned to the smallest value whose recall@K against exact search
+    # reaches TARGET_RECALL (0 disables tuning; ef stays 100), and re-tuned once
+    # the index has grown by RETUNE_GROWTH (0.25 = 25%) since the last tuning
+    rag_hnsw_target_recall: float = _env_float("RAG_HNSW_TARGET_RECALL", 0.95)
+    rag_hnsw_tune_k: int = _env_int("RAG_HNSW_TUNE_K", 20)
+    rag_hnsw_retune_growth: float = _env_float("RAG_HNSW_RETUNE_GROWTH", 0.25)
+    # Collections searched for every user (comma separated); each user also
+    # searches their own private "user:<user_id>" collection
+    rag_shared_collections: tuple[str, ...] = tuple(
+        name.strip()
+        for name in os.getenv("RAG_SHARED_COLLECTIONS", "shared").split(",")
+        if name.strip()
+    )
+    # Chunking used by scripts/ingest_documents.py and POST /rag/documents:
+    # max embedding-model tokens per chunk (keep below the model's 256-token
+    # limit) and tokens of trailing sentences repeated in the next chunk
+    rag_chunk_tokens: int = _env_int("RAG_CHUNK_TOKENS", 240)
+    rag_chunk_overlap_tokens: int = _env_int("RAG_CHUNK_OVERLAP_TOKENS", 40)
+    # Bearer token for the online ingestion endpoints under /rag (empty
+    # disables them); caps on the text of one request and on queued jobs
+    rag_ingest_token: str = os.getenv("RAG_INGEST_TOKEN", "")
+    rag_ingest_max_chars: int = _env_int("RAG_INGEST_MAX_CHARS", 5_000_000)
+    rag_ingest_queue_size: int = _env_int("RAG_INGEST_QUEUE_SIZE", 16)
     max_input_chars: int = _env_int("MAX_INPUT_CHARS", 8000)
     expose_delivery_errors: bool = _env_bool("EXPOSE_DELIVERY_ERRORS", False)
 
     long_context_threshold_chars: int = _env_int("LONG_CONTEXT_THRESHOLD_CHARS", 1200)
     cloud_timeout_seconds: int = _env_int("CLOUD_TIMEOUT_SECONDS", 25)
+    # Token budgets: prompts are packed to each backend's context window minus
+    # its reserved output tokens (MAX_RESPONSE_TOKENS locally, below for cloud).
+    cloud_max_output_tokens: int = _env_int("CLOUD_MAX_OUTPUT_TOKENS", 1024)
+    groq_context_tokens: int = _env_int("GROQ_CONTEXT_TOKENS", 8192)
+    gemini_context_tokens: int = _env_int("GEMINI_CONTEXT_TOKENS", 32768)
+    kimi_context_tokens: int = _env_int("KIMI_CONTEXT_TOKENS", 8192)
 
     # Conversation memory
     memory_max_turns: int = _env_int("MEMORY_MAX_TURNS", 10)
@@ -84,9 +150,57 @@ class Settings:
     # Local LLM routing classification
     use_llm_routing: bool = _env_bool("USE_LLM_ROUTING", True)
     local_short_threshold_chars: int = _env_int("LOCAL_SHORT_THRESHOLD_CHARS", 150)
+    # Minimum classifier probability for a cloud route; below it Tier 3 stays local
+    llm_routing_min_confidence: float = _env_float("LLM_ROUTING_MIN_CONFIDENCE", 0.5)
+    # Embedding router (scripts/train_router.py): routes ambiguous messages from
+    # the RAG embedding; the LLM classifier only runs when it is less confident
+    embedding_router_path: Path = Path(os.getenv("EMBEDDING_ROUTER_PATH", "./data/rag/router.npz"))
+    embedding_router_min_confidence: float = _env_float("EMBEDDING_ROUTER_MIN_CONFIDENCE", 0.6)
     # Timeout in seconds for the llama.cpp subprocess
     llama_timeout_seconds: int = _env_int("LLAMA_TIMEOUT_SECONDS", 120)
 
+    # Local inference engine: "subprocess" (spawn llama-cli per call),
+    # "server" (one resident llama-server process, queried over localhost HTTP) or
+    # "inprocess" (llama-cpp-python bindings; model mmapped into the API process)
+    llm_engine: str = os.getenv("LLM_ENGINE", "subprocess")
+    llama_server_path: Path = Path(os.getenv("LLAMA_SERVER_PATH", _DEFAULT_LLAMA_SERVER_PATH))
+    llama_server_host: str = os.getenv("LLAMA_SERVER_HOST", "127.0.0.1")
+    llama_server_port: int = _env_int("LLAMA_SERVER_PORT", 8081)
+    # How long to wait for llama-server to load the model before giving up
+    llama_server_startup_seconds: int = _env_int("LLAMA_SERVER_STARTUP_SECONDS", 120)
+    # Parallel decoding slots (continuous batching) and context per slot.
+    # 0 → use LLM_CONTEXT_TOKENS for each slot.
+    llama_server_slots: int = _env_int("LLAMA_SERVER_SLOTS", 1)
+    llama_server_slot_context: int = _env_int("LLAMA_SERVER_SLOT_CONTEXT", 0)
+
+    # Inference scheduler: concurrent local calls, queue bound and max queue wait.
+    # Requests beyond these limits are rejected with HTTP 429 / a "busy" reply.
+    inference_slots: int = _env_int("INFERENCE_SLOTS", 1)
+    inference_max_queue: int = _env_int("INFERENCE_MAX_QUEUE", 8)
+    inference_max_wait_seconds: float = _env_float("INFERENCE_MAX_WAIT_SECONDS", 60.0)
+
+    # Prompt/KV cache: reuse the evaluated system block (and optionally each
+    # user's history) instead of re-running prompt eval on every call.  On by
+    # default only for the resident engines: with llama-cli every new system
+    # prefix costs an extra warm-up run, and switching prefixes drops the
+    # cached one.
+    prompt_cache_enabled: bool = _env_bool(
+        "PROMPT_CACHE_ENABLED",
+        os.getenv("LLM_ENGINE", "subprocess").strip().lower() in ("server", "inprocess"),
+    )
+    prompt_cache_dir: Path = Path(os.getenv("PROMPT_CACHE_DIR", "./data/prompt_cache"))
+    prompt_cache_max_files: int = _env_int("PROMPT_CACHE_MAX_FILES", 32)
+    prompt_cache_max_mb: int = _env_int("PROMPT_CACHE_MAX_MB", 1024)
+    # Per-user KV files are ~100 KB per cached token for Gemma 2 2B — opt in.
+    prompt_cache_per_user: bool = _env_bool("PROMPT_CACHE_PER_USER", False)
+
+    # Semantic response cache: reuse replies to near-identical, non-personal
+    # questions (cosine similarity of message embeddings) for a while.
+    response_cache_enabled: bool = _env_bool("RESPONSE_CACHE_ENABLED", True)
+    response_cache_max_entries: int = _env_int("RESPONSE_CACHE_MAX_ENTRIES", 512)
+    response_cache_ttl_seconds: int = _env_int("RESPONSE_CACHE_TTL_SECONDS", 3600)
+    response_cache_min_similarity: float = _env_float("RESPONSE_CACHE_MIN_SIMILARITY", 0.95)
+
     groq_api_key: str = os.getenv("GROQ_API_KEY", "")
     groq_model: str = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")
 
@@ -0,0 +1,158 @@
+"""Nearest-centroid routing on the message embedding.
+
+Tier 3 used to spend a full Gemma call to pick a routing label.  The RAG
+embedder already embeds every message, so ``EmbeddingRouter`` compares that
+same vector against one centroid per label (the mean embedding of labelled
+examples) and turns the cosine similarities into probabilities with a
+temperature-scaled softmax.  That is one small matrix-vector product —
+microseconds — and the orchestrator only falls back to the LLM classifier
+when the top probability is below ``min_confidence``.
+
+Weights are trained from labelled JSONL examples by
+``scripts/train_router.py`` and stored as a compressed ``.npz`` file holding
+the labels, the centroid matrix, the temperature and the embedding model
+name (so a router trained for a different embedder is refused at load time).
+"""
+from __future__ import annotations
+
+import logging
+from pathlib import Path
+from typing import Any, Sequence
+
+logger = logging.getLogger(__name__)
+
+_TEMPERATURE_GRID = (0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5)
+
+
+def _numpy() -> Any:
+    try:
+        import numpy as _np  # type: ignore[import]
+    except ImportError as exc:
+        raise RuntimeError(
+            "numpy is not installed. Run: pip install -r requirements.txt"
+        ) from exc
+    return _np
+
+
+class EmbeddingRouter:
+    def __init__(
+        self,
+        labels: Sequence[str],
+        centroids: Any,
+        temperature: float = 0.05,
+        embedding_model: str = "",
+    ) -> None:
+        np = _numpy()
+        self._np = np
+        self.labels = [str(label) for label in labels]
+        matrix = np.asarray(centroids, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.centroids = matrix / np.maximum(norms, 1e-12)
+        self.temperature = float(temperature)
+        self.embedding_model = embedding_model
+
+    @property
+    def dimension(self) -> int:
+        return int(self.centroids.shape[1])
+
+    # ------------------------------------------------------------------
+    # Inference
+    # ------------------------------------------------------------------
+
+    def probabilities(self, vector: Any) -> dict[str, float]:
+        """Return P(label) for a unit-length message embedding."""
+        np = self._np
+        logits = (self.centroids @ np.asarray(vector, dtype=np.float32)) / self.temperature
+        weights = np.exp(logits - logits.max())
+        weights /= weights.sum()
+        return {label: float(weight) for label, weight in zip(self.labels, weights)}
+
+    def classify(self, vector: Any) -> tuple[str, float]:
+        """Return the best label and its probability."""
+        probabilities = self.probabilities(vector)
+        label = max(probabilities, key=probabilities.__getitem__)
+        return label, probabilities[label]
+
+    # ------------------------------------------------------------------
+    # Training and persistence
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def fit(
+        cls,
+        vectors: Any,
+        labels: Sequence[str],
+        embedding_model: str = "",
+    ) -> "EmbeddingRouter":
+        """Build centroids from unit-length example embeddings and calibrate the temperature.
+
+        The temperature is the grid value that minimises the negative
+        log-likelihood of the training labels, so reported probabilities are
+        roughly calibrated and ``min_confidence`` means what it says.
+        """
+        np = _numpy()
+        matrix = np.asarray(vectors, dtype=np.float32)
+        names = sorted(set(labels))
+        targets = np.array([names.index(label) for label in labels])
+        centroids = np.stack([matrix[targets == idx].mean(axis=0) for idx in range(len(names))])
+
+        router = cls(names, centroids, embedding_model=embedding_model)
+        similarities = matrix @ router.centroids.T
+        best_nll = float("inf")
+        for temperature in _TEMPERATURE_GRID:
+            logits = similarities / temperature
+            logits -= logits.max(axis=1, keepdims=True)
+            log_probs = logits - np.log(np.exp(logits).sum(axis=1, keepdims=True))
+            nll = float(-log_probs[np.arange(len(targets)), targets].mean())
+            if nll < best_nll:
+                best_nll, router.temperature = nll, temperature
+        return router
+
+    def save(self, path: Path) -> None:
+        np = self._np
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # np.savez appends ".npz" to names without it; write to the exact path.
+        with path.open("wb") as handle:
+            np.savez_compressed(
+                handle,
+                labels=np.array(self.labels),
+                centroids=self.centroids.astype(np.float16),
+                temperature=np.array(self.temperature),
+                embedding_model=np.array(self.embedding_model),
+            )
+
+    @classmethod
+    def load(
+        cls, path: Path, embedding_model: str = "", dimension: int = 0
+    ) -> "EmbeddingRouter | None":
+        """Load router weights, or return None if absent or built for another embedder."""
+        path = Path(path)
+        if not path.exists():
+            return None
+        np = _numpy()
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                router = cls(
+                    labels=[str(label) for label in data["labels"]],
+                    centroids=data["centroids"].astype(np.float32),
+                    temperature=float(data["temperature"]),
+                    embedding_model=str(data["embedding_model"]),
+                )
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Could not load embedding router %s: %s", path, exc)
+            return None
+
+        if embedding_model and router.embedding_model and router.embedding_model != embedding_model:
+            logger.warning(
+                "Embedding router %s was trained for %s, not %s — ignoring it",
+                path, router.embedding_model, embedding_model,
+            )
+            return None
+        if dimension and router.dimension != dimension:
+            logger.warning(
+                "Embedding router %s has dimension %d, embedder has %d — ignoring it",
+                path, router.dimension, dimension,
+            )
+            return None
+        return router
@@ -13,6 +13,7 @@ class CloudConfig:
     kimi_base_url: str
     kimi_model: str
     timeout_seconds: int = 25
+    max_output_tokens: int = 1024
 
 
 class CloudRouter:
@@ -66,7 +67,7 @@ class CloudRouter:
 
         generation_config = genai.types.GenerationConfig(
             temperature=0.2,
-            max_output_tokens=1024,
+            max_output_tokens=self.config.max_output_tokens,
         )
         self._gemini_model = genai.GenerativeModel(
             self.config.gemini_model,
@@ -86,7 +87,7 @@ class CloudRouter:
             model=self.config.groq_model,
             messages=[{"role": "user", "content": prompt}],
             temperature=0.2,
-            max_tokens=1024,
+            max_tokens=self.config.max_output_tokens,
         )
         content = response.choices[0].message.content
         return (content or "").strip()
@@ -107,7 +108,7 @@ class CloudRouter:
             model=self.config.kimi_model,
             messages=[{"role": "user", "content": prompt}],
             temperature=0.2,
-            max_tokens=1024,
+            max_tokens=self.config.max_output_tokens,
         )
         content = response.choices[0].message.content
         return (content or "").strip()
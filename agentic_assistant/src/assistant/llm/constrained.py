@@ -0,0 +1,89 @@
+"""Helpers for grammar-constrained label classification.
+
+The routing classifier only ever needs one of a handful of labels.  Instead of
+letting the model free-run for 16 tokens and scanning the text, the engines
+constrain decoding with a GBNF grammar that admits exactly those labels, and
+turn the per-token top-k probabilities into one probability per label.
+"""
+from __future__ import annotations
+
+import math
+from typing import Iterable, Sequence
+
+
+def label_grammar(labels: Sequence[str]) -> str:
+    """Return a GBNF grammar whose only sentences are *labels*."""
+    alternatives = " | ".join(f'"{label}"' for label in labels)
+    return f"root ::= {alternatives}"
+
+
+def one_hot(labels: Sequence[str], text: str) -> dict[str, float]:
+    """Probabilities for engines that only report the decoded text."""
+    decoded = text.strip().upper()
+    return {label: 1.0 if label == decoded else 0.0 for label in labels}
+
+
+def label_probabilities(
+    labels: Sequence[str],
+    steps: Iterable[tuple[str, Sequence[tuple[str, float]]]],
+) -> dict[str, float]:
+    """Estimate P(label) from a constrained decode's top-k token probabilities.
+
+    *steps* holds, for each decoded position, the chosen token and the top-k
+    ``(token, prob)`` candidates at that position.  Probability mass of
+    candidates that branch off the chosen path is credited to the labels that
+    branch still admits (split evenly when several do — under the grammar the
+    remaining tokens of a label are effectively forced).  The result is
+    normalised to sum to 1; it is all zeros if nothing matched.
+    """
+    scores = {label: 0.0 for label in labels}
+    emitted = ""
+    path_prob = 1.0
+
+    for chosen, candidates in steps:
+        chosen_prob = None
+        for token, prob in candidates:
+            if token == chosen:
+                chosen_prob = prob
+                continue
+            branch = emitted + token
+            matches = [label for label in labels if label.startswith(branch)]
+            for label in matches:
+                scores[label] += path_prob * prob / len(matches)
+
+        # The chosen token may be missing from top-k when probs are reported
+        # pre-grammar; treat it as certain rather than dropping the path.
+        path_prob *= chosen_prob if chosen_prob is not None else 1.0
+        emitted += chosen
+        if emitted.strip() in scores:
+            scores[emitted.strip()] += path_prob
+            break
+
+    total = sum(scores.values())
+    if total <= 0:
+        return scores
+    return {label: value / total for label, value in scores.items()}
+
+
+def server_probability_steps(
+    completion_probabilities: Iterable[dict],
+) -> list[tuple[str, list[tuple[str, float]]]]:
+    """Normalise llama-server ``completion_probabilities`` across API versions.
+
+    Older builds report ``{"content", "probs": [{"tok_str", "prob"}]}``; newer
+    ones ``{"token", "top_probs": [{"token", "prob"}]}`` or log-probs.
+    """
+    steps: list[tuple[str, list[tuple[str, float]]]] = []
+    for item in completion_probabilities:
+        chosen = str(item.get("token", item.get("content", "")))
+        raw = item.get("top_probs") or item.get("top_logprobs") or item.get("probs") or []
+        candidates: list[tuple[str, float]] = []
+        for cand in raw:
+            token = str(cand.get("token", cand.get("tok_str", "")))
+            if "prob" in cand:
+                prob = float(cand["prob"])
+            else:
+                prob = math.exp(float(cand.get("logprob", -math.inf)))
+            candidates.append((token, prob))
+        steps.append((chosen, candidates))
+    return steps
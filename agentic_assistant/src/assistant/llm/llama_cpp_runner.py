@@ -1,7 +1,17 @@
 from __future__ import annotations
 
+import codecs
+import os
 import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Iterator, Sequence
+
+from assistant.llm.constrained import label_grammar, one_hot
+from assistant.llm.prompt_cache import PromptCache, PromptCacheKey
+from assistant.prompt_budget import estimate_tokens
 
 
 # Sentinel value meaning "use the runner's default"
@@ -9,6 +19,8 @@ _DEFAULT = object()
 
 
 class LlamaCppRunner:
+    engine = "subprocess"  # reported as llm_engine in /health
+
     def __init__(
         self,
         executable_path: Path,
@@ -18,6 +30,7 @@ class LlamaCppRunner:
         max_tokens: int = 256,
         temperature: float = 0.2,
         timeout_seconds: int = 120,
+        prompt_cache: PromptCache | None = None,
     ) -> None:
         self.executable_path = Path(executable_path)
         self.model_path = Path(model_path)
@@ -26,8 +39,14 @@ class LlamaCppRunner:
         self.max_tokens = max_tokens
         self.temperature = temperature
         self.timeout_seconds = timeout_seconds
+        self.prompt_cache = prompt_cache
 
-    def _build_command(self, prompt: str, max_tokens_override: int | None = None) -> list[str]:
+    def _build_command(
+        self,
+        prompt: str,
+        max_tokens_override: int | None = None,
+        extra_args: list[str] | None = None,
+    ) -> list[str]:
         n_tokens = max_tokens_override if max_tokens_override is not None else self.max_tokens
         return [
             str(self.executable_path),
@@ -47,28 +66,98 @@ class LlamaCppRunner:
             "0",
             "--log-disable",   # suppress llama.cpp progress/noise from stdout
             "--no-display-prompt",  # llama-cli flag to omit echoed prompt in output
+            *(extra_args or []),
         ]
 
-    def generate(self, prompt: str, max_tokens_override: int | None = None) -> str:
+    # ------------------------------------------------------------------
+    # Prompt-cache (KV state reuse)
+    # ------------------------------------------------------------------
+
+    def _warm_prefix(self, key: PromptCacheKey, path: Path) -> None:
+        """Evaluate *key.prefix* once and persist its KV state to *path*."""
+        with self.prompt_cache.lock(path):  # type: ignore[union-attr]
+            if path.exists():
+                return
+            try:
+                subprocess.run(
+                    self._build_command(
+                        key.prefix, max_tokens_override=1, extra_args=["--prompt-cache", str(path)]
+                    ),
+                    text=True,
+                    capture_output=True,
+                    timeout=self.timeout_seconds,
+                )
+            except subprocess.TimeoutExpired:
+                path.unlink(missing_ok=True)
+
+    @contextmanager
+    def _prompt_cache_args(
+        self, prompt: str, cache_key: PromptCacheKey | None
+    ) -> Iterator[list[str]]:
+        """Yield llama-cli flags that load (and for sessions, update) cached KV state.
+
+        The shared prefix file is only ever read after it has been warmed, so
+        concurrent calls can use it; per-session files are rewritten by
+        llama-cli and are therefore locked for the duration of the call.
+        """
+        cache = self.prompt_cache
+        if cache is None or cache_key is None or not prompt.startswith(cache_key.prefix):
+            yield []
+            return
+
+        shared = cache.path_for(cache_key, shared=True)
+        if not shared.exists():
+            self._warm_prefix(cache_key, shared)
+
+        if not cache_key.session:
+            if shared.exists():
+                cache.touch(shared)
+                yield ["--prompt-cache", str(shared), "--prompt-cache-ro"]
+            else:
+                yield []
+            return
+
+        path = cache.path_for(cache_key)
+        if shared.exists():
+            cache.touch(shared)  # the prefix seeds every session — keep it hot
+        with cache.lock(path):
+            cache.seed(path, shared)
+            yield ["--prompt-cache", str(path)]
+        cache.touch(path)
+
+    def _check_paths(self) -> None:
+        if not self.executable_path.exists():
+            raise FileNotFoundError(f"llama executable not found: {self.executable_path}")
+        if not self.model_path.exists():
+            raise FileNotFoundError(f"model file not found: {self.model_path}")
+
+    def generate(
+        self,
+        prompt: str,
+        max_tokens_override: int | None = None,
+        cache_key: PromptCacheKey | None = None,
+    ) -> str:
         """Run inference and return the generated text only (prompt stripped).
 
         Args:
             prompt: The full prompt string.
             max_tokens_override: Override the default max_tokens for this call only.
                                  Useful for classification prompts that need very few tokens.
+            cache_key: Reuse cached KV state for the prompt prefix (and, if the
+                       key carries a session, that user's previous prompt).
         """
-        if not self.executable_path.exists():
-            raise FileNotFoundError(f"llama executable not found: {self.executable_path}")
-        if not self.model_path.exists():
-            raise FileNotFoundError(f"model file not found: {self.model_path}")
+        self._check_paths()
 
         try:
-            process = subprocess.run(
-                self._build_command(prompt, max_tokens_override=max_tokens_override),
-                text=True,
-                capture_output=True,
-                timeout=self.timeout_seconds,
-            )
+            with self._prompt_cache_args(prompt, cache_key) as cache_args:
+                process = subprocess.run(
+                    self._build_command(
+                        prompt, max_tokens_override=max_tokens_override, extra_args=cache_args
+                    ),
+                    text=True,
+                    capture_output=True,
+                    timeout=self.timeout_seconds,
+                )
         except subprocess.TimeoutExpired as exc:
             raise RuntimeError(
                 f"llama.cpp inference timed out after {self.timeout_seconds}s"
@@ -89,6 +178,86 @@ class LlamaCppRunner:
 
         return output
 
+    def generate_stream(
+        self,
+        prompt: str,
+        max_tokens_override: int | None = None,
+        cache_key: PromptCacheKey | None = None,
+    ) -> Iterator[str]:
+        """Yield generated text incrementally as llama-cli writes it to stdout.
+
+        Same contract as :meth:`generate`, except that text is yielded as soon
+        as it is produced so callers can forward it before decoding finishes.
+        Leading whitespace is dropped so the concatenated deltas match
+        ``generate(...)`` modulo trailing whitespace.
+        """
+        self._check_paths()
+
+        with self._prompt_cache_args(prompt, cache_key) as cache_args, \
+                tempfile.TemporaryFile() as stderr_file:
+            process = subprocess.Popen(
+                self._build_command(
+                    prompt, max_tokens_override=max_tokens_override, extra_args=cache_args
+                ),
+                stdout=subprocess.PIPE,
+                stderr=stderr_file,
+            )
+            timed_out = threading.Event()
+
+            def _kill_on_timeout() -> None:
+                timed_out.set()
+                process.kill()
+
+            watchdog = threading.Timer(self.timeout_seconds, _kill_on_timeout)
+            watchdog.start()
+            try:
+                assert process.stdout is not None
+                fd = process.stdout.fileno()
+                decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+                # Older llama-cli builds echo the prompt even with
+                # --no-display-prompt; hold output back until we know.
+                pending = ""
+                echo_checked = False
+                started = False
+                while True:
+                    raw = os.read(fd, 4096)
+                    text = decoder.decode(raw, final=not raw)
+                    pending += text
+                    if not echo_checked:
+                        if len(pending) < len(prompt) and prompt.startswith(pending) and raw:
+                            continue
+                        if pending.startswith(prompt):
+                            pending = pending[len(prompt):]
+                        echo_checked = True
+                    if not started:
+                        pending = pending.lstrip()
+                        started = bool(pending)
+                    if pending:
+                        yield pending
+                        pending = ""
+                    if not raw:
+                        break
+                returncode = process.wait()
+            finally:
+                watchdog.cancel()
+                if process.poll() is None:
+                    # Consumer stopped iterating early — don't leave llama-cli running.
+                    process.kill()
+                    process.wait()
+                if process.stdout is not None:
+                    process.stdout.close()
+
+            if timed_out.is_set():
+                raise RuntimeError(
+                    f"llama.cpp inference timed out after {self.timeout_seconds}s"
+                )
+            if returncode != 0:
+                stderr_file.seek(0)
+                stderr_snippet = stderr_file.read(400).decode("utf-8", errors="replace").strip()
+                raise RuntimeError(
+                    f"llama.cpp exited with code {returncode}: {stderr_snippet}"
+                )
+
     # ------------------------------------------------------------------
     # Convenience: thin classification call (very few tokens)
     # ------------------------------------------------------------------
@@ -96,3 +265,43 @@ class LlamaCppRunner:
     def classify(self, prompt: str) -> str:
         """Run inference with max_tokens=16 for routing classification queries."""
         return self.generate(prompt, max_tokens_override=16)
+
+    def classify_labels(self, prompt: str, labels: Sequence[str]) -> dict[str, float]:
+        """Constrained classification: decode exactly one of *labels*.
+
+        A GBNF grammar restricts sampling to the label strings, so the model
+        cannot wander off into free text.  llama-cli does not report token
+        probabilities, so the result is one-hot on the decoded label.
+        """
+        self._check_paths()
+        # Generous token budget: the grammar ends generation once a label is complete.
+        command = self._build_command(
+            prompt,
+            max_tokens_override=8,
+            extra_args=["--grammar", label_grammar(labels)],
+        )
+        try:
+            process = subprocess.run(
+                command, text=True, capture_output=True, timeout=self.timeout_seconds
+            )
+        except subprocess.TimeoutExpired as exc:
+            raise RuntimeError(
+                f"llama.cpp classification timed out after {self.timeout_seconds}s"
+            ) from exc
+        if process.returncode != 0:
+            stderr_snippet = (process.stderr or "")[:400].strip()
+            raise RuntimeError(
+                f"llama.cpp exited with code {process.returncode}: {stderr_snippet}"
+            )
+        output = process.stdout.strip()
+        if output.startswith(prompt):
+            output = output[len(prompt):]
+        return one_hot(labels, output)
+
+    def count_tokens(self, text: str) -> int:
+        """Approximate token count of *text*.
+
+        Spawning a tokenizer process per call would cost more than the
+        estimate saves, so the subprocess engine uses the character heuristic.
+        """
+        return estimate_tokens(text)
@@ -0,0 +1,263 @@
+"""In-process llama.cpp engine (llama-cpp-python bindings).
+
+``LlamaInProcessRunner`` loads the GGUF into the API process itself, so there
+is no process spawn per call (subprocess engine) and no HTTP hop (server
+engine).  Owning the model directly also gives us:
+
+* exact tokenization for prompt budgeting (``count_tokens``),
+* per-token callbacks (``generate(..., on_token=...)``) and streaming, and
+* the raw logits, so routing classification reads label probabilities from
+  a single forward pass instead of decoding text.
+
+Weights are mmapped (``use_mmap``) and every ``Llama`` handle for the same
+file and settings is shared across runners.  The classifier runs in its own
+small context on the same GGUF — the kernel maps the file once, so the
+weights are not duplicated, and classification never evicts the generation
+context's cached prompt prefix.
+
+CPU-only and offline: ``n_gpu_layers=0`` and the model is loaded from
+``MODEL_PATH``; nothing is downloaded.
+"""
+from __future__ import annotations
+
+import logging
+import math
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Iterator, Sequence
+
+from assistant.llm.llama_cpp_runner import LlamaCppRunner
+from assistant.llm.prompt_cache import PromptCache, PromptCacheKey
+
+logger = logging.getLogger(__name__)
+
+_CLASSIFY_CONTEXT_TOKENS = 512  # classifier prompt + trimmed message fit easily
+
+# (model path, n_ctx, threads) → shared Llama handle and the lock guarding its context
+_shared_models: dict[tuple[str, int, int], tuple[Any, threading.Lock]] = {}
+_shared_guard = threading.Lock()
+
+
+def _import_llama_cpp():
+    try:
+        import llama_cpp
+    except ImportError as exc:
+        raise RuntimeError(
+            "llama-cpp-python is not installed — pip install llama-cpp-python"
+        ) from exc
+    return llama_cpp
+
+
+def _load_shared(model_path: Path, n_ctx: int, threads: int) -> tuple[Any, threading.Lock]:
+    """Return the process-wide ``Llama`` (and its lock) for these settings, loading it once."""
+    key = (str(model_path.resolve()), n_ctx, threads)
+    with _shared_guard:
+        entry = _shared_models.get(key)
+        if entry is None:
+            llama_cpp = _import_llama_cpp()
+            logger.info("Loading %s in-process (n_ctx=%d)", model_path.name, n_ctx)
+            llm = llama_cpp.Llama(
+                model_path=str(model_path),
+                n_ctx=n_ctx,
+                n_threads=threads,
+                n_gpu_layers=0,
+                use_mmap=True,
+                use_mlock=False,
+                verbose=False,
+            )
+            # A llama context is single-threaded; every user of the handle
+            # takes this lock.
+            entry = (llm, threading.Lock())
+            _shared_models[key] = entry
+        return entry
+
+
+class LlamaInProcessRunner(LlamaCppRunner):
+    """Drop-in replacement for ``LlamaCppRunner`` running llama.cpp in-process."""
+
+    engine = "inprocess"
+
+    def __init__(
+        self,
+        model_path: Path,
+        threads: int = 4,
+        context_tokens: int = 2048,
+        max_tokens: int = 256,
+        temperature: float = 0.2,
+        timeout_seconds: int = 120,
+        prompt_cache: PromptCache | None = None,
+    ) -> None:
+        super().__init__(
+            # No external binary: the model file is the only path to check.
+            executable_path=model_path,
+            model_path=model_path,
+            threads=threads,
+            context_tokens=context_tokens,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            timeout_seconds=timeout_seconds,
+            prompt_cache=prompt_cache,
+        )
+        self._llm: tuple[Any, threading.Lock] | None = None
+        self._classifier: tuple[Any, threading.Lock] | None = None
+        self._load_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Model lifecycle
+    # ------------------------------------------------------------------
+
+    def _model(self) -> tuple[Any, threading.Lock]:
+        if self._llm is not None:
+            return self._llm
+        with self._load_lock:
+            if self._llm is None:
+                self._check_paths()
+                entry = _load_shared(self.model_path, self.context_tokens, self.threads)
+                if self.prompt_cache is not None:
+                    # llama.cpp already reuses the longest common prefix with the
+                    # previous call; the RAM cache also keeps other users' states.
+                    llama_cpp = _import_llama_cpp()
+                    entry[0].set_cache(
+                        llama_cpp.LlamaRAMCache(capacity_bytes=self.prompt_cache.max_bytes)
+                    )
+                self._llm = entry
+        return self._llm
+
+    def _classifier_model(self) -> tuple[Any, threading.Lock]:
+        if self._classifier is not None:
+            return self._classifier
+        with self._load_lock:
+            if self._classifier is None:
+                self._check_paths()
+                n_ctx = min(_CLASSIFY_CONTEXT_TOKENS, self.context_tokens)
+                self._classifier = _load_shared(self.model_path, n_ctx, self.threads)
+        return self._classifier
+
+    def start(self) -> None:
+        """Load the model now instead of on the first request."""
+        self._model()
+
+    def stop(self) -> None:
+        """Drop this runner's handles; the shared models stay mapped for other runners."""
+        with self._load_lock:
+            self._llm = None
+            self._classifier = None
+
+    def _check_paths(self) -> None:
+        if not self.model_path.exists():
+            raise FileNotFoundError(f"model file not found: {self.model_path}")
+
+    # ------------------------------------------------------------------
+    # Generation
+    # ------------------------------------------------------------------
+
+    def _completion_chunks(self, prompt: str, max_tokens_override: int | None) -> Iterator[str]:
+        """Yield raw text deltas while holding the generation context."""
+        llama_cpp = _import_llama_cpp()
+        llm, lock = self._model()
+        n_tokens = max_tokens_override if max_tokens_override is not None else self.max_tokens
+        deadline = time.monotonic() + self.timeout_seconds
+        timed_out = False
+
+        def _past_deadline(_input_ids: Any, _logits: Any) -> bool:
+            nonlocal timed_out
+            timed_out = time.monotonic() > deadline
+            return timed_out
+
+        with lock:
+            for chunk in llm.create_completion(
+                prompt,
+                max_tokens=n_tokens,
+                temperature=self.temperature,
+                stream=True,
+                stopping_criteria=llama_cpp.StoppingCriteriaList([_past_deadline]),
+            ):
+                text = chunk["choices"][0].get("text", "")
+                if text:
+                    yield text
+        if timed_out:
+            raise RuntimeError(f"llama.cpp inference timed out after {self.timeout_seconds}s")
+
+    def generate(
+        self,
+        prompt: str,
+        max_tokens_override: int | None = None,
+        cache_key: PromptCacheKey | None = None,
+        on_token: Callable[[str], None] | None = None,
+    ) -> str:
+        """Run inference in-process and return the generated text.
+
+        *cache_key* is accepted for interface parity; prefix reuse is automatic
+        here.  *on_token*, if given, is called with each text delta as it is
+        decoded.
+        """
+        parts: list[str] = []
+        for delta in self._completion_chunks(prompt, max_tokens_override):
+            parts.append(delta)
+            if on_token is not None:
+                on_token(delta)
+        return "".join(parts).strip()
+
+    def generate_stream(
+        self,
+        prompt: str,
+        max_tokens_override: int | None = None,
+        cache_key: PromptCacheKey | None = None,
+    ) -> Iterator[str]:
+        """Yield generated text token-by-token (leading whitespace dropped)."""
+        started = False
+        for delta in self._completion_chunks(prompt, max_tokens_override):
+            if not started:
+                delta = delta.lstrip()
+                started = bool(delta)
+            if delta:
+                yield delta
+
+    # ------------------------------------------------------------------
+    # Tokenizer and logits
+    # ------------------------------------------------------------------
+
+    def count_tokens(self, text: str) -> int:
+        """Exact token count of *text* with the model's own tokenizer."""
+        # Tokenization only reads the vocabulary, so it does not take the
+        # context lock and never waits behind a running generation.
+        return len(self._model()[0].tokenize(text.encode("utf-8"), add_bos=False, special=True))
+
+    def classify_labels(self, prompt: str, labels: Sequence[str]) -> dict[str, float]:
+        """Label probabilities from one forward pass over *prompt*.
+
+        Under a grammar that only admits *labels*, the first decoded token
+        decides the label (the rest is forced), so the distribution over the
+        labels' first tokens — renormalised among themselves — is exactly the
+        constrained classifier's.  Labels sharing a first token split its mass.
+        """
+        llm, lock = self._classifier_model()
+        first_ids: dict[str, int] = {}
+        for label in labels:
+            ids = llm.tokenize(label.encode("utf-8"), add_bos=False, special=False)
+            if ids:
+                first_ids[label] = ids[0]
+        if not first_ids:
+            return {label: 0.0 for label in labels}
+
+        llama_cpp = _import_llama_cpp()
+        tokens = llm.tokenize(prompt.encode("utf-8"), add_bos=True, special=True)
+        with lock:
+            llm.reset()
+            llm.eval(tokens)
+            # Llama.scores is only filled with logits_all=True; without it
+            # llama.cpp still computes the last position's logits, read here.
+            row = llama_cpp.llama_get_logits_ith(llm.ctx, -1)
+            logits = {tid: float(row[tid]) for tid in set(first_ids.values())}
+
+        peak = max(logits.values())
+        weights = {tid: math.exp(value - peak) for tid, value in logits.items()}
+        total = sum(weights.values())
+        sharing = {tid: list(first_ids.values()).count(tid) for tid in weights}
+        return {
+            label: (weights[first_ids[label]] / total / sharing[first_ids[label]])
+            if label in first_ids
+            else 0.0
+            for label in labels
+        }
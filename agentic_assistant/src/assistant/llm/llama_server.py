@@ -0,0 +1,446 @@
+"""Resident llama-server engine.
+
+``LlamaCppRunner`` spawns ``llama-cli`` for every call, so the GGUF weights are
+mmapped and warmed up again for each reply and each routing classification.
+``LlamaServerRunner`` keeps one ``llama-server`` process alive for the lifetime
+of the API and talks to it over localhost HTTP.  The public interface
+(``generate`` / ``generate_stream`` / ``classify``) is identical, so the
+orchestrator does not care which engine it was given.
+
+The child process is supervised: if it exits (OOM kill, segfault, …) the next
+call restarts it transparently.
+
+Parallel decoding: the server is started with ``parallel_slots`` slots
+(``--parallel``) and continuous batching, so concurrent requests are decoded
+together in shared batches instead of one after another.  Each call is pinned
+to an explicit slot id; a call prefers the slot that last served the same user
+(or the same prompt prefix) so that slot's cached KV state is reused.
+
+Prompt reuse: every completion is sent with ``cache_prompt`` so the slot keeps
+the KV state of the shared system prefix in RAM.  When a ``PromptCache`` is
+configured and a call carries a session id, that user's slot state is
+restored from / saved to disk around the call (``--slot-save-path``) unless
+the slot already holds it.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Sequence
+
+import httpx
+
+from assistant.llm.constrained import (
+    label_grammar,
+    label_probabilities,
+    one_hot,
+    server_probability_steps,
+)
+from assistant.llm.llama_cpp_runner import LlamaCppRunner
+from assistant.llm.prompt_cache import PromptCache, PromptCacheKey
+
+logger = logging.getLogger(__name__)
+
+_HEALTH_POLL_INTERVAL = 0.5   # seconds between readiness probes during startup
+_STOP_GRACE_SECONDS = 10      # time allowed for a clean shutdown before SIGKILL
+_CLASSIFY_OWNER = "\x00classify"  # slot-affinity key for routing classification
+
+
+class _SlotPool:
+    """Hands out llama-server slot ids, preferring the slot last used by the same owner."""
+
+    def __init__(self, count: int) -> None:
+        self._cond = threading.Condition()
+        # Free slots in least-recently-released order.
+        self._free: list[int] = list(range(count))
+        self._owner: dict[int, str] = {}
+
+    def acquire(self, owner: str, timeout: float) -> tuple[int, bool]:
+        """Return ``(slot_id, reused)``; *reused* means the slot last served *owner*."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self._free:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RuntimeError(f"no llama-server slot became free within {timeout}s")
+                self._cond.wait(remaining)
+            slot_id = next((sid for sid in self._free if self._owner.get(sid) == owner), None)
+            reused = slot_id is not None
+            if slot_id is None:
+                slot_id = self._free[0]
+            self._free.remove(slot_id)
+            self._owner[slot_id] = owner
+            return slot_id, reused
+
+    def release(self, slot_id: int) -> None:
+        with self._cond:
+            self._free.append(slot_id)
+            self._cond.notify()
+
+    def forget(self) -> None:
+        """Drop affinity after a restart — the new process has empty slots."""
+        with self._cond:
+            self._owner.clear()
+
+
+class LlamaServerRunner(LlamaCppRunner):
+    """Drop-in replacement for ``LlamaCppRunner`` backed by a resident llama-server."""
+
+    engine = "server"
+
+    def __init__(
+        self,
+        executable_path: Path,
+        model_path: Path,
+        threads: int = 4,
+        context_tokens: int = 2048,
+        max_tokens: int = 256,
+        temperature: float = 0.2,
+        timeout_seconds: int = 120,
+        host: str = "127.0.0.1",
+        port: int = 8081,
+        startup_timeout_seconds: int = 120,
+        prompt_cache: PromptCache | None = None,
+        parallel_slots: int = 1,
+    ) -> None:
+        super().__init__(
+            executable_path=executable_path,
+            model_path=model_path,
+            threads=threads,
+            context_tokens=context_tokens,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            timeout_seconds=timeout_seconds,
+            prompt_cache=prompt_cache,
+        )
+        self.host = host
+        self.port = port
+        self.startup_timeout_seconds = startup_timeout_seconds
+        self.parallel_slots = max(1, parallel_slots)
+        self.base_url = f"http://{host}:{port}"
+
+        self._process: subprocess.Popen | None = None  # type: ignore[type-arg]
+        self._client = httpx.Client(
+            base_url=self.base_url,
+            timeout=timeout_seconds,
+            # One connection per slot plus headroom for slot save/restore calls.
+            limits=httpx.Limits(max_connections=self.parallel_slots * 2 + 2),
+        )
+        # Guards process start/stop; generation requests do not take it.
+        self._lock = threading.Lock()
+        self._ready = False   # set once /health answers 200 for the current process
+        self._slots = _SlotPool(self.parallel_slots)
+        self.restart_count = 0
+
+    # ------------------------------------------------------------------
+    # Process supervision
+    # ------------------------------------------------------------------
+
+    def _build_server_command(self) -> list[str]:
+        cache_args = (
+            ["--slot-save-path", str(self.prompt_cache.cache_dir)]
+            if self.prompt_cache is not None
+            else []
+        )
+        return [
+            str(self.executable_path),
+            "-m",
+            str(self.model_path),
+            "-t",
+            str(self.threads),
+            # llama-server splits -c evenly across slots, so scale it up to
+            # give every slot the full per-request context window.
+            "-c",
+            str(self.context_tokens * self.parallel_slots),
+            "--parallel",
+            str(self.parallel_slots),
+            "--cont-batching",
+            "-ngl",
+            "0",
+            "--host",
+            self.host,
+            "--port",
+            str(self.port),
+            "--log-disable",
+            *cache_args,
+        ]
+
+    def is_running(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def start(self) -> None:
+        """Start llama-server (if not already running) and wait until it is ready."""
+        with self._lock:
+            self._start_locked()
+
+    def _start_locked(self) -> None:
+        if self.is_running() and self._ready:
+            return
+        if not self.executable_path.exists():
+            raise FileNotFoundError(f"llama-server executable not found: {self.executable_path}")
+        if not self.model_path.exists():
+            raise FileNotFoundError(f"model file not found: {self.model_path}")
+
+        if self._process is not None:
+            # The previous child died on its own — record it and start over.
+            logger.warning(
+                "llama-server exited with code %s; restarting", self._process.returncode
+            )
+            self.restart_count += 1
+
+        logger.info(
+            "Starting llama-server on %s (%d slot(s))", self.base_url, self.parallel_slots
+        )
+        self._slots.forget()
+        self._ready = False
+        self._process = subprocess.Popen(
+            self._build_server_command(),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        self._wait_until_ready()
+        self._ready = True
+
+    def _wait_until_ready(self) -> None:
+        # llama-server answers /health with 503 while the model is loading.
+        deadline = time.monotonic() + self.startup_timeout_seconds
+        while time.monotonic() < deadline:
+            if self._process is None or self._process.poll() is not None:
+                code = self._process.returncode if self._process is not None else None
+                raise RuntimeError(f"llama-server exited during startup with code {code}")
+            try:
+                resp = self._client.get("/health", timeout=2.0)
+                if resp.status_code == 200:
+                    logger.info("llama-server ready")
+                    return
+            except httpx.TransportError:
+                pass
+            time.sleep(_HEALTH_POLL_INTERVAL)
+
+        self._stop_locked()
+        raise RuntimeError(
+            f"llama-server did not become ready within {self.startup_timeout_seconds}s"
+        )
+
+    def stop(self) -> None:
+        """Terminate the resident llama-server process."""
+        with self._lock:
+            self._stop_locked()
+
+    def _stop_locked(self) -> None:
+        if self._process is None:
+            return
+        if self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=_STOP_GRACE_SECONDS)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+        self._process = None
+        self._ready = False
+
+    def _ensure_running(self) -> None:
+        if self._ready and self.is_running():
+            return
+        with self._lock:
+            self._start_locked()
+
+    # ------------------------------------------------------------------
+    # HTTP helpers
+    # ------------------------------------------------------------------
+
+    def _post(self, path: str, payload: dict) -> dict:
+        """POST to llama-server, restarting it once if the connection fails."""
+        self._ensure_running()
+        try:
+            resp = self._client.post(path, json=payload)
+        except httpx.TimeoutException as exc:
+            raise RuntimeError(
+                f"llama-server inference timed out after {self.timeout_seconds}s"
+            ) from exc
+        except httpx.TransportError:
+            # The child may have crashed between the liveness check and the
+            # request — restart and retry exactly once.
+            self._ensure_running()
+            try:
+                resp = self._client.post(path, json=payload)
+            except httpx.HTTPError as exc:
+                raise RuntimeError(f"llama-server request failed: {exc}") from exc
+
+        if resp.status_code != 200:
+            raise RuntimeError(
+                f"llama-server returned HTTP {resp.status_code}: {resp.text[:400].strip()}"
+            )
+        return resp.json()
+
+    def _stream_events(self, path: str, payload: dict) -> Iterator[dict]:
+        """POST a streaming request and yield each decoded SSE ``data:`` event."""
+        with self._client.stream("POST", path, json=payload) as resp:
+            if resp.status_code != 200:
+                resp.read()
+                raise RuntimeError(
+                    f"llama-server returned HTTP {resp.status_code}: {resp.text[:400].strip()}"
+                )
+            for line in resp.iter_lines():
+                if not line.startswith("data:"):
+                    continue
+                body = line[len("data:"):].strip()
+                if not body or body == "[DONE]":
+                    continue
+                yield json.loads(body)
+
+    # ------------------------------------------------------------------
+    # Per-session slot state
+    # ------------------------------------------------------------------
+
+    def _slot_action(self, slot_id: int, action: str, filename: str) -> bool:
+        try:
+            resp = self._client.post(
+                f"/slots/{slot_id}", params={"action": action}, json={"filename": filename}
+            )
+        except httpx.HTTPError as exc:
+            logger.warning("llama-server slot %s failed: %s", action, exc)
+            return False
+        if resp.status_code != 200:
+            logger.warning("llama-server slot %s returned HTTP %d", action, resp.status_code)
+            return False
+        return True
+
+    @contextmanager
+    def _claim_slot(self, cache_key: PromptCacheKey | None, owner: str = "") -> Iterator[dict]:
+        """Pin the call to a slot and yield the completion fields that select it.
+
+        Per-session KV state is restored into the slot first (unless the slot
+        already served that session) and saved back afterwards.
+        """
+        cache = self.prompt_cache
+        session = cache_key.session if cache_key is not None else ""
+        if not owner:
+            owner = session or (cache_key.prefix if cache_key is not None else "")
+
+        self._ensure_running()
+        slot_id, reused = self._slots.acquire(owner, timeout=self.timeout_seconds)
+        try:
+            if cache is None or cache_key is None or not session:
+                yield {"id_slot": slot_id}
+                return
+
+            path = cache.path_for(cache_key)
+            with cache.lock(path):
+                if not reused and path.exists():
+                    self._slot_action(slot_id, "restore", path.name)
+                yield {"id_slot": slot_id}
+                self._slot_action(slot_id, "save", path.name)
+            cache.touch(path)
+        finally:
+            self._slots.release(slot_id)
+
+    # ------------------------------------------------------------------
+    # Public interface (mirrors LlamaCppRunner)
+    # ------------------------------------------------------------------
+
+    def _completion_payload(
+        self, prompt: str, max_tokens_override: int | None, stream: bool
+    ) -> dict:
+        n_tokens = max_tokens_override if max_tokens_override is not None else self.max_tokens
+        return {
+            "prompt": prompt,
+            "n_predict": n_tokens,
+            "temperature": self.temperature,
+            "stream": stream,
+            # Keep the evaluated prompt in the slot so the common prefix
+            # (system block + history) is not re-evaluated next time.
+            "cache_prompt": True,
+        }
+
+    def generate(
+        self,
+        prompt: str,
+        max_tokens_override: int | None = None,
+        cache_key: PromptCacheKey | None = None,
+    ) -> str:
+        """Run inference on the resident server and return the generated text."""
+        payload = self._completion_payload(prompt, max_tokens_override, stream=False)
+        with self._claim_slot(cache_key) as slot_fields:
+            data = self._post("/completion", {**payload, **slot_fields})
+        return str(data.get("content", "")).strip()
+
+    def generate_stream(
+        self,
+        prompt: str,
+        max_tokens_override: int | None = None,
+        cache_key: PromptCacheKey | None = None,
+    ) -> Iterator[str]:
+        """Yield generated text token-by-token using llama-server's SSE stream."""
+        with self._claim_slot(cache_key) as slot_fields:
+            payload = {
+                **self._completion_payload(prompt, max_tokens_override, stream=True),
+                **slot_fields,
+            }
+            yield from self._stream_completion(payload)
+
+    def _stream_completion(self, payload: dict) -> Iterator[str]:
+        self._ensure_running()
+        started = False
+        for attempt in range(2):
+            try:
+                for event in self._stream_events("/completion", payload):
+                    delta = str(event.get("content", ""))
+                    if not started:
+                        delta = delta.lstrip()
+                        started = bool(delta)
+                    if delta:
+                        yield delta
+                    if event.get("stop"):
+                        return
+                return
+            except httpx.TimeoutException as exc:
+                raise RuntimeError(
+                    f"llama-server inference timed out after {self.timeout_seconds}s"
+                ) from exc
+            except httpx.TransportError as exc:
+                # Only retry if nothing has been emitted yet; a half-streamed
+                # reply cannot be resumed transparently.
+                if started or attempt:
+                    raise RuntimeError(f"llama-server stream failed: {exc}") from exc
+                self._ensure_running()
+
+    def classify_labels(self, prompt: str, labels: Sequence[str]) -> dict[str, float]:
+        """Constrained classification with per-label probabilities.
+
+        Decoding is restricted to *labels* by a GBNF grammar and run greedily;
+        the server's top-k token probabilities are folded into one
+        probability per label so callers can apply a confidence threshold.
+        """
+        with self._claim_slot(None, owner=_CLASSIFY_OWNER) as slot_fields:
+            data = self._post(
+                "/completion",
+                {
+                    "prompt": prompt,
+                    "n_predict": 8,
+                    "temperature": 0.0,
+                    "grammar": label_grammar(labels),
+                    "n_probs": max(4, len(labels)),
+                    "post_sampling_probs": True,
+                    "cache_prompt": True,
+                    "stream": False,
+                    **slot_fields,
+                },
+            )
+        steps = server_probability_steps(data.get("completion_probabilities") or [])
+        probabilities = label_probabilities(labels, steps)
+        if not any(probabilities.values()):
+            # No usable probabilities (old server build) — trust the decoded label.
+            return one_hot(labels, str(data.get("content", "")))
+        return probabilities
+
+    def count_tokens(self, text: str) -> int:
+        """Exact token count of *text* using the loaded model's tokenizer."""
+        data = self._post("/tokenize", {"content": text})
+        return len(data.get("tokens") or [])
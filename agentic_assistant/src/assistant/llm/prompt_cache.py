@@ -0,0 +1,155 @@
+"""On-disk llama.cpp prompt/KV cache bookkeeping.
+
+Every local prompt starts with the same system block, and a user's history
+block grows by one turn per message.  llama.cpp can persist the evaluated KV
+state of a prompt (``--prompt-cache`` for llama-cli, slot save/restore for
+llama-server) and, on the next call, only evaluate the suffix that differs.
+
+``PromptCache`` decides *which* file a call should use and keeps the directory
+bounded:
+
+* one shared file per distinct prompt prefix (i.e. per personality), and
+* optionally one file per ``(prefix, session)`` pair for per-user history.
+
+File names embed a fingerprint of the model file and a hash of the prefix, so
+swapping the GGUF or editing the personality never reuses stale KV state —
+files from other models are purged at startup and files from other prefixes
+are purged as soon as a new prefix is seen.  The directory is capped by file
+count and total size, evicting least-recently-used files first.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+_SUFFIX = ".bin"
+
+
+@dataclass(frozen=True)
+class PromptCacheKey:
+    """Identifies reusable prompt state for one call.
+
+    Attributes:
+        prefix:  Stable leading text shared by many prompts (the system block).
+                 The prompt passed to the runner must start with it.
+        session: Optional per-user id.  Empty means "shared prefix only".
+    """
+
+    prefix: str
+    session: str = ""
+
+
+def _digest(text: str, length: int = 12) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:length]
+
+
+class PromptCache:
+    def __init__(
+        self,
+        cache_dir: Path,
+        model_path: Path,
+        max_files: int = 32,
+        max_bytes: int = 1024 * 1024 * 1024,
+    ) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_files = max(1, max_files)
+        self.max_bytes = max_bytes
+        self.model_fingerprint = self._fingerprint_model(Path(model_path))
+
+        self._locks: dict[Path, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self._active_prefix = ""
+
+        self._purge(lambda name: not name.startswith(self.model_fingerprint + "-"))
+
+    # ------------------------------------------------------------------
+    # Internal helpers
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _fingerprint_model(model_path: Path) -> str:
+        try:
+            stat = model_path.stat()
+            ident = f"{model_path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+        except OSError:
+            ident = str(model_path)
+        return _digest(ident, 10)
+
+    def _files(self) -> list[Path]:
+        return [p for p in self.cache_dir.glob(f"*{_SUFFIX}") if p.is_file()]
+
+    def _purge(self, should_delete: Callable[[str], bool]) -> None:
+        for path in self._files():
+            if should_delete(path.name):
+                path.unlink(missing_ok=True)
+
+    def _note_prefix(self, prefix_hash: str) -> None:
+        """Drop files belonging to a previous prefix (personality changed)."""
+        if prefix_hash == self._active_prefix:
+            return
+        with self._locks_guard:
+            if prefix_hash == self._active_prefix:
+                return
+            if self._active_prefix:
+                logger.info("Prompt prefix changed — invalidating cached prompt state")
+            own = f"{self.model_fingerprint}-{prefix_hash}-"
+            self._purge(lambda name: not name.startswith(own))
+            self._active_prefix = prefix_hash
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def path_for(self, key: PromptCacheKey, shared: bool = False) -> Path:
+        """Return the cache file for *key* (or for its shared prefix when *shared*)."""
+        prefix_hash = _digest(key.prefix)
+        self._note_prefix(prefix_hash)
+        session = "shared" if shared or not key.session else _digest(key.session)
+        return self.cache_dir / f"{self.model_fingerprint}-{prefix_hash}-{session}{_SUFFIX}"
+
+    def lock(self, path: Path) -> threading.Lock:
+        """Per-file lock: llama.cpp rewrites cache files in place."""
+        with self._locks_guard:
+            return self._locks.setdefault(path, threading.Lock())
+
+    def seed(self, path: Path, source: Path) -> None:
+        """Initialise a session file from the shared prefix so its prefix is reused."""
+        if source.exists() and not path.exists():
+            shutil.copyfile(source, path)
+
+    def touch(self, path: Path) -> None:
+        """Mark *path* as recently used and enforce the size/count limits."""
+        if path.exists():
+            os.utime(path)
+        self.evict()
+
+    def evict(self) -> None:
+        files = self._files()
+        entries = []
+        for path in files:
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()  # oldest first
+        total = sum(size for _, size, _ in entries)
+        while entries and (len(entries) > self.max_files or total > self.max_bytes):
+            _, size, path = entries.pop(0)
+            lock = self.lock(path)
+            if not lock.acquire(blocking=False):
+                continue  # in use right now — leave it
+            try:
+                path.unlink(missing_ok=True)
+                total -= size
+            finally:
+                lock.release()
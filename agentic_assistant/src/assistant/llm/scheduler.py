@@ -0,0 +1,278 @@
+"""Priority scheduler and admission control for local inference.
+
+The API threadpool, the Telegram poller and the Discord bot all call the local
+runner from arbitrary threads.  Without coordination a burst spawns N llama
+processes that fight over the Pi's 4 cores until every one of them times out.
+
+``InferenceScheduler`` wraps a runner and exposes the same interface
+(``generate`` / ``generate_stream`` / ``classify`` / ``classify_labels``), but
+only lets ``slots`` calls run at once.  Waiting calls are served by priority:
+
+  1. routing classification (short, and it gates a generation)
+  2. interactive API requests
+  3. bot traffic (default)
+
+Callers mark interactive work with ``with inference_priority(Priority.INTERACTIVE)``.
+When the queue is full, the predicted wait is too long, or a call waits past
+``max_wait_seconds``, ``SchedulerBusyError`` is raised so the caller can answer
+"busy" (HTTP 429) instead of timing out.
+"""
+from __future__ import annotations
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Any, Iterator, Sequence
+
+from assistant.llm.prompt_cache import PromptCacheKey
+
+_WAIT_SAMPLES = 256       # recent wait times kept for percentile reporting
+_SERVICE_EWMA_ALPHA = 0.2  # smoothing for the average service-time estimate
+
+
+class Priority(IntEnum):
+    CLASSIFY = 0
+    INTERACTIVE = 1
+    BOT = 2
+
+
+_current_priority: ContextVar[Priority] = ContextVar("inference_priority", default=Priority.BOT)
+
+
+@contextmanager
+def inference_priority(priority: Priority) -> Iterator[None]:
+    """Run the enclosed orchestrator calls at *priority*."""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class SchedulerBusyError(RuntimeError):
+    """Raised when local inference is saturated and new work is rejected."""
+
+    def __init__(self, reason: str, retry_after_seconds: int) -> None:
+        super().__init__(f"local inference busy ({reason})")
+        self.reason = reason
+        self.retry_after_seconds = retry_after_seconds
+
+
+class _Ticket:
+    __slots__ = ("priority", "enqueued", "cancelled")
+
+    def __init__(self, priority: Priority) -> None:
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.cancelled = False
+
+
+class _SlotStream:
+    """Iterator that releases its scheduler slot when exhausted, closed or collected."""
+
+    def __init__(self, scheduler: "InferenceScheduler", chunks: Iterator[str], started: float) -> None:
+        self._scheduler = scheduler
+        self._chunks = chunks
+        self._started = started
+        self._released = False
+
+    def __iter__(self) -> "_SlotStream":
+        return self
+
+    def __next__(self) -> str:
+        try:
+            return next(self._chunks)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        close = getattr(self._chunks, "close", None)
+        if close is not None:
+            close()
+        self._scheduler._release(self._started)
+
+    def __del__(self) -> None:
+        self.close()
+
+
+class InferenceScheduler:
+    def __init__(
+        self,
+        runner: Any,
+        slots: int = 1,
+        max_queue: int = 8,
+        max_wait_seconds: float = 60.0,
+    ) -> None:
+        self.runner = runner
+        self.slots = max(1, slots)
+        self.max_queue = max(0, max_queue)
+        self.max_wait_seconds = max_wait_seconds
+
+        self._cond = threading.Condition()
+        self._heap: list[tuple[int, int, _Ticket]] = []
+        self._seq = itertools.count()
+        self._waiting = 0
+        self._active = 0
+
+        self._admitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._waits: deque[float] = deque(maxlen=_WAIT_SAMPLES)
+        self._avg_service = 0.0
+
+    # ------------------------------------------------------------------
+    # Slot management
+    # ------------------------------------------------------------------
+
+    def _retry_after(self) -> int:
+        return max(1, int(self._avg_service * (self._waiting + 1) / self.slots))
+
+    def _reject(self, reason: str) -> SchedulerBusyError:
+        self._rejected += 1
+        return SchedulerBusyError(reason, self._retry_after())
+
+    def _acquire(self, priority: Priority) -> float:
+        """Block until a slot is free for *priority*; return the start timestamp."""
+        with self._cond:
+            if self._active >= self.slots:
+                if self._waiting >= self.max_queue:
+                    raise self._reject("queue_full")
+                predicted = self._avg_service * (self._waiting + 1) / self.slots
+                if predicted > self.max_wait_seconds:
+                    raise self._reject("predicted_wait")
+
+            ticket = _Ticket(priority)
+            heapq.heappush(self._heap, (int(priority), next(self._seq), ticket))
+            self._waiting += 1
+            deadline = ticket.enqueued + self.max_wait_seconds
+            try:
+                while True:
+                    self._drop_cancelled()
+                    if self._active < self.slots and self._heap[0][2] is ticket:
+                        heapq.heappop(self._heap)
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        ticket.cancelled = True
+                        # Our departure may unblock the next waiter.
+                        self._cond.notify_all()
+                        raise self._reject("wait_timeout")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+            self._active += 1
+            self._admitted += 1
+            started = time.monotonic()
+            self._waits.append(started - ticket.enqueued)
+            return started
+
+    def _drop_cancelled(self) -> None:
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+
+    def _release(self, started: float) -> None:
+        with self._cond:
+            self._active -= 1
+            self._completed += 1
+            elapsed = time.monotonic() - started
+            if self._avg_service == 0.0:
+                self._avg_service = elapsed
+            else:
+                self._avg_service += _SERVICE_EWMA_ALPHA * (elapsed - self._avg_service)
+            self._cond.notify_all()
+
+    @contextmanager
+    def _slot(self, priority: Priority) -> Iterator[None]:
+        started = self._acquire(priority)
+        try:
+            yield
+        finally:
+            self._release(started)
+
+    # ------------------------------------------------------------------
+    # Runner interface
+    # ------------------------------------------------------------------
+
+    def generate(
+        self,
+        prompt: str,
+        max_tokens_override: int | None = None,
+        cache_key: PromptCacheKey | None = None,
+    ) -> str:
+        with self._slot(_current_priority.get()):
+            return self.runner.generate(
+                prompt, max_tokens_override=max_tokens_override, cache_key=cache_key
+            )
+
+    def generate_stream(
+        self,
+        prompt: str,
+        max_tokens_override: int | None = None,
+        cache_key: PromptCacheKey | None = None,
+    ) -> Iterator[str]:
+        # Admission happens now (so callers can still answer 429), and the
+        # slot is held until the stream is exhausted or closed.
+        started = self._acquire(_current_priority.get())
+        try:
+            chunks = self.runner.generate_stream(
+                prompt, max_tokens_override=max_tokens_override, cache_key=cache_key
+            )
+        except BaseException:
+            self._release(started)
+            raise
+        return _SlotStream(self, iter(chunks), started)
+
+    def classify(self, prompt: str) -> str:
+        with self._slot(Priority.CLASSIFY):
+            return self.runner.classify(prompt)
+
+    def classify_labels(self, prompt: str, labels: Sequence[str]) -> dict[str, float]:
+        with self._slot(Priority.CLASSIFY):
+            return self.runner.classify_labels(prompt, labels)
+
+    def __getattr__(self, name: str) -> Any:
+        # Everything else (start/stop, model_path, …) is the wrapped runner's.
+        if name == "runner":
+            raise AttributeError(name)
+        return getattr(self.runner, name)
+
+    # ------------------------------------------------------------------
+    # Metrics
+    # ------------------------------------------------------------------
+
+    def stats(self) -> dict:
+        with self._cond:
+            waits = sorted(self._waits)
+            active = self._active
+            waiting = self._waiting
+            counters = (self._admitted, self._rejected, self._completed)
+            avg_service = self._avg_service
+
+        def _pct(q: float) -> float:
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(q * len(waits)))] * 1000, 1)
+
+        return {
+            "slots": self.slots,
+            "active": active,
+            "queue_depth": waiting,
+            "max_queue": self.max_queue,
+            "admitted": counters[0],
+            "rejected": counters[1],
+            "completed": counters[2],
+            "wait_ms_p50": _pct(0.50),
+            "wait_ms_p95": _pct(0.95),
+            "wait_ms_max": round(waits[-1] * 1000, 1) if waits else 0.0,
+            "avg_service_ms": round(avg_service * 1000, 1),
+        }
@@ -73,17 +73,24 @@ class ConversationMemory:
             ).fetchall()
         return [{"role": r["role"], "content": r["content"]} for r in reversed(rows)]
 
-    def format_for_prompt(self, user_id: str) -> str:
-        """Return a compact conversation history block for inclusion in prompts."""
-        history = self.get_history(user_id)
-        if not history:
-            return ""
-        lines = [
+    def history_lines(self, user_id: str) -> list[str]:
+        """Return one ``"User: …"`` / ``"Assistant: …"`` line per stored turn (oldest first)."""
+        return [
             f"{'User' if turn['role'] == 'user' else 'Assistant'}: {turn['content']}"
-            for turn in history
+            for turn in self.get_history(user_id)
         ]
+
+    @staticmethod
+    def format_lines(lines: list[str]) -> str:
+        """Wrap history lines in the block markers used inside prompts."""
+        if not lines:
+            return ""
         return "--- Previous conversation ---\n" + "\n".join(lines) + "\n--- End ---"
 
+    def format_for_prompt(self, user_id: str) -> str:
+        """Return a compact conversation history block for inclusion in prompts."""
+        return self.format_lines(self.history_lines(user_id))
+
     def clear(self, user_id: str) -> None:
         """Remove all stored history for *user_id*."""
         with self._connect() as conn:
@@ -3,7 +3,8 @@
 Routing priority (highest → lowest):
   1. Very short messages  → local model (no routing overhead)
   2. Keyword fast-path    → well-known signal words route immediately
-  3. Local LLM classifier → Gemma decides the best backend for ambiguous queries
+  3. Embedding router     → nearest label centroid to the message embedding
+     Local LLM classifier → Gemma decides when the embedding router is unsure
   4. Default              → local simple
 
 RAG context is fetched and injected into *every* backend prompt, so cloud
@@ -11,17 +12,31 @@ models also benefit from the stored knowledge base.
 
 Conversation memory (per user_id) is prepended to prompts and updated
 after every turn.
+
+An optional semantic ``ResponseCache`` answers repeated FAQ-style questions
+without generating; hits are reported with route ``cache_hit``.
+
+Prompts are packed to each backend's token budget (context window minus
+reserved output tokens): history turns and RAG chunks that do not fit are
+trimmed or dropped, lowest value first — see ``assistant.prompt_budget``.
 """
 from __future__ import annotations
 
+import functools
 import logging
 from dataclasses import dataclass
+from typing import Any, Callable, Iterator
 
+from assistant.embedding_router import EmbeddingRouter
 from assistant.llm.cloud_router import CloudRouter
 from assistant.llm.llama_cpp_runner import LlamaCppRunner
+from assistant.llm.prompt_cache import PromptCacheKey
 from assistant.memory import ConversationMemory
 from assistant.personality import Personality
-from assistant.rag.store import RagStore
+from assistant.prompt_budget import PromptPacker, TokenCounter
+from assistant.rag.lazy import RagWarmingError
+from assistant.rag.store import DEFAULT_COLLECTION, RagStore, user_collection
+from assistant.response_cache import ResponseCache, is_cacheable, normalize_message
 
 logger = logging.getLogger(__name__)
 
@@ -30,7 +45,18 @@ _ROUTE_LOCAL = "LOCAL"
 _ROUTE_GROQ = "GROQ"
 _ROUTE_GEMINI = "GEMINI"
 _ROUTE_KIMI = "KIMI"
-_VALID_LLM_ROUTES = {_ROUTE_LOCAL, _ROUTE_GROQ, _ROUTE_GEMINI, _ROUTE_KIMI}
+_LLM_ROUTE_LABELS = (_ROUTE_LOCAL, _ROUTE_GROQ, _ROUTE_GEMINI, _ROUTE_KIMI)
+# RouteResult.route values served by a cloud backend
+_CLOUD_ROUTES = {"groq", "gemini", "kimi"}
+# Default context windows (tokens) for the configured cloud models
+_DEFAULT_CLOUD_CONTEXT_TOKENS = {"groq": 8192, "gemini": 32768, "kimi": 8192}
+# Message tokens shown to the routing classifier
+_CLASSIFY_MESSAGE_TOKENS = 128
+
+# Section wrappers shared by the prompt builders and the packer's overhead accounting
+_LOCAL_HISTORY_OPEN = "<start_of_turn>context"
+_LOCAL_RAG_OPEN = "<start_of_turn>context\nRetrieved knowledge:"
+_CLOUD_RAG_HEADER = "=== Retrieved Knowledge ==="
 
 # Gemma instruction-tuned token format
 _GEMMA_CLS_PROMPT = """\
@@ -56,6 +82,15 @@ class RouteResult:
     response: str
 
 
+@dataclass(frozen=True)
+class RouteStream:
+    """Routing decision plus an iterator of response text deltas."""
+
+    route: str
+    reason: str
+    chunks: Iterator[str]
+
+
 class AgentOrchestrator:
     def __init__(
         self,
@@ -68,6 +103,16 @@ class AgentOrchestrator:
         long_context_threshold_chars: int = 1200,
         short_message_threshold_chars: int = 150,
         use_llm_routing: bool = True,
+        per_user_prompt_cache: bool = False,
+        llm_routing_min_confidence: float = 0.5,
+        local_context_tokens: int = 2048,
+        local_reserved_tokens: int = 256,
+        cloud_context_tokens: dict[str, int] | None = None,
+        cloud_reserved_tokens: int = 1024,
+        response_cache: ResponseCache | None = None,
+        embedding_router: EmbeddingRouter | None = None,
+        embedding_router_min_confidence: float = 0.6,
+        rag_collections: list[str] | None = None,
     ) -> None:
         self.rag = rag
         self.llm = llm
@@ -78,30 +123,128 @@ class AgentOrchestrator:
         self.long_context_threshold_chars = long_context_threshold_chars
         self.short_message_threshold_chars = short_message_threshold_chars
         self.use_llm_routing = use_llm_routing
+        self.per_user_prompt_cache = per_user_prompt_cache
+        self.llm_routing_min_confidence = llm_routing_min_confidence
+        self.response_cache = response_cache
+        self.embedding_router = embedding_router
+        self.embedding_router_min_confidence = embedding_router_min_confidence
+        # Collections every user can search; each user also sees user:<id>
+        self.rag_collections = list(rag_collections or [DEFAULT_COLLECTION])
+
+        # Token counts are cached per history line / RAG chunk, so re-packing
+        # the same context for the next message is cheap.
+        self._local_counter = TokenCounter(llm.count_tokens)
+        cloud_counter = TokenCounter()
+        windows = {**_DEFAULT_CLOUD_CONTEXT_TOKENS, **(cloud_context_tokens or {})}
+        self._packers: dict[str, PromptPacker] = {
+            "local": PromptPacker(self._local_counter, local_context_tokens, local_reserved_tokens),
+            **{
+                route: PromptPacker(cloud_counter, windows[route], cloud_reserved_tokens)
+                for route in _CLOUD_ROUTES
+            },
+        }
 
     # ------------------------------------------------------------------
     # RAG helpers
     # ------------------------------------------------------------------
 
-    def _rag_context(self, message: str) -> str:
-        """Retrieve relevant chunks and format as a context block."""
-        chunks = self.rag.query(message, top_k=self.top_k)
-        if not chunks:
-            return ""
-        lines = [
+    def _collections(self, user_id: str) -> list[str]:
+        """Collections *user_id* may retrieve from: the shared ones plus their own."""
+        if not user_id:
+            return list(self.rag_collections)
+        return [*self.rag_collections, user_collection(user_id)]
+
+    def _has_private_knowledge(self, user_id: str) -> bool:
+        return bool(user_id) and self.rag.collection_size(user_collection(user_id)) > 0
+
+    def _rag_chunks(self, message: str, vector: Any = None, user_id: str = "") -> list[str]:
+        """Retrieve relevant chunks, formatted with their source, best first.
+
+        *vector* is the message embedding if the caller already has one.
+        Only the shared collections and *user_id*'s own are searched.  While
+        the store is still loading, the reply goes out without RAG context.
+        """
+        try:
+            results = self.rag.query(
+                message, top_k=self.top_k, vector=vector, collections=self._collections(user_id)
+            )
+        except RagWarmingError as exc:
+            logger.info("Answering without RAG context: %s", exc)
+            return []
+        return [
             f"[{item['source']} chunk#{item['chunk_index']}]\n{item['content']}"
-            for item in chunks
+            for item in results
         ]
-        return "\n\n".join(lines)
+
+    def _query_vector(self, message: str) -> Any:
+        """Embedding of the normalised message, shared by the router, the cache and RAG.
+
+        None when neither the embedding router nor the response cache is
+        configured — retrieval then embeds the raw message itself — and while
+        the RAG store (which owns the embedder) is still loading.  Also None
+        for identifier-style messages the store answers by BM25 alone: an
+        embedding would cost more than their retrieval, and cannot tell
+        ``E1234`` from ``E1235`` anyway, so they skip the response cache and
+        the embedding router too.
+        """
+        if self.response_cache is None and self.embedding_router is None:
+            return None
+        if self.rag.prefers_lexical(message):
+            return None
+        try:
+            return self.rag.embed(normalize_message(message))
+        except RagWarmingError:
+            return None
+
+    # ------------------------------------------------------------------
+    # Response cache helpers
+    # ------------------------------------------------------------------
+
+    # Replies are shared across users and keyed by the message alone, so a
+    # turn whose answer could depend on anything else — the user's private
+    # collection or their earlier turns ("and in French?") — neither reads
+    # from nor writes to the cache.
+
+    def _shares_cache(self, message: str, vector: Any, history: list[str], user_id: str) -> bool:
+        if vector is None or history or not is_cacheable(message):
+            return False
+        return not self._has_private_knowledge(user_id)
+
+    def _cached_reply(
+        self,
+        message: str,
+        vector: Any,
+        route: str,
+        generation: int,
+        history: list[str],
+        user_id: str = "",
+    ) -> str | None:
+        if self.response_cache is None or not self._shares_cache(message, vector, history, user_id):
+            return None
+        return self.response_cache.lookup(vector, route, generation)
+
+    def _cache_reply(
+        self,
+        message: str,
+        vector: Any,
+        route: str,
+        generation: int,
+        history: list[str],
+        response: str,
+        user_id: str = "",
+    ) -> None:
+        if self.response_cache is None or not self._shares_cache(message, vector, history, user_id):
+            return
+        self.response_cache.store(vector, route, generation, response)
 
     # ------------------------------------------------------------------
     # Memory helpers
     # ------------------------------------------------------------------
 
-    def _history_block(self, user_id: str) -> str:
+    def _history_lines(self, user_id: str) -> list[str]:
         if self.memory is None or not user_id:
-            return ""
-        return self.memory.format_for_prompt(user_id)
+            return []
+        return self.memory.history_lines(user_id)
 
     def _record(self, user_id: str, message: str, response: str) -> None:
         if self.memory is None or not user_id:
@@ -113,8 +256,8 @@ class AgentOrchestrator:
     # Prompt builders
     # ------------------------------------------------------------------
 
-    def _local_prompt(self, message: str, rag_ctx: str, history: str) -> str:
-        """Build a Gemma-format prompt for the local model."""
+    def _local_system_block(self) -> str:
+        """The fixed system turn every local prompt starts with."""
         if self.personality:
             system_text = self.personality.system_prompt(is_local=True)
         else:
@@ -122,15 +265,20 @@ class AgentOrchestrator:
                 "You are a concise, helpful assistant. "
                 "Use the context and conversation history when relevant. Be brief."
             )
-        parts: list[str] = [
-            "<start_of_turn>system",
-            system_text,
-            "<end_of_turn>",
-        ]
+        return "\n".join(["<start_of_turn>system", system_text, "<end_of_turn>"])
+
+    def _local_cache_key(self, user_id: str) -> PromptCacheKey:
+        """Prompt-cache key: the system block, plus the user when per-user caching is on."""
+        session = user_id if self.per_user_prompt_cache else ""
+        return PromptCacheKey(prefix=self._local_system_block() + "\n", session=session)
+
+    def _render_local(self, message: str, rag_chunks: list[str], history: list[str]) -> str:
+        """Lay out a Gemma-format prompt from already-packed parts."""
+        parts: list[str] = [self._local_system_block()]
         if history:
-            parts += ["<start_of_turn>context", history, "<end_of_turn>"]
-        if rag_ctx:
-            parts += ["<start_of_turn>context", "Retrieved knowledge:\n" + rag_ctx, "<end_of_turn>"]
+            parts += [_LOCAL_HISTORY_OPEN, ConversationMemory.format_lines(history), "<end_of_turn>"]
+        if rag_chunks:
+            parts += [_LOCAL_RAG_OPEN + "\n" + "\n\n".join(rag_chunks), "<end_of_turn>"]
         parts += [
             "<start_of_turn>user",
             message,
@@ -139,20 +287,44 @@ class AgentOrchestrator:
         ]
         return "\n".join(parts)
 
-    def _cloud_prompt(self, message: str, rag_ctx: str, history: str) -> str:
-        """Build a plain-text prompt suitable for all cloud models."""
-        sections: list[str] = []
+    def _local_prompt(self, message: str, rag_chunks: list[str], history: list[str]) -> str:
+        """Build a Gemma-format prompt for the local model, packed to its context window."""
+        packed = self._packers["local"].pack(
+            fixed=self._render_local("", [], []),
+            message=message,
+            history=history,
+            rag_chunks=rag_chunks,
+            history_overhead=(
+                _LOCAL_HISTORY_OPEN + ConversationMemory.format_lines([""]) + "<end_of_turn>"
+            ),
+            rag_overhead=_LOCAL_RAG_OPEN + "<end_of_turn>",
+        )
+        return self._render_local(packed.message, packed.rag_chunks, packed.history)
+
+    def _cloud_system_text(self) -> str:
         if self.personality:
-            sections.append(self.personality.system_prompt(is_local=False))
-        else:
-            sections.append(
-                "You are a helpful assistant. Use the provided context and history when relevant."
-            )
-        if history:
-            sections.append(history)
-        if rag_ctx:
-            sections.append("=== Retrieved Knowledge ===\n" + rag_ctx)
-        sections.append(f"User: {message}\nAssistant:")
+            return self.personality.system_prompt(is_local=False)
+        return "You are a helpful assistant. Use the provided context and history when relevant."
+
+    def _cloud_prompt(
+        self, route: str, message: str, rag_chunks: list[str], history: list[str]
+    ) -> str:
+        """Build a plain-text prompt for the cloud *route*, packed to its context window."""
+        system_text = self._cloud_system_text()
+        packed = self._packers[route].pack(
+            fixed=f"{system_text}\n\nUser: \nAssistant:",
+            message=message,
+            history=history,
+            rag_chunks=rag_chunks,
+            history_overhead=ConversationMemory.format_lines([""]),
+            rag_overhead=_CLOUD_RAG_HEADER,
+        )
+        sections: list[str] = [system_text]
+        if packed.history:
+            sections.append(ConversationMemory.format_lines(packed.history))
+        if packed.rag_chunks:
+            sections.append(_CLOUD_RAG_HEADER + "\n" + "\n\n".join(packed.rag_chunks))
+        sections.append(f"User: {packed.message}\nAssistant:")
         return "\n\n".join(sections)
 
     # ------------------------------------------------------------------
@@ -193,36 +365,81 @@ class AgentOrchestrator:
     def _classify_with_local_llm(self, message: str) -> str | None:
         """Ask the local Gemma model to classify the routing target.
 
-        Returns one of LOCAL / GROQ / GEMINI / KIMI, or None on failure.
+        Decoding is grammar-constrained to the four labels, so the model
+        emits exactly one of them.  Returns LOCAL / GROQ / GEMINI / KIMI, or
+        None on failure or when the top label's probability is below
+        ``llm_routing_min_confidence``.
         """
-        prompt = _GEMMA_CLS_PROMPT.format(message=message[:500])
+        prompt = _GEMMA_CLS_PROMPT.format(
+            message=self._local_counter.trim(message, _CLASSIFY_MESSAGE_TOKENS)
+        )
         try:
-            raw = self.llm.classify(prompt).upper()
+            probabilities = self.llm.classify_labels(prompt, _LLM_ROUTE_LABELS)
         except Exception as exc:  # noqa: BLE001
             logger.warning("LLM routing classification failed: %s", exc)
             return None
 
-        # The model may prefix with whitespace or include punctuation.
-        for token in raw.split():
-            candidate = token.strip(".,!?:")
-            if candidate in _VALID_LLM_ROUTES:
-                return candidate
-        return None
+        label, confidence = max(probabilities.items(), key=lambda item: item[1])
+        if confidence < self.llm_routing_min_confidence:
+            logger.debug(
+                "LLM routing below confidence threshold (%s=%.2f)", label, confidence
+            )
+            return None
+        return label
+
+    def _classify_with_embedding(self, vector: Any) -> str | None:
+        """Route label from the embedding router, or None if absent or unsure."""
+        if self.embedding_router is None or vector is None:
+            return None
+        label, confidence = self.embedding_router.classify(vector)
+        if label not in _LLM_ROUTE_LABELS or confidence < self.embedding_router_min_confidence:
+            logger.debug("Embedding router unsure (%s=%.2f)", label, confidence)
+            return None
+        return label
 
     # ------------------------------------------------------------------
     # Private response dispatchers
     # ------------------------------------------------------------------
 
-    def _local_simple(self, message: str, rag_ctx: str, history: str) -> str:
-        return self.llm.generate(self._local_prompt(message, rag_ctx, history)).strip()
+    def _local_simple(self, message: str, rag_chunks: list[str], history: list[str], user_id: str = "") -> str:
+        return self.llm.generate(
+            self._local_prompt(message, rag_chunks, history),
+            cache_key=self._local_cache_key(user_id),
+        ).strip()
+
+    def _local_stream(
+        self, message: str, rag_chunks: list[str], history: list[str], user_id: str = ""
+    ) -> Iterator[str]:
+        return self.llm.generate_stream(
+            self._local_prompt(message, rag_chunks, history),
+            cache_key=self._local_cache_key(user_id),
+        )
 
-    def _safe_cloud_fallback(self, message: str, rag_ctx: str, history: str) -> RouteResult:
+    def _safe_cloud_fallback(
+        self, message: str, rag_chunks: list[str], history: list[str], user_id: str = ""
+    ) -> RouteResult:
         """Last-resort fallback: generate locally."""
-        response = self._local_simple(message, rag_ctx, history)
+        response = self._local_simple(message, rag_chunks, history, user_id)
         return RouteResult(route="local_fallback", reason="cloud_unavailable", response=response)
 
+    def _cloud_generate(self, route: str, cloud_prompt: str) -> str:
+        """Call the cloud backend for *route*; raises if it is unavailable or fails."""
+        if route == "groq":
+            if not self.cloud.is_groq_available():
+                raise RuntimeError("GROQ_API_KEY not configured")
+            return self.cloud.groq_generate(cloud_prompt)
+        if route == "gemini":
+            if not self.cloud.is_gemini_available():
+                raise RuntimeError("GEMINI_API_KEY not configured")
+            return self.cloud.gemini_generate(cloud_prompt)
+        if route == "kimi":
+            if not self.cloud.is_kimi_available():
+                raise RuntimeError("KIMI_API_KEY not configured")
+            return self.cloud.kimi_generate(cloud_prompt)
+        raise RuntimeError(f"unknown cloud route: {route}")
+
     # ------------------------------------------------------------------
-    # Main entry point
+    # Main entry points
     # ------------------------------------------------------------------
 
     def respond_with_route(self, message: str, user_id: str = "") -> RouteResult:
@@ -233,115 +450,161 @@ class AgentOrchestrator:
             user_id: Optional stable identifier for conversation memory
                      (telegram user id, discord user id, …).
         """
-        rag_ctx = self._rag_context(message)
-        history = self._history_block(user_id)
-        cloud_prompt = self._cloud_prompt(message, rag_ctx, history)
+        vector = self._query_vector(message)
+        generation = self.rag.generation
+        route, reason = self._plan(message, vector)
+        history = self._history_lines(user_id)
+
+        cached = self._cached_reply(message, vector, route, generation, history, user_id)
+        if cached is not None:
+            result = RouteResult(route="cache_hit", reason=f"cached_{route}", response=cached)
+        else:
+            rag_chunks = self._rag_chunks(message, vector, user_id)
+            result = self._dispatch(route, reason, message, rag_chunks, history, user_id)
+            if result.route == route:  # never cache a fallback under the planned route
+                self._cache_reply(
+                    message, vector, route, generation, history, result.response, user_id
+                )
 
-        result = self._route(message, rag_ctx, history, cloud_prompt)
         self._record(user_id, message, result.response)
         return result
 
-    def _route(
+    def respond_with_route_stream(self, message: str, user_id: str = "") -> RouteStream:
+        """Streaming counterpart of :meth:`respond_with_route`.
+
+        The routing decision (and any cloud call) happens before this method
+        returns, so ``route`` / ``reason`` are final.  Local generations are
+        streamed token-by-token; cloud replies and cache hits arrive as a
+        single chunk.  Conversation memory (and the response cache) is updated
+        once the chunk iterator is exhausted.
+        """
+        vector = self._query_vector(message)
+        generation = self.rag.generation
+        route, reason = self._plan(message, vector)
+        history = self._history_lines(user_id)
+
+        cached = self._cached_reply(message, vector, route, generation, history, user_id)
+        if cached is not None:
+            return RouteStream(
+                route="cache_hit",
+                reason=f"cached_{route}",
+                chunks=self._record_when_done(user_id, message, iter([cached])),
+            )
+
+        rag_chunks = self._rag_chunks(message, vector, user_id)
+        planned = route
+        if route in _CLOUD_ROUTES:
+            try:
+                response = self._cloud_generate(
+                    route, self._cloud_prompt(route, message, rag_chunks, history)
+                )
+                chunks: Iterator[str] = iter([response])
+            except Exception as exc:  # noqa: BLE001
+                logger.warning("%s route failed (%s), falling back to local", route.capitalize(), exc)
+                route, reason = "local_fallback", f"{route}_unavailable"
+                chunks = self._local_stream(message, rag_chunks, history, user_id)
+        else:
+            chunks = self._local_stream(message, rag_chunks, history, user_id)
+
+        on_done = None
+        if route == planned:  # never cache a fallback under the planned route
+            on_done = functools.partial(
+                self._cache_reply, message, vector, planned, generation, history, user_id=user_id
+            )
+
+        return RouteStream(
+            route=route,
+            reason=reason,
+            chunks=self._record_when_done(user_id, message, chunks, on_done),
+        )
+
+    def _record_when_done(
         self,
+        user_id: str,
         message: str,
-        rag_ctx: str,
-        history: str,
-        cloud_prompt: str,
-    ) -> RouteResult:
+        chunks: Iterator[str],
+        on_done: Callable[[str], None] | None = None,
+    ) -> Iterator[str]:
+        parts: list[str] = []
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        response = "".join(parts).strip()
+        self._record(user_id, message, response)
+        if on_done is not None:
+            on_done(response)
+
+    def _plan(self, message: str, vector: Any = None) -> tuple[str, str]:
+        """Decide ``(route, reason)`` for *message* without generating a reply.
+
+        *vector* is the message embedding used by the embedding router.
+
+        The returned route is one of ``local_simple``, ``local_rag``, ``groq``,
+        ``gemini`` or ``kimi``; cloud fallback is decided at dispatch time.
+        """
         # ── 1. Short-message fast path → local, no LLM routing overhead ─────
         if len(message) <= self.short_message_threshold_chars and not self._has_reasoning_signal(message) and not self._has_planning_signal(message):
-            response = self._local_simple(message, rag_ctx, history)
-            return RouteResult(route="local_simple", reason="short_message", response=response)
+            return "local_simple", "short_message"
 
         # ── 2. Keyword fast path ─────────────────────────────────────────────
         if self._has_planning_signal(message):
-            target = _ROUTE_KIMI
-            reason = "kw_planning"
-        elif len(message) >= self.long_context_threshold_chars:
-            target = _ROUTE_GEMINI
-            reason = "kw_long_context"
-        elif self._has_reasoning_signal(message):
-            target = _ROUTE_GROQ
-            reason = "kw_reasoning"
-        elif self._has_rag_signal(message):
+            return "kimi", "kw_planning"
+        if len(message) >= self.long_context_threshold_chars:
+            return "gemini", "kw_long_context"
+        if self._has_reasoning_signal(message):
+            return "groq", "kw_reasoning"
+        if self._has_rag_signal(message):
             # RAG queries stay local — no need for expensive cloud call
-            response = self._local_simple(message, rag_ctx, history)
-            return RouteResult(route="local_rag", reason="kw_rag", response=response)
-        else:
-            target = None
-            reason = ""
+            return "local_rag", "kw_rag"
 
-        # ── 3. LLM classifier for ambiguous messages ─────────────────────────
-        if target is None and self.use_llm_routing:
+        # ── 3a. Embedding router — microseconds, on the shared embedding ────
+        routed = self._classify_with_embedding(vector)
+        if routed is not None:
+            if routed != _ROUTE_LOCAL:
+                return routed.lower(), "embedding_router"
+            return "local_simple", "embedding_router_local"
+
+        # ── 3b. LLM classifier for messages the router is unsure about ──────
+        if self.use_llm_routing:
             llm_route = self._classify_with_local_llm(message)
             if llm_route and llm_route != _ROUTE_LOCAL:
-                target = llm_route
-                reason = "llm_classifier"
-            else:
-                # LLM said LOCAL or classification failed
-                response = self._local_simple(message, rag_ctx, history)
-                return RouteResult(route="local_simple", reason="llm_classifier_local", response=response)
-
-        if target is None:
-            # No signal found → default local
-            response = self._local_simple(message, rag_ctx, history)
-            return RouteResult(route="local_simple", reason="default", response=response)
-
-        # ── 4. Dispatch to cloud ─────────────────────────────────────────────
-        if target == _ROUTE_GROQ:
-            try:
-                if not self.cloud.is_groq_available():
-                    raise RuntimeError("GROQ_API_KEY not configured")
-                return RouteResult(
-                    route="groq",
-                    reason=reason,
-                    response=self.cloud.groq_generate(cloud_prompt),
-                )
-            except Exception as exc:  # noqa: BLE001
-                logger.warning("Groq route failed (%s), falling back to local", exc)
-                return RouteResult(
-                    route="local_fallback",
-                    reason="groq_unavailable",
-                    response=self._local_simple(message, rag_ctx, history),
-                )
+                return llm_route.lower(), "llm_classifier"
+            # LLM said LOCAL or classification failed
+            return "local_simple", "llm_classifier_local"
 
-        if target == _ROUTE_GEMINI:
-            try:
-                if not self.cloud.is_gemini_available():
-                    raise RuntimeError("GEMINI_API_KEY not configured")
-                return RouteResult(
-                    route="gemini",
-                    reason=reason,
-                    response=self.cloud.gemini_generate(cloud_prompt),
-                )
-            except Exception as exc:  # noqa: BLE001
-                logger.warning("Gemini route failed (%s), falling back to local", exc)
-                return RouteResult(
-                    route="local_fallback",
-                    reason="gemini_unavailable",
-                    response=self._local_simple(message, rag_ctx, history),
-                )
+        # No signal found → default local
+        return "local_simple", "default"
 
-        if target == _ROUTE_KIMI:
-            try:
-                if not self.cloud.is_kimi_available():
-                    raise RuntimeError("KIMI_API_KEY not configured")
-                return RouteResult(
-                    route="kimi",
-                    reason=reason,
-                    response=self.cloud.kimi_generate(cloud_prompt),
-                )
-            except Exception as exc:  # noqa: BLE001
-                logger.warning("Kimi route failed (%s), falling back to local", exc)
-                return RouteResult(
-                    route="local_fallback",
-                    reason="kimi_unavailable",
-                    response=self._local_simple(message, rag_ctx, history),
-                )
+    def _dispatch(
+        self,
+        route: str,
+        reason: str,
+        message: str,
+        rag_chunks: list[str],
+        history: list[str],
+        user_id: str = "",
+    ) -> RouteResult:
+        """Generate the reply for a planned *route*, falling back to local on cloud failure."""
+        if route not in _CLOUD_ROUTES:
+            response = self._local_simple(message, rag_chunks, history, user_id)
+            return RouteResult(route=route, reason=reason, response=response)
 
-        # Fallthrough (should not be reached)
-        response = self._local_simple(message, rag_ctx, history)
-        return RouteResult(route="local_simple", reason="unmatched_target", response=response)
+        # ── 4. Dispatch to cloud ─────────────────────────────────────────────
+        try:
+            return RouteResult(
+                route=route,
+                reason=reason,
+                response=self._cloud_generate(
+                    route, self._cloud_prompt(route, message, rag_chunks, history)
+                ),
+            )
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("%s route failed (%s), falling back to local", route.capitalize(), exc)
+            return RouteResult(
+                route="local_fallback",
+                reason=f"{route}_unavailable",
+                response=self._local_simple(message, rag_chunks, history, user_id),
+            )
 
     # ------------------------------------------------------------------
     # Convenience alias
@@ -349,4 +612,3 @@ class AgentOrchestrator:
 
     def respond(self, message: str, user_id: str = "") -> str:
         return self.respond_with_route(message, user_id).response
-
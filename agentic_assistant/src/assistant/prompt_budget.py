@@ -0,0 +1,215 @@
+"""Token-budget prompt packing.
+
+Every backend has a fixed context window, part of which must stay free for
+the reply.  ``PromptPacker`` fits a prompt's variable parts — the user
+message, conversation history turns and retrieved RAG chunks — into what is
+left after the fixed system text, in priority order:
+
+  1. the user message (trimmed only if it alone overflows the window)
+  2. the most recent exchange of the conversation
+  3. RAG chunks in retrieval rank (the last one that fits may be trimmed)
+  4. older history turns, newest first (dropped whole; a gap is never left)
+
+Token counts are cached per text, so re-packing the same history turns and
+chunks for the next message costs only dictionary lookups.
+"""
+from __future__ import annotations
+
+import logging
+import math
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Sequence
+
+logger = logging.getLogger(__name__)
+
+_CHARS_PER_TOKEN = 3.5      # deliberately pessimistic for English + markup
+_COUNT_CACHE_SIZE = 4096    # distinct texts whose token counts are remembered
+_PINNED_TURNS = 2           # newest history turns packed ahead of RAG chunks
+_MIN_TRIMMED_TOKENS = 32    # don't bother keeping a chunk trimmed below this
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap, tokenizer-free upper-bound estimate of *text*'s token count."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / _CHARS_PER_TOKEN)
+
+
+class TokenCounter:
+    """Counts tokens with a backend tokenizer, memoising results per text.
+
+    *count_fn* is typically a runner's ``count_tokens``; when it is missing
+    or fails, the character-based estimate is used instead.
+    """
+
+    def __init__(
+        self,
+        count_fn: Callable[[str], int] | None = None,
+        max_entries: int = _COUNT_CACHE_SIZE,
+    ) -> None:
+        self._count_fn = count_fn
+        self._max_entries = max_entries
+        self._cache: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _count_uncached(self, text: str) -> int:
+        if self._count_fn is None or not text:
+            return estimate_tokens(text)
+        try:
+            return int(self._count_fn(text))
+        except Exception as exc:  # noqa: BLE001
+            logger.debug("Tokenizer unavailable (%s) — estimating token count", exc)
+            return estimate_tokens(text)
+
+    def count(self, text: str) -> int:
+        with self._lock:
+            cached = self._cache.get(text)
+            if cached is not None:
+                self._cache.move_to_end(text)
+                return cached
+        tokens = self._count_uncached(text)
+        with self._lock:
+            self._cache[text] = tokens
+            while len(self._cache) > self._max_entries:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def trim(self, text: str, max_tokens: int) -> str:
+        """Return the longest word-aligned prefix of *text* within *max_tokens*."""
+        if max_tokens <= 0:
+            return ""
+        tokens = self.count(text)
+        if tokens <= max_tokens:
+            return text
+        cut = len(text)
+        # Shrink proportionally; a few rounds converge because the ratio of
+        # chars to tokens is roughly constant within one text.
+        for _ in range(4):
+            cut = int(cut * max_tokens / max(tokens, 1))
+            candidate = text[:cut]
+            if " " in candidate:
+                candidate = candidate.rsplit(" ", 1)[0]
+            candidate = candidate.rstrip()
+            tokens = self._count_uncached(candidate)
+            if tokens <= max_tokens:
+                return candidate
+            cut = len(candidate)
+        # Tokens rarely span less than one character — this cut is always safe.
+        return text[:max_tokens]
+
+
+@dataclass(frozen=True)
+class PackedPrompt:
+    """The parts of a prompt that fit, in their original order."""
+
+    message: str
+    history: list[str]      # oldest first
+    rag_chunks: list[str]   # retrieval rank order
+    tokens: int             # estimated prompt tokens, fixed text included
+    dropped_history: int
+    dropped_chunks: int
+    trimmed: bool           # message or a chunk was cut short
+
+
+class PromptPacker:
+    """Fits prompt parts into one backend's context window."""
+
+    def __init__(
+        self,
+        counter: TokenCounter,
+        context_tokens: int,
+        reserved_output_tokens: int,
+    ) -> None:
+        self.counter = counter
+        self.context_tokens = context_tokens
+        self.reserved_output_tokens = reserved_output_tokens
+
+    @property
+    def prompt_budget(self) -> int:
+        return max(0, self.context_tokens - self.reserved_output_tokens)
+
+    def pack(
+        self,
+        fixed: str,
+        message: str,
+        history: Sequence[str],
+        rag_chunks: Sequence[str],
+        history_overhead: str = "",
+        rag_overhead: str = "",
+    ) -> PackedPrompt:
+        """Pack *history* (oldest first) and *rag_chunks* (best first) around *message*.
+
+        Args:
+            fixed:            Text present in every prompt (system block, turn
+                              markers around the message).
+            history_overhead: Wrapper text added once when any history is kept.
+            rag_overhead:     Wrapper text added once when any chunk is kept.
+        """
+        count = self.counter.count
+        budget = self.prompt_budget - count(fixed)
+        trimmed = False
+
+        if count(message) > budget:
+            message = self.counter.trim(message, budget)
+            trimmed = True
+        remaining = budget - count(message)
+
+        newest_first = list(reversed(history))
+        pinned = min(_PINNED_TURNS, len(newest_first))
+        order: list[tuple[str, int]] = [("history", i) for i in range(pinned)]
+        order += [("rag", i) for i in range(len(rag_chunks))]
+        order += [("history", i) for i in range(pinned, len(newest_first))]
+
+        kept_history: dict[int, str] = {}
+        kept_chunks: dict[int, str] = {}
+        history_closed = False  # once a turn is dropped, older turns are too
+
+        for kind, idx in order:
+            if kind == "history":
+                if history_closed:
+                    continue
+                text = newest_first[idx]
+                cost = count(text) + 1
+                if not kept_history:
+                    cost += count(history_overhead)
+                if cost <= remaining:
+                    kept_history[idx] = text
+                    remaining -= cost
+                else:
+                    history_closed = True
+                continue
+
+            text = rag_chunks[idx]
+            overhead = 0 if kept_chunks else count(rag_overhead)
+            cost = count(text) + 2 + overhead
+            if cost <= remaining:
+                kept_chunks[idx] = text
+                remaining -= cost
+                continue
+            room = remaining - overhead - 2
+            if room >= _MIN_TRIMMED_TOKENS:
+                kept_chunks[idx] = self.counter.trim(text, room)
+                remaining -= count(kept_chunks[idx]) + 2 + overhead
+                trimmed = True
+
+        packed = PackedPrompt(
+            message=message,
+            history=[kept_history[i] for i in sorted(kept_history, reverse=True)],
+            rag_chunks=[kept_chunks[i] for i in sorted(kept_chunks)],
+            tokens=self.prompt_budget - remaining,
+            dropped_history=len(history) - len(kept_history),
+            dropped_chunks=len(rag_chunks) - len(kept_chunks),
+            trimmed=trimmed,
+        )
+        if packed.dropped_history or packed.dropped_chunks or packed.trimmed:
+            logger.debug(
+                "Prompt packed to %d/%d tokens (dropped %d turn(s), %d chunk(s), trimmed=%s)",
+                packed.tokens,
+                self.prompt_budget,
+                packed.dropped_history,
+                packed.dropped_chunks,
+                packed.trimmed,
+            )
+        return packed
@@ -0,0 +1,508 @@
+"""Vector index backends for :class:`~assistant.rag.store.RagStore`.
+
+``RagStore`` owns labels, SQLite metadata, the append-only vector log and
+deletions; a backend only stores unit vectors by integer label and answers
+k-nearest-neighbour queries with cosine distances.
+
+* ``HnswBackend`` — hnswlib graph in ``vectors.bin`` (approximate, the default).
+* ``QuantizedBackend`` — exact search over an int8 or float16 matrix in a
+  memory-mapped ``.npy`` file.  Up to a few hundred thousand chunks a
+  blocked matrix-vector product with ``argpartition`` is faster than HNSW at
+  ``ef=100``, never misses a neighbour, and int8 needs a quarter of the RAM
+  of float32 (the matrix lives in the page cache, not the Python heap).
+  Candidates can be re-scored against the store's float32 sidecar
+  (:class:`~assistant.rag.raw_vectors.RawVectors`), so quantisation error
+  does not reorder the final top-k.
+
+Switching ``RAG_VECTOR_BACKEND`` migrates the snapshot of the backend named
+in ``index_meta.json`` on the next start (see :func:`migrate`).
+"""
+from __future__ import annotations
+
+import copy
+import importlib
+import json
+import logging
+import os
+import pickle
+from pathlib import Path
+from typing import Any, Iterable
+
+from assistant.rag.raw_vectors import RawVectors
+
+logger = logging.getLogger(__name__)
+
+
+def _numpy() -> Any:
+    try:
+        import numpy as _np  # type: ignore[import]
+    except ImportError as exc:
+        raise RuntimeError(
+            "numpy is not installed. Run: pip install -r requirements.txt"
+        ) from exc
+    return _np
+
+
+class VectorBackend:
+    """Interface shared by all vector backends."""
+
+    name = ""
+
+    @staticmethod
+    def has_snapshot(data_dir: Path) -> bool:
+        """True if *data_dir* holds a saved index for this backend."""
+        raise NotImplementedError
+
+    def load(self, empty: bool = False) -> bool:
+        """Load the saved index (or start empty); returns False if none was loaded."""
+        raise NotImplementedError
+
+    def add(self, vectors: Any, labels: Any) -> None:
+        """Insert or overwrite *vectors* under *labels*; overwriting undeletes."""
+        raise NotImplementedError
+
+    def mark_deleted(self, label: int) -> None:
+        """Exclude *label* from search (a no-op if it is absent or already deleted)."""
+        raise NotImplementedError
+
+    def search(
+        self, vector: Any, k: int, allowed: set[int] | None = None
+    ) -> tuple[list[int], list[float]]:
+        """Return ``(labels, cosine distances)`` of the *k* nearest live vectors.
+
+        With *allowed*, only those labels are candidates; a backend may raise
+        RuntimeError when the filter leaves too few reachable neighbours.
+        """
+        raise NotImplementedError
+
+    def vectors(self, labels: Any) -> Any:
+        """Unit-normalised float32 rows for *labels*; RuntimeError if any is not live."""
+        raise NotImplementedError
+
+    def missing(self, labels: Iterable[int]) -> list[int]:
+        """Those of *labels* that are absent or deleted (not searchable)."""
+        raise NotImplementedError
+
+    def count(self) -> int:
+        """Number of label slots in use, deleted ones included."""
+        raise NotImplementedError
+
+    def capacity(self) -> int:
+        raise NotImplementedError
+
+    def params(self) -> dict:
+        """Build and search parameters, recorded in ``index_meta.json``."""
+        return {}
+
+    def save(self) -> None:
+        """Write a full snapshot to disk."""
+        raise NotImplementedError
+
+    def export(self, skip: Iterable[int] = ()) -> tuple[Any, Any]:
+        """Return ``(labels, float32 vectors)`` for every stored label not in *skip*."""
+        raise NotImplementedError
+
+
+# ---------------------------------------------------------------------------
+# hnswlib
+# ---------------------------------------------------------------------------
+
+class HnswBackend(VectorBackend):
+    name = "hnsw"
+
+    def __init__(
+        self,
+        data_dir: Path,
+        dimension: int,
+        ef: int = 100,
+        ef_construction: int = 100,
+        M: int = 16,
+        initial_capacity: int = 1024,
+    ) -> None:
+        try:
+            hnswlib = importlib.import_module("hnswlib")
+        except ModuleNotFoundError as exc:
+            raise RuntimeError(
+                "hnswlib is not installed in the active Python environment. "
+                "Install dependencies from requirements.txt before using RAG."
+            ) from exc
+        self._np = _numpy()
+        self.path = Path(data_dir) / "vectors.bin"
+        self.ef = ef
+        self.ef_construction = ef_construction
+        self.M = M
+        self.initial_capacity = max(1, initial_capacity)
+        self.index = hnswlib.Index(space="cosine", dim=dimension)
+
+    @staticmethod
+    def has_snapshot(data_dir: Path) -> bool:
+        return (Path(data_dir) / "vectors.bin").exists()
+
+    def load(self, empty: bool = False) -> bool:
+        found = self.path.exists() and not empty
+        if found:
+            self.index.load_index(str(self.path))
+        else:
+            self.index.init_index(
+                max_elements=self.initial_capacity, ef_construction=self.ef_construction, M=self.M
+            )
+        self.index.set_ef(self.ef)
+        return found
+
+    def add(self, vectors: Any, labels: Any) -> None:
+        required = self.index.get_current_count() + len(labels)
+        if required > self.index.get_max_elements():
+            self.index.resize_index(max(required, self.index.get_max_elements() * 2))
+        self.index.add_items(vectors, labels)
+
+    def set_ef(self, ef: int) -> None:
+        """Search beam width: higher finds more true neighbours, slower."""
+        self.ef = ef
+        self.index.set_ef(ef)
+
+    def clone(self) -> "HnswBackend":
+        """In-memory copy of the graph, deleted marks included, to try another ``ef`` on.
+
+        The copy shares this backend's snapshot path: never ``save`` it.
+        """
+        trial = copy.copy(self)
+        trial.index = pickle.loads(pickle.dumps(self.index))
+        return trial
+
+    def mark_deleted(self, label: int) -> None:
+        try:
+            self.index.mark_deleted(label)
+        except RuntimeError:
+            pass  # already deleted, or never made it into the index
+
+    def search(
+        self, vector: Any, k: int, allowed: set[int] | None = None
+    ) -> tuple[list[int], list[float]]:
+        labels, distances = self.index.knn_query(
+            vector.reshape(1, -1), k=k, filter=allowed.__contains__ if allowed is not None else None
+        )
+        return [int(label) for label in labels[0]], [float(d) for d in distances[0]]
+
+    def vectors(self, labels: Any) -> Any:
+        np = self._np
+        rows = np.asarray(self.index.get_items(list(map(int, labels))), dtype=np.float32)
+        return rows / np.maximum(np.linalg.norm(rows, axis=1, keepdims=True), 1e-12)
+
+    def missing(self, labels: Iterable[int]) -> list[int]:
+        absent: list[int] = []
+        labels = [int(label) for label in labels]
+        for start in range(0, len(labels), 4096):
+            block = labels[start : start + 4096]
+            try:
+                self.index.get_items(block)
+            except RuntimeError:
+                # get_items fails on absent and deleted labels alike
+                for label in block:
+                    try:
+                        self.index.get_items([label])
+                    except RuntimeError:
+                        absent.append(label)
+        return absent
+
+    def count(self) -> int:
+        return self.index.get_current_count()
+
+    def capacity(self) -> int:
+        return self.index.get_max_elements()
+
+    def params(self) -> dict:
+        # A loaded index keeps the M / ef_construction it was built with.
+        return {"M": self.index.M, "ef_construction": self.index.ef_construction, "ef": self.ef}
+
+    def save(self) -> None:
+        tmp_path = self.path.with_suffix(".bin.tmp")
+        self.index.save_index(str(tmp_path))
+        os.replace(tmp_path, self.path)
+
+    def export(self, skip: Iterable[int] = ()) -> tuple[Any, Any]:
+        np = self._np
+        skipped = set(skip)
+        ids = [int(label) for label in self.index.get_ids_list() if int(label) not in skipped]
+        vectors: list[Any] = []
+        kept: list[int] = []
+        for start in range(0, len(ids), 4096):
+            block = ids[start : start + 4096]
+            try:
+                vectors.append(np.asarray(self.index.get_items(block), dtype=np.float32))
+                kept.extend(block)
+            except RuntimeError:
+                # A deleted label in the block; fall back to one at a time.
+                for label in block:
+                    try:
+                        vectors.append(np.asarray(self.index.get_items([label]), dtype=np.float32))
+                        kept.append(label)
+                    except RuntimeError:
+                        continue
+        if not kept:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, self.index.dim), dtype=np.float32)
+        return np.asarray(kept, dtype=np.int64), np.concatenate(vectors)
+
+
+# ---------------------------------------------------------------------------
+# Quantised exact search
+# ---------------------------------------------------------------------------
+
+class QuantizedBackend(VectorBackend):
+    """Exact cosine search over a memory-mapped int8/float16 matrix.
+
+    Files in *data_dir*: ``vectors.q.npy`` (the quantised matrix, one row per
+    label), ``vectors.q.json`` (row count and dtype), ``vectors.scale.npy``
+    (per-row int8 scale factors).  With *rescore*, candidates are re-scored
+    against *raw*, the store's float32 sidecar, reading only their rows; the
+    backend never writes to it (the store does, for every label it adds).
+    """
+
+    name = "quantized"
+    _BLOCK_ROWS = 16384  # rows dequantised at a time; bounds the float32 temporary
+
+    def __init__(
+        self,
+        data_dir: Path,
+        dimension: int,
+        dtype: str = "int8",
+        rescore: bool = True,
+        rescore_factor: int = 4,
+        raw: RawVectors | None = None,
+    ) -> None:
+        np = _numpy()
+        self._np = np
+        data_dir = Path(data_dir)
+        self.path = data_dir / "vectors.q.npy"
+        self.meta_path = data_dir / "vectors.q.json"
+        self.scale_path = data_dir / "vectors.scale.npy"
+        self.dimension = dimension
+        if dtype not in ("int8", "float16"):
+            logger.warning("Unknown RAG_QUANTIZED_DTYPE=%r — falling back to int8", dtype)
+            dtype = "int8"
+        self.dtype = dtype
+        self.rescore = rescore
+        self.rescore_factor = max(1, rescore_factor)
+
+        self._matrix: Any = None
+        self._raw = raw if rescore else None
+        self._scales = np.zeros(0, dtype=np.float32)
+        self._deleted = np.zeros(0, dtype=bool)
+        self._count = 0
+
+    @staticmethod
+    def has_snapshot(data_dir: Path) -> bool:
+        data_dir = Path(data_dir)
+        return (data_dir / "vectors.q.npy").exists() and (data_dir / "vectors.q.json").exists()
+
+    # ------------------------------------------------------------------
+    # Storage
+    # ------------------------------------------------------------------
+
+    def load(self, empty: bool = False) -> bool:
+        np = self._np
+        if empty or not self.has_snapshot(self.path.parent):
+            self._allocate(1024)
+            return False
+
+        with self.meta_path.open("r", encoding="utf-8") as handle:
+            meta = json.load(handle)
+        if meta.get("dtype", self.dtype) != self.dtype:
+            logger.warning(
+                "%s holds %s vectors; keeping that instead of RAG_QUANTIZED_DTYPE=%s",
+                self.path.name, meta["dtype"], self.dtype,
+            )
+            self.dtype = meta["dtype"]
+        self._count = int(meta.get("count", 0))
+        self._matrix = np.load(self.path, mmap_mode="r+")
+        capacity = self._matrix.shape[0]
+        if self.dtype == "int8" and self.scale_path.exists():
+            self._scales = self._fit(np.load(self.scale_path), capacity)
+        else:
+            self._scales = np.zeros(capacity, dtype=np.float32)
+        self._deleted = np.zeros(capacity, dtype=bool)
+        return True
+
+    def _fit(self, array: Any, size: int) -> Any:
+        out = self._np.zeros(size, dtype=array.dtype)
+        out[: min(size, len(array))] = array[:size]
+        return out
+
+    def _allocate(self, capacity: int) -> None:
+        """Create (or grow to) *capacity* rows, copying existing data."""
+        self._grow_memmap("_matrix", self.path, capacity, self.dtype)
+        self._scales = self._fit(self._scales, capacity)
+        self._deleted = self._fit(self._deleted, capacity)
+
+    def _grow_memmap(self, attr: str, path: Path, capacity: int, dtype: str) -> None:
+        """Replace the memmap held in ``self.<attr>`` with one of *capacity* rows."""
+        np = self._np
+        tmp_path = path.with_suffix(".tmp.npy")
+        grown = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=dtype, shape=(capacity, self.dimension)
+        )
+        old = getattr(self, attr)
+        if old is not None:
+            grown[: self._count] = old[: self._count]
+        grown.flush()
+        # Close both maps before replacing (Windows cannot replace a mapped file).
+        del grown, old
+        setattr(self, attr, None)
+        os.replace(tmp_path, path)
+        setattr(self, attr, np.load(path, mmap_mode="r+"))
+
+    def save(self) -> None:
+        np = self._np
+        self._matrix.flush()
+        if self.dtype == "int8":
+            tmp_scales = self.scale_path.with_suffix(".tmp.npy")
+            np.save(tmp_scales, self._scales)
+            os.replace(tmp_scales, self.scale_path)
+        tmp_meta = self.meta_path.with_suffix(".json.tmp")
+        with tmp_meta.open("w", encoding="utf-8") as handle:
+            json.dump({"count": self._count, "dtype": self.dtype, "dimension": self.dimension}, handle)
+        os.replace(tmp_meta, self.meta_path)
+
+    # ------------------------------------------------------------------
+    # Index operations
+    # ------------------------------------------------------------------
+
+    def add(self, vectors: Any, labels: Any) -> None:
+        np = self._np
+        labels = np.asarray(labels, dtype=np.int64)
+        if not len(labels):
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(labels), self.dimension)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+        required = int(labels.max()) + 1
+        if required > self._matrix.shape[0]:
+            self._allocate(max(required * 2, 1024))
+
+        if self.dtype == "int8":
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+            self._matrix[labels] = np.round(vectors / scales[:, None]).astype(np.int8)
+            self._scales[labels] = scales
+        else:
+            self._matrix[labels] = vectors.astype(np.float16)
+        self._deleted[labels] = False
+        self._count = max(self._count, required)
+
+    def mark_deleted(self, label: int) -> None:
+        if 0 <= label < len(self._deleted):
+            self._deleted[label] = True
+
+    def search(
+        self, vector: Any, k: int, allowed: set[int] | None = None
+    ) -> tuple[list[int], list[float]]:
+        np = self._np
+        if self._count == 0 or k <= 0:
+            return [], []
+        query = np.asarray(vector, dtype=np.float32).ravel()
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        wanted = k * self.rescore_factor if self._raw is not None else k
+        excluded = self._deleted
+        if allowed is not None:
+            excluded = np.ones(len(self._deleted), dtype=bool)
+            picked = np.fromiter(allowed, dtype=np.int64, count=len(allowed))
+            excluded[picked[picked < len(excluded)]] = False
+            excluded |= self._deleted
+
+        labels_parts: list[Any] = []
+        score_parts: list[Any] = []
+        for start in range(0, self._count, self._BLOCK_ROWS):
+            end = min(self._count, start + self._BLOCK_ROWS)
+            scores = self._matrix[start:end].astype(np.float32) @ query
+            if self.dtype == "int8":
+                scores *= self._scales[start:end]
+            scores[excluded[start:end]] = -np.inf
+            take = min(wanted, end - start)
+            top = np.argpartition(-scores, take - 1)[:take]
+            labels_parts.append(top + start)
+            score_parts.append(scores[top])
+
+        labels = np.concatenate(labels_parts)
+        scores = np.concatenate(score_parts)
+        live = np.isfinite(scores)
+        labels, scores = labels[live], scores[live]
+        if len(labels) > wanted:
+            top = np.argpartition(-scores, wanted - 1)[:wanted]
+            labels, scores = labels[top], scores[top]
+
+        if self._raw is not None and len(labels):
+            # Exact float32 scores for the candidates only (sorted for sequential reads).
+            labels = np.sort(labels)
+            rows = self._raw.read(labels)
+            rows /= np.maximum(np.linalg.norm(rows, axis=1, keepdims=True), 1e-12)
+            scores = rows @ query
+
+        best = np.argsort(-scores)[:k]
+        return labels[best].tolist(), (1.0 - scores[best]).astype(float).tolist()
+
+    def missing(self, labels: Iterable[int]) -> list[int]:
+        return [
+            int(label)
+            for label in labels
+            if not 0 <= label < self._count or self._deleted[label]
+        ]
+
+    def count(self) -> int:
+        return self._count
+
+    def capacity(self) -> int:
+        return int(self._matrix.shape[0]) if self._matrix is not None else 0
+
+    def params(self) -> dict:
+        return {"dtype": self.dtype, "rescore": self.rescore}
+
+    def export(self, skip: Iterable[int] = ()) -> tuple[Any, Any]:
+        np = self._np
+        keep = ~self._deleted[: self._count]
+        for label in skip:
+            if 0 <= label < self._count:
+                keep[label] = False
+        labels = np.flatnonzero(keep).astype(np.int64)
+        return labels, self.vectors(labels)
+
+    def vectors(self, labels: Any) -> Any:
+        np = self._np
+        labels = np.asarray(labels, dtype=np.int64)
+        absent = (labels < 0) | (labels >= self._count)
+        absent[~absent] = self._deleted[labels[~absent]]
+        if absent.any():
+            # Same contract as hnswlib's get_items, which callers rely on
+            raise RuntimeError(f"Label {int(labels[absent][0])} is deleted or was never added")
+        rows = self._matrix[labels].astype(np.float32)
+        if self.dtype == "int8":
+            rows *= self._scales[labels, None]
+        return rows / np.maximum(np.linalg.norm(rows, axis=1, keepdims=True), 1e-12)
+
+
+BACKENDS: dict[str, type[VectorBackend]] = {
+    HnswBackend.name: HnswBackend,
+    QuantizedBackend.name: QuantizedBackend,
+}
+
+
+def migrate(
+    target: VectorBackend,
+    source_name: str,
+    data_dir: Path,
+    dimension: int,
+    skip: Iterable[int] = (),
+    raw: RawVectors | None = None,
+) -> None:
+    """Copy the *source_name* snapshot in *data_dir* into the empty *target* and save it.
+
+    Vectors are taken from the *raw* sidecar where it has them: a quantised
+    source only holds approximations.
+    """
+    source = BACKENDS[source_name](data_dir, dimension)  # type: ignore[call-arg]
+    source.load()
+    labels, vectors = source.export(skip)
+    if raw is not None and len(labels):
+        exact = raw.read(labels)
+        present = exact.any(axis=1)
+        vectors[present] = exact[present]
+    logger.info("Migrating %d vectors from the %s index to %s", len(labels), source_name, target.name)
+    target.add(vectors, labels)
+    target.save()
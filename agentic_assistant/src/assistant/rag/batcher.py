@@ -0,0 +1,154 @@
+"""Micro-batching front end for the sentence-transformers embedder.
+
+Every bot thread used to call ``embedder.encode([text])`` on its own.  The
+calls serialise on the GIL and fight over torch's intra-op threads, and a
+batch of one wastes most of a forward pass.
+
+``EmbeddingBatcher`` owns a single worker thread.  Callers enqueue their
+texts and block on a future; the worker collects requests for at most
+``max_wait_ms`` after the oldest one arrived (or until ``max_batch`` texts
+are waiting), runs one ``encode`` over all of them and hands each caller its
+rows.  A large request such as an ingest batch is dispatched immediately, on
+its own.  The worker only lingers once concurrency has been seen (the
+previous batch held several requests), so a single chat pays no delay.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Sequence
+
+# encode(texts, batch_size) -> float32 array, one unit-length row per text
+EncodeFn = Callable[[list[str], int], Any]
+
+
+class _Request:
+    __slots__ = ("texts", "batch_size", "enqueued", "future")
+
+    def __init__(self, texts: list[str], batch_size: int) -> None:
+        self.texts = texts
+        self.batch_size = batch_size
+        self.enqueued = time.monotonic()
+        self.future: Future = Future()
+
+
+class EmbeddingBatcher:
+    """Coalesce concurrent ``encode`` calls into batched forward passes.
+
+    With ``max_batch <= 1`` batching is disabled and :meth:`encode` calls
+    the model directly in the caller's thread.
+    """
+
+    def __init__(self, encode: EncodeFn, max_batch: int = 32, max_wait_ms: float = 2.0) -> None:
+        self._encode = encode
+        self.max_batch = max_batch
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._pending: deque[_Request] = deque()
+        self._cond = threading.Condition()
+        self._worker: threading.Thread | None = None
+        self._closed = False
+        self._last_batch_requests = 0
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_batch > 1
+
+    def encode(self, texts: Sequence[str], batch_size: int | None = None) -> Any:
+        """Embed *texts*; blocks until the batch containing them has run."""
+        texts = list(texts)
+        batch_size = batch_size or max(self.max_batch, 1)
+        if not self.enabled or not texts:
+            self._count(1, len(texts))
+            return self._encode(texts, batch_size)
+
+        request = _Request(texts, batch_size)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("EmbeddingBatcher is closed")
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name="rag-embed", daemon=True
+                )
+                self._worker.start()
+            self._pending.append(request)
+            self._cond.notify()
+        return request.future.result()
+
+    def close(self) -> None:
+        """Stop the worker once the queued requests are served."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._worker is not None:
+            self._worker.join()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "batches": self.batches,
+                "requests": self.requests,
+                "avg_batch": round(self.texts / self.batches, 2) if self.batches else 0.0,
+            }
+
+    def _count(self, requests: int, texts: int) -> None:
+        with self._cond:
+            self.batches += 1
+            self.requests += requests
+            self.texts += texts
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+
+    def _queued_texts(self) -> int:
+        return sum(len(request.texts) for request in self._pending)
+
+    def _next_batch(self) -> list[_Request]:
+        """Wait for work, linger briefly for company, then take a batch."""
+        with self._cond:
+            while not self._pending:
+                if self._closed:
+                    return []
+                self._cond.wait()
+            deadline = self._pending[0].enqueued + self.max_wait
+            if len(self._pending) == 1 and self._last_batch_requests <= 1:
+                deadline = 0.0  # no sign of concurrent callers: don't make this one wait
+            while not self._closed and self._queued_texts() < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = [self._pending.popleft()]
+            size = len(batch[0].texts)
+            while self._pending and size + len(self._pending[0].texts) <= self.max_batch:
+                request = self._pending.popleft()
+                batch.append(request)
+                size += len(request.texts)
+            self._last_batch_requests = len(batch)
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            # Identical texts (the same question from two chats) are encoded once.
+            unique: dict[str, int] = {}
+            for request in batch:
+                for text in request.texts:
+                    unique.setdefault(text, len(unique))
+            try:
+                rows = self._encode(list(unique), max(r.batch_size for r in batch))
+            except BaseException as exc:  # noqa: BLE001
+                for request in batch:
+                    request.future.set_exception(exc)
+                continue
+            self._count(len(batch), len(unique))
+            for request in batch:
+                request.future.set_result(rows[[unique[text] for text in request.texts]])
@@ -0,0 +1,283 @@
+"""Streaming, sentence-aware document chunking sized in embedding-model tokens.
+
+The old chunker split a whole document into words and cut fixed 500-word
+windows: a 900-page PDF was fully materialised first, chunk edges fell
+mid-sentence, and most chunks were silently truncated at the embedding
+model's 256-token limit.
+
+Here every stage is a generator:
+
+* :func:`iter_blocks` yields one PDF page, or one ~64 KB line-aligned block
+  of a text file, at a time;
+* :func:`iter_segments` turns blocks into sentences and headings, carrying
+  an unfinished sentence across block boundaries;
+* :func:`chunk_segments` packs whole sentences into chunks of at most
+  ``max_tokens`` embedding-model tokens, repeating the last
+  ``overlap_tokens`` worth of sentences at the start of the next chunk and
+  starting a fresh chunk at headings.
+
+Memory therefore depends on the chunk size, not on the document size.
+"""
+from __future__ import annotations
+
+import hashlib
+import importlib
+import logging
+import re
+from collections import deque
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+from assistant.prompt_budget import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+TEXT_SUFFIXES = {".txt", ".md", ".log"}
+SUPPORTED_SUFFIXES = TEXT_SUFFIXES | {".pdf"}
+
+# Bump when the segmentation rules change so re-ingest re-chunks unchanged files.
+CHUNKER_VERSION = 1
+
+_BLOCK_CHARS = 64 * 1024     # text-file read size
+_MAX_CARRY_CHARS = 8 * 1024  # an unterminated "sentence" longer than this is emitted anyway
+_HASH_BLOCK_BYTES = 1 << 20
+
+_PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?…])[\"'”’)\]]*\s+")
+_MARKDOWN_HEADING = re.compile(r"^\s{0,3}#{1,6}\s")
+_TERMINATED = re.compile(r"[.!?…:;][\"'”’)\]]*$")
+
+CountFn = Callable[[str], int]
+
+
+def file_digest(path: Path) -> str:
+    """SHA-256 of *path*'s bytes, read in blocks (equal to ``content_hash(bytes)``)."""
+    digest = hashlib.sha256()
+    with Path(path).open("rb") as handle:
+        for block in iter(lambda: handle.read(_HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# Extraction
+# ---------------------------------------------------------------------------
+
+def iter_blocks(path: Path) -> Iterator[str]:
+    """Yield *path*'s text a page (PDF) or ~64 KB block (text files) at a time."""
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix in TEXT_SUFFIXES:
+        with path.open("r", encoding="utf-8", errors="ignore") as handle:
+            pending: list[str] = []
+            size = 0
+            for line in handle:
+                pending.append(line)
+                size += len(line)
+                if size >= _BLOCK_CHARS:
+                    yield "".join(pending)
+                    pending, size = [], 0
+            if pending:
+                yield "".join(pending)
+    elif suffix == ".pdf":
+        from pypdf import PdfReader
+
+        for page in PdfReader(str(path)).pages:
+            yield (page.extract_text() or "") + "\n"
+
+
+# ---------------------------------------------------------------------------
+# Segmentation
+# ---------------------------------------------------------------------------
+
+def _paragraph_segments(paragraph: str) -> Iterator[tuple[str, bool]]:
+    """Split one paragraph into ``(text, is_heading)`` segments."""
+    prose: list[str] = []
+    lines = paragraph.splitlines()
+    for number, line in enumerate(lines):
+        stripped = line.strip()
+        if not stripped:
+            continue
+        # A markdown heading, or a lone short line with no terminal
+        # punctuation opening a paragraph (a PDF section title).
+        is_heading = bool(_MARKDOWN_HEADING.match(line)) or (
+            number == 0
+            and len(lines) > 1
+            and len(stripped) <= 80
+            and not _TERMINATED.search(stripped)
+            and not stripped[0].islower()
+        )
+        if is_heading:
+            if prose:
+                yield from ((s, False) for s in _sentences(" ".join(prose)))
+                prose = []
+            yield stripped, True
+        else:
+            prose.append(stripped)
+    if prose:
+        yield from ((s, False) for s in _sentences(" ".join(prose)))
+
+
+def _sentences(text: str) -> list[str]:
+    return [part.strip() for part in _SENTENCE_END.split(text) if part.strip()]
+
+
+def iter_segments(blocks: Iterable[str]) -> Iterator[tuple[str, bool]]:
+    """Turn streamed text blocks into ``(sentence or heading, is_heading)`` pairs.
+
+    The last, possibly unfinished paragraph of each block is carried into the
+    next one, so page and block boundaries never split a sentence.
+    """
+    carry = ""
+    for block in blocks:
+        paragraphs = _PARAGRAPH_BREAK.split(carry + block)
+        carry = paragraphs.pop()
+        for paragraph in paragraphs:
+            yield from _paragraph_segments(paragraph)
+        if len(carry) > _MAX_CARRY_CHARS:
+            # No paragraph break for a long stretch: flush all but the
+            # trailing unterminated sentence.
+            segments = list(_paragraph_segments(carry))
+            tail = segments.pop() if segments and not _TERMINATED.search(segments[-1][0]) else None
+            yield from segments
+            carry = tail[0] if tail is not None and len(tail[0]) <= _MAX_CARRY_CHARS else ""
+            if tail is not None and not carry:
+                yield tail
+    if carry.strip():
+        yield from _paragraph_segments(carry)
+
+
+# ---------------------------------------------------------------------------
+# Packing
+# ---------------------------------------------------------------------------
+
+def _split_oversized(text: str, count: CountFn, max_tokens: int) -> Iterator[tuple[str, int]]:
+    """Cut a sentence longer than *max_tokens* at word boundaries."""
+    words: list[str] = []
+    total = 0
+    for word in text.split():
+        tokens = count(word)
+        if tokens > max_tokens:
+            # A single "word" over the limit (a URL, base64…): hard-cut by characters.
+            step = max(1, len(word) * max_tokens // tokens)
+            pieces = [word[i : i + step] for i in range(0, len(word), step)]
+        else:
+            pieces = [word]
+        for piece in pieces:
+            tokens = count(piece) if len(pieces) > 1 else tokens
+            if words and total + tokens > max_tokens:
+                yield " ".join(words), total
+                words, total = [], 0
+            words.append(piece)
+            total += tokens
+    if words:
+        yield " ".join(words), total
+
+
+def chunk_segments(
+    segments: Iterable[tuple[str, bool]],
+    count: CountFn,
+    max_tokens: int = 240,
+    overlap_tokens: int = 40,
+) -> Iterator[str]:
+    """Pack segments into chunks of at most *max_tokens* tokens.
+
+    Consecutive chunks share up to *overlap_tokens* tokens of whole trailing
+    sentences; a heading starts a new chunk (without overlap) once the
+    current one is at least half full.
+    """
+    overlap_tokens = max(0, min(overlap_tokens, max_tokens // 2))
+    window: deque[tuple[str, int]] = deque()
+    total = 0
+    fresh = False  # window holds something not yet emitted
+
+    def emit() -> str:
+        return " ".join(text for text, _ in window)
+
+    for text, is_heading in segments:
+        if is_heading and fresh and total >= max_tokens // 2:
+            yield emit()
+            window.clear()
+            total, fresh = 0, False
+        tokens = count(text)
+        parts = [(text, tokens)] if tokens <= max_tokens else _split_oversized(text, count, max_tokens)
+        for part, part_tokens in parts:
+            if window and total + part_tokens > max_tokens:
+                if fresh:
+                    yield emit()
+                # Keep whole trailing sentences as overlap, as long as they fit.
+                while window and (total > overlap_tokens or total + part_tokens > max_tokens):
+                    total -= window.popleft()[1]
+                fresh = False
+            window.append((part, part_tokens))
+            total += part_tokens
+            fresh = True
+    if fresh:
+        yield emit()
+
+
+def chunk_file(path: Path, count: CountFn, max_tokens: int = 240, overlap_tokens: int = 40) -> Iterator[str]:
+    """Stream the chunks of one document."""
+    return chunk_segments(iter_segments(iter_blocks(path)), count, max_tokens, overlap_tokens)
+
+
+def chunk_text(text: str, count: CountFn, max_tokens: int = 240, overlap_tokens: int = 40) -> Iterator[str]:
+    """Stream the chunks of a document already in memory (e.g. posted to the API)."""
+    blocks = (text[start : start + _BLOCK_CHARS] for start in range(0, len(text), _BLOCK_CHARS))
+    return chunk_segments(iter_segments(blocks), count, max_tokens, overlap_tokens)
+
+
+def chunking_signature(max_tokens: int, overlap_tokens: int) -> str:
+    """Identifies the chunking settings; part of each file's stored hash."""
+    return f"chunker-v{CHUNKER_VERSION}:{max_tokens}:{overlap_tokens}"
+
+
+# ---------------------------------------------------------------------------
+# Token counting
+# ---------------------------------------------------------------------------
+
+def _cached_tokenizer_file(model_name: str) -> Path | None:
+    """``tokenizer.json`` of *model_name* in the Hugging Face cache, if downloaded."""
+    try:
+        from huggingface_hub import try_to_load_from_cache
+    except ImportError:
+        return None
+    # sentence-transformers resolves bare names under its own organisation
+    repos = [model_name] if "/" in model_name else [f"sentence-transformers/{model_name}", model_name]
+    for repo in repos:
+        cached = try_to_load_from_cache(repo, "tokenizer.json")
+        if isinstance(cached, str):
+            return Path(cached)
+    return None
+
+
+def embedding_token_counter(model_name: str, onnx_dir: Path | None = None) -> CountFn:
+    """Count tokens with the embedding model's own tokenizer (special tokens excluded).
+
+    Uses ``tokenizer.json`` from the ONNX export, the model directory or the
+    Hugging Face cache (filled when the embedder first loaded the model); falls
+    back to the pessimistic character estimate from
+    :mod:`assistant.prompt_budget` if none is available.  Never downloads.
+    """
+    candidates = [Path(model_name) / "tokenizer.json"]
+    if onnx_dir is not None:
+        candidates.insert(0, Path(onnx_dir) / "tokenizer.json")
+    local = next((path for path in candidates if path.exists()), None) or _cached_tokenizer_file(
+        model_name
+    )
+    if local is None:
+        logger.warning("No tokenizer.json found for %s — estimating chunk sizes", model_name)
+        return estimate_tokens
+    try:
+        tokenizers = importlib.import_module("tokenizers")
+        tokenizer = tokenizers.Tokenizer.from_file(str(local))
+        tokenizer.no_truncation()
+        tokenizer.no_padding()
+    except Exception as exc:  # noqa: BLE001
+        logger.warning("Embedding tokenizer unavailable (%s) — estimating chunk sizes", exc)
+        return estimate_tokens
+
+    def count(text: str) -> int:
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+    return count
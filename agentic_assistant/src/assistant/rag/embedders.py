@@ -0,0 +1,185 @@
+"""Sentence embedders behind :class:`~assistant.rag.store.RagStore`.
+
+``torch`` runs the configured sentence-transformers model (the reference).
+``onnx`` runs an ONNX Runtime export of the same model, usually int8
+quantised, without importing torch, which saves seconds of startup and
+hundreds of MB of RSS on a Pi.  Create the export once with
+``scripts/export_onnx_embedder.py``; it also checks the export against the
+torch embeddings.
+
+Both produce unit-length float32 vectors of the model's dimension, so an
+index built with one keeps working with the other.
+"""
+from __future__ import annotations
+
+import importlib
+import json
+import logging
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# Written next to the exported model by scripts/export_onnx_embedder.py
+ONNX_CONFIG_NAME = "embedder.json"
+
+
+def _numpy() -> Any:
+    try:
+        return importlib.import_module("numpy")
+    except ModuleNotFoundError as exc:
+        raise RuntimeError(
+            "numpy is not installed in the active Python environment. "
+            "Install dependencies from requirements.txt before using RAG."
+        ) from exc
+
+
+class Embedder:
+    """Interface shared by all embedders."""
+
+    name = ""
+    dimension = 0
+
+    def encode(self, texts: list[str], batch_size: int = 32) -> Any:
+        """Return a ``(len(texts), dimension)`` float32 array of unit-length rows."""
+        raise NotImplementedError
+
+
+# ---------------------------------------------------------------------------
+# sentence-transformers (torch)
+# ---------------------------------------------------------------------------
+
+class SentenceTransformerEmbedder(Embedder):
+    name = "torch"
+
+    def __init__(self, model_name: str) -> None:
+        try:
+            from sentence_transformers import SentenceTransformer  # type: ignore[import]
+        except ImportError as exc:
+            raise RuntimeError(
+                "sentence-transformers is not installed. Run: pip install -r requirements.txt"
+            ) from exc
+        self._np = _numpy()
+        self.model = SentenceTransformer(model_name)
+        dimension = self.model.get_sentence_embedding_dimension()
+        if dimension is None:
+            raise RuntimeError("Embedding model did not provide output dimension")
+        self.dimension = int(dimension)
+
+    def encode(self, texts: list[str], batch_size: int = 32) -> Any:
+        return self.model.encode(
+            texts, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True
+        ).astype(self._np.float32)
+
+
+# ---------------------------------------------------------------------------
+# ONNX Runtime
+# ---------------------------------------------------------------------------
+
+class OnnxEmbedder(Embedder):
+    """Transformer forward pass in ONNX Runtime, pooled and normalised in numpy.
+
+    *model_dir* holds ``tokenizer.json``, the exported model and
+    ``embedder.json`` (model file, pooling mode, dimension, max sequence
+    length, source model name).
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_dir: Path, model_name: str = "", threads: int = 0) -> None:
+        try:
+            ort = importlib.import_module("onnxruntime")
+            tokenizers = importlib.import_module("tokenizers")
+        except ModuleNotFoundError as exc:
+            raise RuntimeError(
+                "onnxruntime and tokenizers are needed for EMBEDDING_BACKEND=onnx — "
+                "pip install onnxruntime tokenizers"
+            ) from exc
+        self._np = _numpy()
+        model_dir = Path(model_dir)
+        config_path = model_dir / ONNX_CONFIG_NAME
+        if not config_path.exists():
+            raise RuntimeError(
+                f"{config_path} not found. Export the model first: "
+                "python scripts/export_onnx_embedder.py"
+            )
+        with config_path.open("r", encoding="utf-8") as handle:
+            config = json.load(handle)
+        if model_name and config.get("model") and config["model"] != model_name:
+            logger.warning(
+                "%s was exported from %s but EMBEDDING_MODEL is %s — re-export it",
+                model_dir, config["model"], model_name,
+            )
+
+        self.dimension = int(config["dimension"])
+        self.pooling = config.get("pooling", "mean")
+        self.tokenizer = tokenizers.Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=int(config.get("max_seq_length", 256)))
+        self.tokenizer.enable_padding(
+            pad_id=int(config.get("pad_id", 0)), pad_token=config.get("pad_token", "[PAD]")
+        )
+
+        options = ort.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            str(model_dir / config["model_file"]), options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {item.name for item in self.session.get_inputs()}
+
+    def encode(self, texts: list[str], batch_size: int = 32) -> Any:
+        np = self._np
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        parts: list[Any] = []
+        for start in range(0, len(texts), max(1, batch_size)):
+            encodings = self.tokenizer.encode_batch(texts[start : start + batch_size])
+            ids = np.asarray([item.ids for item in encodings], dtype=np.int64)
+            mask = np.asarray([item.attention_mask for item in encodings], dtype=np.int64)
+            feeds = {"input_ids": ids, "attention_mask": mask}
+            if "token_type_ids" in self._input_names:
+                feeds["token_type_ids"] = np.asarray(
+                    [item.type_ids for item in encodings], dtype=np.int64
+                )
+            hidden = self.session.run(None, feeds)[0]
+            if self.pooling == "cls":
+                pooled = hidden[:, 0]
+            else:
+                weights = mask[:, :, None].astype(np.float32)
+                pooled = (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+            parts.append(pooled.astype(np.float32))
+        vectors = np.concatenate(parts)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+class NullEmbedder(Embedder):
+    """Stand-in for opening a store without loading a model (index maintenance).
+
+    Knows only the index dimension; any attempt to embed raises RuntimeError.
+    """
+
+    name = "none"
+
+    def __init__(self, dimension: int) -> None:
+        self.dimension = dimension
+
+    def encode(self, texts: list[str], batch_size: int = 32) -> Any:
+        raise RuntimeError("This RAG store was opened without an embedder")
+
+
+EMBEDDERS: dict[str, type[Embedder]] = {
+    SentenceTransformerEmbedder.name: SentenceTransformerEmbedder,
+    OnnxEmbedder.name: OnnxEmbedder,
+}
+
+
+def create_embedder(backend: str, model_name: str, onnx_dir: Path | None = None) -> Embedder:
+    """Build the embedder for *backend* (``"torch"`` or ``"onnx"``)."""
+    if backend not in EMBEDDERS:
+        logger.warning("Unknown EMBEDDING_BACKEND=%r — falling back to torch", backend)
+        backend = SentenceTransformerEmbedder.name
+    if backend == OnnxEmbedder.name:
+        if onnx_dir is None:
+            raise RuntimeError("EMBEDDING_BACKEND=onnx needs EMBEDDING_ONNX_DIR")
+        return OnnxEmbedder(onnx_dir, model_name)
+    return SentenceTransformerEmbedder(model_name)
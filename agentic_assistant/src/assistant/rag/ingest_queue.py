@@ -0,0 +1,227 @@
+"""Online ingestion: document adds and deletes run on the API's own store.
+
+``scripts/ingest_documents.py`` opens a second ``RagStore`` on the same
+files, so a running server kept answering from the index it had loaded at
+startup until it was restarted.  :class:`IngestQueue` applies changes to the
+server's store instead, on one background thread, in submission order (a
+delete queued after an ingest of the same source runs after it).
+
+Posted text is chunked exactly like a file by the script (same token limits
+and the same ``<content hash>:<chunking signature>`` file hash), so posting
+an unchanged document again is skipped before it is even chunked.  Queries
+are answered throughout: the store embeds new chunks before it takes the
+write lock, and holds it only while applying them.
+
+Jobs live in memory — the queued ones and the last *history* finished ones —
+and are lost on restart; their effects are not (the store is durable).
+"""
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable
+
+from assistant.rag.chunking import CountFn, chunk_text, chunking_signature
+from assistant.rag.store import DEFAULT_COLLECTION, RagStore, content_hash
+
+logger = logging.getLogger(__name__)
+
+JOB_STATES = ("queued", "running", "done", "failed")
+
+
+class IngestQueueFullError(RuntimeError):
+    """Raised when the maximum number of jobs is already waiting."""
+
+
+def _timestamp() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+@dataclass
+class IngestJob:
+    """Progress of one ingest (``kind="ingest"``) or delete job."""
+
+    kind: str
+    collection: str
+    sources: list[str]
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    state: str = "queued"
+    documents_done: int = 0
+    files_skipped: int = 0
+    chunks_added: int = 0
+    chunks_kept: int = 0
+    chunks_deleted: int = 0
+    error: str | None = None
+    created_at: str = field(default_factory=_timestamp)
+    started_at: str | None = None
+    finished_at: str | None = None
+    seconds: float | None = None
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        sources = data.pop("sources")
+        # A large upload would make every status poll echo all its names
+        data["documents"] = len(sources)
+        data["sources"] = sources[:20]
+        return data
+
+
+class IngestQueue:
+    """Single-threaded worker applying ingest/delete jobs to a :class:`RagStore`.
+
+    *store* returns the store, blocking while it loads (``BackgroundRagStore.wait``).
+    *token_counter* builds the chunk-size counter; it is called once, on the
+    worker thread, for the first ingest job.  Documents are passed to
+    ``add_documents`` in groups of about *batch_chunks* chunks, so progress
+    is visible and memory bounded.  The worker thread starts with the first job.
+    """
+
+    def __init__(
+        self,
+        store: Callable[[], RagStore],
+        token_counter: Callable[[], CountFn],
+        max_tokens: int = 240,
+        overlap_tokens: int = 40,
+        max_queued: int = 16,
+        batch_chunks: int = 256,
+        history: int = 100,
+    ) -> None:
+        self._store = store
+        self._token_counter = token_counter
+        self._count: CountFn | None = None
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.batch_chunks = max(1, batch_chunks)
+        self.history = history
+        self._queue: queue.Queue[tuple[IngestJob, Any]] = queue.Queue(maxsize=max(1, max_queued))
+        self._jobs: OrderedDict[str, IngestJob] = OrderedDict()
+        self._lock = threading.Lock()
+        self._worker: threading.Thread | None = None
+
+    # ------------------------------------------------------------------
+    # Submission and status
+    # ------------------------------------------------------------------
+
+    def submit_documents(
+        self, documents: list[tuple[str, str]], collection: str = DEFAULT_COLLECTION
+    ) -> dict:
+        """Queue ``(source, text)`` documents; each replaces what *source* held before."""
+        job = IngestJob("ingest", collection, [source for source, _ in documents])
+        return self._submit(job, documents)
+
+    def submit_delete(self, source: str, collection: str = DEFAULT_COLLECTION) -> dict:
+        """Queue the removal of every chunk of *source*."""
+        return self._submit(IngestJob("delete", collection, [source]), None)
+
+    def _submit(self, job: IngestJob, payload: Any) -> dict:
+        with self._lock:
+            try:
+                self._queue.put_nowait((job, payload))
+            except queue.Full:
+                raise IngestQueueFullError(
+                    f"{self._queue.maxsize} ingest jobs are already queued"
+                ) from None
+            self._jobs[job.id] = job
+            self._prune()
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="rag-ingest", daemon=True)
+                self._worker.start()
+            return job.to_dict()
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job is not None else None
+
+    def jobs(self) -> list[dict]:
+        """Every known job, newest first."""
+        with self._lock:
+            return [job.to_dict() for job in reversed(self._jobs.values())]
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = {state: 0 for state in JOB_STATES}
+            for job in self._jobs.values():
+                counts[job.state] += 1
+            return counts
+
+    def _prune(self) -> None:
+        """Forget the oldest finished jobs beyond *history* (lock held)."""
+        finished = [key for key, job in self._jobs.items() if job.state in ("done", "failed")]
+        for key in finished[: max(0, len(finished) - self.history)]:
+            del self._jobs[key]
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+
+    def _run(self) -> None:
+        while True:
+            job, payload = self._queue.get()
+            started = time.monotonic()
+            with self._lock:
+                job.state, job.started_at = "running", _timestamp()
+            try:
+                store = self._store()
+                if job.kind == "delete":
+                    deleted = store.delete_source(job.sources[0], job.collection)
+                    with self._lock:
+                        job.chunks_deleted, job.documents_done = deleted, 1
+                else:
+                    self._ingest(store, job, payload)
+            except Exception as exc:  # noqa: BLE001
+                logger.error("Ingest job %s failed: %s", job.id, exc)
+                state, error = "failed", str(exc)
+            else:
+                state, error = "done", None
+            with self._lock:
+                job.state, job.error = state, error
+                job.finished_at = _timestamp()
+                job.seconds = round(time.monotonic() - started, 2)
+                self._prune()
+            logger.info(
+                "Ingest job %s (%s, %d source(s)) %s in %.1fs: +%d chunks, -%d",
+                job.id, job.kind, len(job.sources), state, job.seconds,
+                job.chunks_added, job.chunks_deleted,
+            )
+            del payload  # the document text is not kept with the job
+
+    def _ingest(self, store: RagStore, job: IngestJob, documents: list[tuple[str, str]]) -> None:
+        if self._count is None:
+            self._count = self._token_counter()
+        signature = chunking_signature(self.max_tokens, self.overlap_tokens)
+        known = store.file_hashes(job.collection)
+        batch: list[tuple[str, str, list[str]]] = []
+        pending = 0
+
+        def flush() -> None:
+            nonlocal pending
+            stats = store.add_documents(batch, collection=job.collection)
+            with self._lock:
+                job.documents_done += len(batch)
+                job.files_skipped += stats.files_skipped
+                job.chunks_added += stats.chunks_added
+                job.chunks_kept += stats.chunks_kept
+                job.chunks_deleted += stats.chunks_deleted
+            batch.clear()
+            pending = 0
+
+        for source, text in documents:
+            file_hash = content_hash(f"{content_hash(text)}:{signature}")
+            if known.get(source) == file_hash:
+                with self._lock:
+                    job.documents_done += 1
+                    job.files_skipped += 1
+                continue
+            chunks = list(chunk_text(text, self._count, self.max_tokens, self.overlap_tokens))
+            batch.append((source, file_hash, chunks))
+            pending += len(chunks)
+            if pending >= self.batch_chunks:
+                flush()
+        if batch:
+            flush()
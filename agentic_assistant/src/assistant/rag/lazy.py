@@ -0,0 +1,137 @@
+"""Background construction of :class:`~assistant.rag.store.RagStore`.
+
+Building the store imports the ML stack, loads the embedding model and reads
+the vector index — 20+ seconds on a Pi, during which a module-level
+``RagStore(...)`` kept Uvicorn from even binding its port.
+
+``BackgroundRagStore`` builds the store on a daemon thread instead.  Until
+it is ready, :meth:`embed` and :meth:`query` raise :class:`RagWarmingError`
+(the orchestrator answers without RAG context), ``generation`` is ``-1`` and
+``collection_size`` is 0.  Loading starts with :meth:`start` (the API calls
+it on startup) or on first use.  :meth:`wait` blocks for callers that cannot do
+without the store, such as ingestion.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Iterable
+
+from assistant.rag.store import RagStore
+
+logger = logging.getLogger(__name__)
+
+
+class RagWarmingError(RuntimeError):
+    """Raised when the RAG store is still loading (or failed to load)."""
+
+
+class BackgroundRagStore:
+    """Load a RagStore off the request path; report its state meanwhile.
+
+    *state* is ``"cold"`` (not started), ``"warming"``, ``"ready"`` or
+    ``"failed"``.  *on_ready* runs on the loader thread once the store exists.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], RagStore],
+        on_ready: Callable[[RagStore], None] | None = None,
+    ) -> None:
+        self._factory = factory
+        self._on_ready = on_ready
+        self._store: RagStore | None = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self.state = "cold"
+        self.error = ""
+        self.load_seconds: float | None = None
+
+    def start(self) -> None:
+        """Begin loading on a daemon thread (a no-op once started)."""
+        with self._lock:
+            if self.state != "cold":
+                return
+            self.state = "warming"
+        threading.Thread(target=self._load, name="rag-warmup", daemon=True).start()
+
+    def _load(self) -> None:
+        started = time.monotonic()
+        try:
+            store = self._factory()
+            if self._on_ready is not None:
+                self._on_ready(store)
+        except Exception as exc:  # noqa: BLE001
+            self.error = str(exc)
+            self.state = "failed"
+            logger.error("RAG store failed to load — answering without RAG: %s", exc)
+        else:
+            self._store = store
+            self.state = "ready"
+            logger.info("RAG store ready in %.1fs", time.monotonic() - started)
+        finally:
+            self.load_seconds = round(time.monotonic() - started, 2)
+            self._ready.set()
+
+    def wait(self, timeout: float | None = None) -> RagStore:
+        """Start loading if needed and block until the store is usable."""
+        self.start()
+        self._ready.wait(timeout)
+        return self._require()
+
+    def _require(self) -> RagStore:
+        store = self._store
+        if store is None:
+            self.start()  # first use kicks off loading if nobody started it
+            if self.state == "failed":
+                raise RagWarmingError(f"RAG store failed to load: {self.error}")
+            raise RagWarmingError("RAG store is still loading")
+        return store
+
+    def status(self) -> dict:
+        return {"state": self.state, "load_seconds": self.load_seconds, "error": self.error or None}
+
+    # ------------------------------------------------------------------
+    # The RagStore surface used on the request path
+    # ------------------------------------------------------------------
+
+    @property
+    def ready(self) -> bool:
+        return self._store is not None
+
+    @property
+    def generation(self) -> int:
+        # -1 keeps anything cached while RAG was unavailable apart from real generations
+        return self._store.generation if self._store is not None else -1
+
+    @property
+    def dimension(self) -> int:
+        return self._require().dimension
+
+    def embed(self, text: str) -> Any:
+        return self._require().embed(text)
+
+    def query(
+        self,
+        text: str,
+        top_k: int = 3,
+        vector: Any = None,
+        mode: str | None = None,
+        collections: Iterable[str] | None = None,
+    ) -> list[dict]:
+        return self._require().query(
+            text, top_k=top_k, vector=vector, mode=mode, collections=collections
+        )
+
+    def prefers_lexical(self, text: str) -> bool:
+        return self._store.prefers_lexical(text) if self._store is not None else False
+
+    def collection_size(self, collection: str) -> int:
+        return self._store.collection_size(collection) if self._store is not None else 0
+
+    def cache_stats(self) -> dict | None:
+        return self._store.cache_stats() if self._store is not None else None
+
+    def index_stats(self) -> dict | None:
+        return self._store.index_stats() if self._store is not None else None
@@ -0,0 +1,98 @@
+"""Float32 copy of every embedding, by label, in a memory-mapped ``vectors.raw.npy``.
+
+Index backends keep vectors in whatever form suits search: hnswlib inside
+its graph, :class:`~assistant.rag.backends.QuantizedBackend` as int8 or
+float16.  This sidecar keeps the exact embedder output next to them, so
+``scripts/maintain_index.py`` can compact the index or rebuild it with
+different parameters without running the embedder again, and can measure
+recall against exact search.
+
+Row *n* holds the vector of label *n*.  Rows of deleted labels keep their
+old vector until the label is reused; never-written rows are zero.  Writes
+go to the page cache and are flushed by :meth:`flush` (``RagStore`` calls it
+before it empties the vector log, so the log always covers unflushed rows).
+"""
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Any
+
+RAW_VECTORS_NAME = "vectors.raw.npy"
+
+
+class RawVectors:
+    """Grow-on-write float32 matrix of ``(labels, dimension)``."""
+
+    def __init__(self, data_dir: Path, dimension: int) -> None:
+        try:
+            import numpy as _np  # type: ignore[import]
+        except ImportError as exc:
+            raise RuntimeError(
+                "numpy is not installed. Run: pip install -r requirements.txt"
+            ) from exc
+        self._np = _np
+        self.path = Path(data_dir) / RAW_VECTORS_NAME
+        self.dimension = dimension
+        self._matrix: Any = None
+
+    def open(self) -> bool:
+        """Map the existing file; returns False if there is none yet."""
+        if not self.path.exists():
+            return False
+        matrix = self._np.load(self.path, mmap_mode="r+")
+        if matrix.ndim != 2 or matrix.shape[1] != self.dimension:
+            raise RuntimeError(
+                f"{self.path} holds {matrix.shape[-1]}-dimensional vectors, expected "
+                f"{self.dimension}. Move it aside; it is rebuilt from the index."
+            )
+        self._matrix = matrix
+        return True
+
+    def rows(self) -> int:
+        return int(self._matrix.shape[0]) if self._matrix is not None else 0
+
+    def write(self, labels: Any, vectors: Any) -> None:
+        np = self._np
+        labels = np.asarray(labels, dtype=np.int64)
+        if not len(labels):
+            return
+        required = int(labels.max()) + 1
+        if required > self.rows():
+            self._grow(max(required, self.rows() * 2, 1024))
+        self._matrix[labels] = np.asarray(vectors, dtype=np.float32).reshape(
+            len(labels), self.dimension
+        )
+
+    def read(self, labels: Any) -> Any:
+        """Float32 rows for *labels* (zeros for labels never written)."""
+        np = self._np
+        labels = np.asarray(labels, dtype=np.int64)
+        out = np.zeros((len(labels), self.dimension), dtype=np.float32)
+        present = labels < self.rows()
+        if present.any():
+            out[present] = self._matrix[labels[present]]
+        return out
+
+    def flush(self) -> None:
+        if self._matrix is not None:
+            self._matrix.flush()
+
+    def _grow(self, capacity: int) -> None:
+        np = self._np
+        tmp_path = self.path.with_suffix(".tmp.npy")
+        grown = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype="float32", shape=(capacity, self.dimension)
+        )
+        old = self._matrix
+        if old is not None:
+            rows = old.shape[0]
+            for start in range(0, rows, 65536):
+                end = min(rows, start + 65536)
+                grown[start:end] = old[start:end]
+        grown.flush()
+        # Close both maps before replacing (Windows cannot replace a mapped file).
+        del grown, old
+        self._matrix = None
+        os.replace(tmp_path, self.path)
+        self._matrix = np.load(self.path, mmap_mode="r+")
@@ -1,43 +1,356 @@
 from __future__ import annotations
 
+import hashlib
 import json
-import importlib
+import logging
+import os
+import re
+import shutil
 import sqlite3
+import threading
+import time
 import uuid
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Iterable
+from typing import Any, Iterable, Iterator
+
+from assistant.rag.batcher import EmbeddingBatcher
+from assistant.rag.embedders import Embedder, create_embedder
+from assistant.rag.backends import BACKENDS, HnswBackend, QuantizedBackend, VectorBackend, migrate
+from assistant.rag.raw_vectors import RawVectors
+
+logger = logging.getLogger(__name__)
+
+# vectors.log layout: a 16-byte header (magic + little-endian uint32 dimension
+# + padding), then fixed-size records of (int64 label, float32[dimension]).
+_LOG_MAGIC = b"SWVLOG1\0"
+_LOG_HEADER_BYTES = 16
+# rebuild_index() stages new files here; READY marks them complete.
+_REBUILD_DIR = "rebuild"
+_REBUILD_READY = "READY"
+_REBUILD_BLOCK = 4096
+# HNSW ef values tried by tune_ef(), smallest first
+_EF_SWEEP = (10, 16, 24, 32, 48, 64, 96, 128, 192, 256, 384, 512)
+
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid", "auto")
+DEFAULT_COLLECTION = "shared"
+_RRF_K = 60  # reciprocal-rank fusion constant (Cormack et al.)
+# MMR alone barely separates true near-duplicates (their similarity to the
+# query equals their similarity to each other); above this they are dropped.
+_NEAR_DUPLICATE = 0.95
+_WORD = re.compile(r"\w+")
+# Identifier-like tokens: config keys, error codes, versions (LLAMA_MAIN_PATH, E1234, 0x80070005)
+_IDENTIFIER = re.compile(r"^(?=\w*[_\d])\w{3,}$|^[A-Z]{2,}$")
+
+
+def _fts_query(text: str) -> str:
+    """FTS5 MATCH expression: every word of *text* as a quoted term, OR-ed."""
+    return " OR ".join(f'"{word}"' for word in dict.fromkeys(_WORD.findall(text.lower())))
+
+
+def user_collection(user_id: str) -> str:
+    """Name of *user_id*'s private collection (e.g. ``user:tg:123456``)."""
+    return f"user:{user_id}"
+
+
+def looks_like_keywords(text: str) -> bool:
+    """True for short queries built around an exact identifier (e.g. ``LLAMA_MAIN_PATH?``)."""
+    words = _WORD.findall(text)
+    return 0 < len(words) <= 6 and any(_IDENTIFIER.match(word) for word in words)
+
+
+def content_hash(data: str | bytes) -> str:
+    """SHA-256 hex digest used for file and chunk change detection."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+@dataclass
+class IngestStats:
+    files_skipped: int = 0
+    chunks_added: int = 0
+    chunks_kept: int = 0
+    chunks_deleted: int = 0
+
+
+def _cache_key(text: str) -> str:
+    """Case- and whitespace-insensitive key for query caches."""
+    return " ".join(text.lower().split())
+
+
+class _LRUCache:
+    """Thread-safe bounded LRU map with hit/miss counters."""
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Any, Any] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Any, value: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+class _ReadWriteLock:
+    """Many readers or one writer; a waiting writer holds back new readers.
+
+    Not reentrant: a thread holding the read side must not acquire it again
+    (it would deadlock behind a waiting writer).
+    """
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
 
 
 class RagStore:
-    def __init__(self, data_dir: Path, embedding_model: str) -> None:
+    """Vector index plus SQLite chunk metadata.
+
+    The index is a pluggable :class:`~assistant.rag.backends.VectorBackend`:
+    hnswlib (``vector_backend="hnsw"``) or exact search over a quantised
+    memmap (``"quantized"``).  Switching backends migrates the existing
+    snapshot on the next start.
+
+    Writes are append-only: ``add_chunks`` appends the new (label, vector)
+    records to ``vectors.log`` instead of rewriting the whole index
+    snapshot.  The snapshot is rewritten by :meth:`checkpoint` — called
+    explicitly (e.g. at the end of an ingest run) or automatically once the
+    log grows past *checkpoint_log_bytes*.  On startup the snapshot is loaded
+    and the log replayed on top of it.  Each embedding is also written, as
+    float32 by label, to the ``vectors.raw.npy`` sidecar, from which
+    :meth:`rebuild_index` rebuilds or compacts the index without re-embedding.
+
+    Every file (``source``) and chunk carries a content hash, so re-ingesting
+    skips unchanged files, keeps unchanged chunks of changed files and only
+    embeds what is new.  Removed chunks are ``mark_deleted`` in the index and
+    their labels are handed to the next chunks added, so the index does not
+    grow with every re-ingest.
+
+    Retrieval combines the vector index with an SQLite FTS5 (BM25) index over
+    the same chunks, kept in sync by triggers.  ``mode="hybrid"`` runs both
+    concurrently and merges them with reciprocal-rank fusion, so exact
+    identifiers the embedder blurs still rank; ``mode="lexical"`` never
+    touches the embedder; ``mode="auto"`` (the default) answers short,
+    identifier-heavy queries lexically when BM25 finds anything and falls
+    back to hybrid otherwise.
+
+    Chunks belong to a *collection* (``"shared"`` by default, or a private
+    ``user:<user_id>`` collection).  ``query(..., collections=[...])`` only
+    searches those collections: small ones by exact search over just their
+    vectors, larger ones by filtered kNN, so cost follows the size of the
+    collection rather than of the whole corpus.
+
+    Query embeddings are cached by normalised text, and query results by
+    (embedding, ``top_k``, :attr:`generation`).  Every add or delete bumps the
+    generation, so a stale result can never be served.
+
+    The store is safe to write while it serves queries.  Writers (adds,
+    deletes, checkpoints, rebuilds, ef tuning) are serialised, and new
+    chunks are embedded before any lock that queries wait on is taken; only
+    the short step that applies them to the index, SQLite and the in-memory
+    label sets excludes queries, so a query sees a write entirely or not at
+    all.  Another *process* writing the same data directory is still not
+    seen until restart.
+    """
+
+    def __init__(
+        self,
+        data_dir: Path,
+        embedding_model: str,
+        checkpoint_log_bytes: int = 16 * 1024 * 1024,
+        embedding_cache_size: int = 1024,
+        result_cache_size: int = 256,
+        retrieval_mode: str = "auto",
+        max_distance: float = 0.8,
+        mmr_lambda: float = 0.7,
+        collapse_adjacent: bool = True,
+        exact_search_max: int = 4096,
+        embed_batch_max: int = 32,
+        embed_batch_wait_ms: float = 2.0,
+        vector_backend: str = "hnsw",
+        quantized_dtype: str = "int8",
+        quantized_rescore: bool = True,
+        embedding_backend: str = "torch",
+        onnx_dir: Path | None = None,
+        embedder: Embedder | None = None,
+        target_recall: float = 0.95,
+        tune_k: int = 20,
+        retune_growth: float = 0.25,
+    ) -> None:
         # Lazy-import heavy deps so a missing package yields a clear error
         # instead of crashing the entire server process at startup.
         try:
-            from sentence_transformers import SentenceTransformer  # type: ignore[import]
             import numpy as _np  # type: ignore[import]
         except ImportError as exc:
             raise RuntimeError(
-                "sentence-transformers and/or numpy are not installed. "
-                "Run: pip install -r requirements.txt"
+                "numpy is not installed. Run: pip install -r requirements.txt"
             ) from exc
         self._np = _np
 
         self.data_dir = Path(data_dir)
         self.data_dir.mkdir(parents=True, exist_ok=True)
 
-        self.index_path = self.data_dir / "vectors.bin"
         self.meta_path = self.data_dir / "index_meta.json"
         self.sqlite_path = self.data_dir / "chunks.sqlite3"
+        self.log_path = self.data_dir / "vectors.log"
+        self.checkpoint_log_bytes = checkpoint_log_bytes
 
-        self.embedder = SentenceTransformer(embedding_model)
-        dimension = self.embedder.get_sentence_embedding_dimension()
-        if dimension is None:
-            raise RuntimeError("Embedding model did not provide output dimension")
-        self.dimension = int(dimension)
+        self.embedder: Embedder = embedder or create_embedder(
+            embedding_backend, embedding_model, onnx_dir
+        )
+        self.dimension = self.embedder.dimension
+        # Queries from concurrent threads and ingest batches share one
+        # encoder thread, so simultaneous questions become one forward pass.
+        self._batcher = EmbeddingBatcher(self._encode, embed_batch_max, embed_batch_wait_ms)
 
-        self.index: Any = None
+        if vector_backend not in BACKENDS:
+            logger.warning("Unknown RAG_VECTOR_BACKEND=%r — falling back to hnsw", vector_backend)
+            vector_backend = HnswBackend.name
+        self.vector_backend = vector_backend
+        self.quantized_dtype = quantized_dtype
+        self.quantized_rescore = quantized_rescore
+        self.index: VectorBackend | None = None
+        # Build parameters recorded in index_meta.json, reused for new indexes
+        self._index_params: dict = {}
+        # Exact float32 embeddings by label, for rebuilds without the embedder
+        self.raw_vectors = RawVectors(self.data_dir, self.dimension)
+        # HNSW ef tuning (see tune_ef); target_recall <= 0 disables it
+        self.target_recall = target_recall
+        self.tune_k = max(1, tune_k)
+        self.retune_growth = retune_growth
+        self.ef_tuning: dict | None = None
+        # Bumped on every index change; caches keyed on retrieval results
+        # (e.g. the response cache) compare it to detect stale entries.
+        self.generation = 0
+        # Labels of deleted chunks: excluded from search, reused by new chunks
+        self._free_labels: list[int] = []
+        # One past the highest label SQLite knows (live or free)
+        self._label_end = 0
+        # collection → labels of its live chunks
+        self._collections: dict[str, set[int]] = defaultdict(set)
+        self.exact_search_max = exact_search_max
+        # Post-retrieval selection (see _select); max_distance <= 0 and
+        # mmr_lambda >= 1 switch the respective step off.
+        self.max_distance = max_distance
+        self.mmr_lambda = mmr_lambda
+        self.collapse_adjacent = collapse_adjacent
+        self._embedding_cache = _LRUCache(embedding_cache_size)
+        self._result_cache = _LRUCache(result_cache_size)
+
+        if retrieval_mode not in RETRIEVAL_MODES:
+            logger.warning("Unknown RAG_RETRIEVAL_MODE=%r — falling back to hybrid", retrieval_mode)
+            retrieval_mode = "hybrid"
+        self.retrieval_mode = retrieval_mode
+        self._fts = False
+        # BM25 runs on this pool while the calling thread embeds and searches
+        # the vector index (sqlite3, torch and hnswlib all release the GIL).
+        self._lexical_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="rag-fts")
+        # Queries read under _rw; writers hold _write_mutex throughout (while
+        # they embed, too) and take _rw's write side only to apply a change.
+        self._rw = _ReadWriteLock()
+        self._write_mutex = threading.RLock()
+        self._finish_rebuild()
         self._ensure_sqlite()
         self._load_or_create_index()
+        self._maybe_tune_ef()
+
+    @classmethod
+    def from_settings(cls, settings: Any, embedder: Embedder | None = None) -> "RagStore":
+        """Build the store from :class:`~assistant.config.Settings`.
+
+        Shared by the API and the scripts so they all open the same backend
+        (a mismatch would migrate the index back and forth).
+        """
+        return cls(
+            settings.rag_data_dir,
+            settings.embedding_model,
+            checkpoint_log_bytes=settings.rag_checkpoint_log_mb * 1024 * 1024,
+            embedding_cache_size=settings.rag_embedding_cache_size,
+            result_cache_size=settings.rag_result_cache_size,
+            retrieval_mode=settings.rag_retrieval_mode,
+            max_distance=settings.rag_max_distance,
+            mmr_lambda=settings.rag_mmr_lambda,
+            collapse_adjacent=settings.rag_collapse_adjacent,
+            embed_batch_max=settings.rag_embed_batch_max,
+            embed_batch_wait_ms=settings.rag_embed_batch_wait_ms,
+            vector_backend=settings.rag_vector_backend,
+            quantized_dtype=settings.rag_quantized_dtype,
+            quantized_rescore=settings.rag_quantized_rescore,
+            embedding_backend=settings.embedding_backend,
+            onnx_dir=settings.embedding_onnx_dir,
+            embedder=embedder,
+            target_recall=settings.rag_hnsw_target_recall,
+            tune_k=settings.rag_hnsw_tune_k,
+            retune_growth=settings.rag_hnsw_retune_growth,
+        )
 
     def _connect(self) -> sqlite3.Connection:
         conn = sqlite3.connect(self.sqlite_path)
@@ -65,6 +378,50 @@ class RagStore:
             }
             if "vector_label" not in columns:
                 conn.execute("ALTER TABLE chunks ADD COLUMN vector_label INTEGER")
+            if "content_hash" not in columns:
+                conn.execute("ALTER TABLE chunks ADD COLUMN content_hash TEXT")
+            if "collection" not in columns:
+                conn.execute(
+                    f"ALTER TABLE chunks ADD COLUMN collection TEXT NOT NULL DEFAULT '{DEFAULT_COLLECTION}'"
+                )
+            conn.execute("DROP INDEX IF EXISTS idx_chunks_source")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_chunks_collection_source ON chunks(collection, source)"
+            )
+
+            file_columns = {
+                row["name"] for row in conn.execute("PRAGMA table_info(files)").fetchall()
+            }
+            if file_columns and "collection" not in file_columns:
+                conn.execute("ALTER TABLE files RENAME TO files_v1")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS files (
+                    collection TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    chunk_count INTEGER NOT NULL,
+                    updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (collection, source)
+                )
+                """
+            )
+            if file_columns and "collection" not in file_columns:
+                conn.execute(
+                    "INSERT INTO files (collection, source, content_hash, chunk_count, updated_at) "
+                    "SELECT ?, source, content_hash, chunk_count, updated_at FROM files_v1",
+                    (DEFAULT_COLLECTION,),
+                )
+                conn.execute("DROP TABLE files_v1")
+            conn.execute("CREATE TABLE IF NOT EXISTS free_labels (label INTEGER PRIMARY KEY)")
+
+            unhashed = conn.execute(
+                "SELECT rowid, content FROM chunks WHERE content_hash IS NULL"
+            ).fetchall()
+            conn.executemany(
+                "UPDATE chunks SET content_hash = ? WHERE rowid = ?",
+                [(content_hash(row["content"]), row["rowid"]) for row in unhashed],
+            )
 
             unlabeled = conn.execute(
                 "SELECT rowid FROM chunks WHERE vector_label IS NULL ORDER BY rowid"
@@ -76,101 +433,1082 @@ class RagStore:
                 )
             conn.commit()
 
-    def _load_or_create_index(self) -> None:
-        try:
-            hnswlib = importlib.import_module("hnswlib")
-        except ModuleNotFoundError as exc:
-            raise RuntimeError(
-                "hnswlib is not installed in the active Python environment. "
-                "Install dependencies from requirements.txt before using RAG."
-            ) from exc
+            self._fts = self._ensure_fts(conn)
+
+            self._free_labels = [
+                int(row["label"])
+                for row in conn.execute("SELECT label FROM free_labels ORDER BY label")
+            ]
+            for row in conn.execute("SELECT collection, vector_label FROM chunks"):
+                self._collections[row["collection"]].add(int(row["vector_label"]))
+            top = conn.execute("SELECT MAX(vector_label) AS top FROM chunks").fetchone()["top"]
+            self._label_end = max(
+                int(top) + 1 if top is not None else 0,
+                self._free_labels[-1] + 1 if self._free_labels else 0,
+            )
+
+    def _ensure_fts(self, conn: sqlite3.Connection) -> bool:
+        """Create the FTS5 mirror of ``chunks`` and its sync triggers; False if unsupported."""
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chunks_fts'"
+        ).fetchone()
+        if exists is None:
+            try:
+                # tokenchars '_' keeps identifiers like LLAMA_MAIN_PATH as one term
+                conn.execute(
+                    "CREATE VIRTUAL TABLE chunks_fts USING fts5("
+                    "content, content='chunks', content_rowid='rowid', "
+                    "tokenize=\"unicode61 tokenchars '_'\")"
+                )
+            except sqlite3.OperationalError as exc:
+                logger.warning("SQLite FTS5 unavailable (%s) — lexical retrieval disabled", exc)
+                return False
+            conn.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+
+        conn.executescript(
+            """
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN
+                INSERT INTO chunks_fts (rowid, content) VALUES (new.rowid, new.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, content)
+                VALUES ('delete', old.rowid, old.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_update AFTER UPDATE OF content ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, content)
+                VALUES ('delete', old.rowid, old.content);
+                INSERT INTO chunks_fts (rowid, content) VALUES (new.rowid, new.content);
+            END;
+            """
+        )
+        return True
 
-        self.index = hnswlib.Index(space="cosine", dim=self.dimension)
+    def _make_backend(
+        self, data_dir: Path | None = None, raw: RawVectors | None = None, **params: Any
+    ) -> VectorBackend:
+        """Backend for *data_dir* (default: ours); *params* override recorded build parameters.
 
-        if self.index_path.exists() and self.meta_path.exists():
+        *raw* is the raw-vector sidecar of *data_dir* (default: ours), which
+        the quantized backend re-scores its candidates against.
+        """
+        if data_dir is None:
+            data_dir, raw = self.data_dir, raw or self.raw_vectors
+        if self.vector_backend == QuantizedBackend.name:
+            return QuantizedBackend(
+                data_dir,
+                self.dimension,
+                dtype=self.quantized_dtype,
+                rescore=self.quantized_rescore,
+                raw=raw,
+            )
+        build = {**self._index_params, **params}
+        return HnswBackend(
+            data_dir,
+            self.dimension,
+            **{
+                key: build[key]
+                for key in ("M", "ef_construction", "ef", "initial_capacity")
+                if key in build
+            },
+        )
+
+    def _load_or_create_index(self) -> None:
+        meta: dict = {}
+        if self.meta_path.exists():
             with self.meta_path.open("r", encoding="utf-8") as handle:
                 meta = json.load(handle)
+            self.generation = int(meta.get("generation", 0))
+            self._index_params = dict(meta.get("params", {}))
+            self.ef_tuning = meta.get("ef_tuning")
+            indexed = int(meta.get("dimension", self.dimension))
+            if indexed != self.dimension:
+                raise RuntimeError(
+                    f"{self.data_dir} was indexed with {indexed}-dimensional embeddings but the "
+                    f"embedder produces {self.dimension}. Use the same EMBEDDING_MODEL (torch "
+                    "or its ONNX export) or re-ingest into a new RAG_DATA_DIR."
+                )
+
+        # Indexes written before backends were pluggable are hnswlib.
+        previous = meta.get("backend", HnswBackend.name)
+        self.index = self._make_backend()
+        has_raw = self.raw_vectors.open()
+        if (
+            previous != self.index.name
+            and previous in BACKENDS
+            and BACKENDS[previous].has_snapshot(self.data_dir)
+        ):
+            # RAG_VECTOR_BACKEND changed: the other backend's snapshot is the
+            # current one (ours, if any, is stale).
+            self.index.load(empty=True)
+            migrate(
+                self.index, previous, self.data_dir, self.dimension,
+                skip=self._free_labels, raw=self.raw_vectors if has_raw else None,
+            )
+            self._save_meta()
+        else:
+            self.index.load()
+        self._replay_log()
+        if not has_raw and self.index.count():
+            self._backfill_raw_vectors()
+        # Deletions are recorded in SQLite; re-apply any the snapshot or the
+        # replayed log does not reflect yet.
+        for label in self._free_labels:
+            self._mark_deleted(label)
 
-            max_elements = max(meta.get("max_elements", 10000), 10000)
-            self.index.load_index(str(self.index_path), max_elements=max_elements)
-            self.index.set_ef(100)
+    def _backfill_raw_vectors(self) -> None:
+        """Create the raw-vector sidecar of an index that predates it (one-off)."""
+        labels, vectors = self.index.export(skip=self._free_labels)
+        self.raw_vectors.write(labels, vectors)
+        self.raw_vectors.flush()
+        if self.index.name == QuantizedBackend.name:
+            logger.warning(
+                "Raw vectors were recovered from the %s %s index and are approximate",
+                self.index.params()["dtype"], self.index.name,
+            )
+        logger.info("Wrote %d vectors to %s", len(labels), self.raw_vectors.path.name)
+
+    def _mark_deleted(self, label: int) -> None:
+        if self.index is not None:
+            self.index.mark_deleted(label)
+
+    def _slot_count(self) -> int:
+        """Labels in use, live or deleted; fresh labels start here."""
+        if self.index is None:
+            return 0
+        # An index rebuilt or migrated from live vectors only can count fewer
+        # slots than the highest label, so SQLite's labels bound it too.
+        return max(self.index.count(), self._label_end)
+
+    def _live_count(self) -> int:
+        return self._slot_count() - len(self._free_labels)
+
+    # ------------------------------------------------------------------
+    # Append-only vector log
+    # ------------------------------------------------------------------
+
+    def _log_dtype(self) -> Any:
+        return self._np.dtype([("label", "<i8"), ("vector", "<f4", (self.dimension,))])
+
+    def _replay_log(self) -> None:
+        """Re-add vectors appended since the last snapshot.
+
+        Replaying is idempotent (backends overwrite an existing label), so a
+        crash between writing a snapshot and truncating the log is harmless.
+        A torn record at the end of the log is discarded.
+        """
+        if not self.log_path.exists():
+            return
+        size = self.log_path.stat().st_size
+        if size <= _LOG_HEADER_BYTES:
+            return
+        with self.log_path.open("rb") as handle:
+            header = handle.read(_LOG_HEADER_BYTES)
+        dimension = int.from_bytes(header[8:12], "little")
+        if header[:8] != _LOG_MAGIC or dimension != self.dimension:
+            raise RuntimeError(
+                f"{self.log_path} does not match this index (dimension {dimension}, "
+                f"expected {self.dimension}). Move it aside and re-ingest."
+            )
+
+        dtype = self._log_dtype()
+        count = (size - _LOG_HEADER_BYTES) // dtype.itemsize
+        if _LOG_HEADER_BYTES + count * dtype.itemsize != size:
+            logger.warning("Discarding a torn record at the end of %s", self.log_path)
+            with self.log_path.open("r+b") as handle:
+                handle.truncate(_LOG_HEADER_BYTES + count * dtype.itemsize)
+        if count == 0:
             return
 
-        self.index.init_index(max_elements=10000, ef_construction=100, M=16)
-        self.index.set_ef(100)
+        records = self._np.fromfile(self.log_path, dtype=dtype, count=count, offset=_LOG_HEADER_BYTES)
+        self.index.add(records["vector"], records["label"])
+        self.raw_vectors.write(records["label"], records["vector"])
+        logger.info("Replayed %d vectors from %s", count, self.log_path.name)
+
+    def _append_log(self, labels: Any, embeddings: Any) -> None:
+        records = self._np.empty(len(labels), dtype=self._log_dtype())
+        records["label"] = labels
+        records["vector"] = embeddings
+        with self.log_path.open("ab") as handle:
+            if handle.tell() == 0:
+                handle.write(
+                    _LOG_MAGIC + self.dimension.to_bytes(4, "little") + bytes(_LOG_HEADER_BYTES - 12)
+                )
+            handle.write(records.tobytes())
+            handle.flush()
+            os.fsync(handle.fileno())
+
+    def checkpoint(self) -> None:
+        """Write a full index snapshot and empty the vector log."""
+        with self._write_mutex:
+            if self.index is None:
+                return
+            self.index.save()
+            self.raw_vectors.flush()
+            self._save_meta()
+            # Only now is every logged vector inside the snapshot.
+            self.log_path.unlink(missing_ok=True)
 
     def _save_meta(self) -> None:
         if self.index is None:
             return
+        self._write_meta(self.meta_path, self.index, self.generation, self.ef_tuning)
+
+    def _write_meta(
+        self, path: Path, index: VectorBackend, generation: int, ef_tuning: dict | None
+    ) -> None:
         meta = {
-            "max_elements": max(self.index.get_max_elements(), 10000),
-            "current_count": self.index.get_current_count(),
+            "backend": index.name,
+            "max_elements": index.capacity(),
+            "current_count": index.count(),
             "dimension": self.dimension,
+            "generation": generation,
+            "params": index.params(),
+            "ef_tuning": ef_tuning,
         }
-        with self.meta_path.open("w", encoding="utf-8") as handle:
+        with path.open("w", encoding="utf-8") as handle:
             json.dump(meta, handle, indent=2)
 
-    def add_chunks(self, source: str, chunks: Iterable[str]) -> int:
-        chunk_list = [chunk.strip() for chunk in chunks if chunk.strip()]
-        if not chunk_list:
-            return 0
+    def add_chunks(
+        self, source: str, chunks: Iterable[str], collection: str = DEFAULT_COLLECTION
+    ) -> int:
+        """Store *chunks* as the content of *source*, replacing what it had before.
+
+        Returns the number of chunks that had to be embedded.
+        """
+        return self.add_documents([(source, "", list(chunks))], collection=collection).chunks_added
+
+    def file_hashes(self, collection: str = DEFAULT_COLLECTION) -> dict[str, str]:
+        """Return ``{source: content hash}`` for every file ingested into *collection*."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT source, content_hash FROM files WHERE collection = ?", (collection,)
+            ).fetchall()
+        return {row["source"]: row["content_hash"] for row in rows}
+
+    def collection_size(self, collection: str) -> int:
+        """Number of live chunks in *collection*."""
+        return len(self._collections.get(collection, ()))
+
+    def add_documents(
+        self,
+        documents: Iterable[tuple[str, str, list[str]]],
+        batch_size: int = 32,
+        collection: str = DEFAULT_COLLECTION,
+    ) -> IngestStats:
+        """Sync ``(source, file_hash, chunks)`` documents into *collection* in one batch.
 
-        embeddings = self.embedder.encode(chunk_list, convert_to_numpy=True).astype(self._np.float32)
+        A source whose *file_hash* matches the stored one is skipped (pass an
+        empty hash to always compare chunk by chunk).  Otherwise chunks whose
+        content hash already exists under that source are kept, new chunks are
+        embedded (in batches of *batch_size*) and inserted with one
+        ``add_items`` call, and leftover old chunks are deleted.  All SQLite
+        changes are made in one transaction.
+        """
+        with self._write_mutex:
+            return self._add_documents(documents, batch_size, collection)
+
+    def _add_documents(
+        self,
+        documents: Iterable[tuple[str, str, list[str]]],
+        batch_size: int,
+        collection: str,
+    ) -> IngestStats:
+        stats = IngestStats()
+        new_items: list[tuple[str, int, str, str]] = []
+        moved: list[tuple[int, int]] = []
+        stale: list[int] = []
+        file_rows: list[tuple[str, str, int]] = []
+
+        with self._connect() as conn:
+            for source, file_hash, chunks in documents:
+                if file_hash:
+                    known = conn.execute(
+                        "SELECT content_hash FROM files WHERE collection = ? AND source = ?",
+                        (collection, source),
+                    ).fetchone()
+                    if known is not None and known["content_hash"] == file_hash:
+                        stats.files_skipped += 1
+                        continue
+                chunk_list = [chunk.strip() for chunk in chunks if chunk.strip()]
+                existing: dict[str, list[tuple[int, int]]] = defaultdict(list)
+                for row in conn.execute(
+                    "SELECT vector_label, chunk_index, content_hash FROM chunks "
+                    "WHERE collection = ? AND source = ?",
+                    (collection, source),
+                ):
+                    existing[row["content_hash"]].append(
+                        (int(row["vector_label"]), int(row["chunk_index"]))
+                    )
+
+                for chunk_idx, content in enumerate(chunk_list):
+                    digest = content_hash(content)
+                    if existing.get(digest):
+                        label, old_idx = existing[digest].pop()
+                        stats.chunks_kept += 1
+                        if old_idx != chunk_idx:
+                            moved.append((chunk_idx, label))
+                    else:
+                        new_items.append((source, chunk_idx, content, digest))
+                stale.extend(label for labels in existing.values() for label, _ in labels)
+                file_rows.append((source, file_hash, len(chunk_list)))
+
+        if not new_items and not stale and not moved and not file_rows:
+            return stats
 
         if self.index is None:
             raise RuntimeError("Vector index is not initialized")
 
-        existing_count = self.index.get_current_count()
-        required = existing_count + len(chunk_list)
-        if required > self.index.get_max_elements():
-            self.index.resize_index(max(required * 2, 10000))
+        embeddings: Any = None
+        if new_items:
+            # One batcher request per batch, so concurrent queries are
+            # encoded between them instead of after the whole document set.
+            texts = [content for _, _, content, _ in new_items]
+            embeddings = self._np.concatenate(
+                [
+                    self._batcher.encode(texts[start : start + batch_size], batch_size=batch_size)
+                    for start in range(0, len(texts), batch_size)
+                ]
+            )
 
-        labels = self._np.arange(existing_count, required)
-        self.index.add_items(embeddings, labels)
+        labels: list[int] = []
+        with self._rw.write():
+            if new_items:
+                # Deleted labels are reused first; only the rest grow the index.
+                reused = self._free_labels[: len(new_items)]
+                existing_count = self._slot_count()
+                fresh = range(existing_count, existing_count + len(new_items) - len(reused))
+                labels = reused + list(fresh)
 
-        rows: list[tuple[str, str, int, str]] = []
-        for chunk_idx, content in enumerate(chunk_list):
-            label = int(labels[chunk_idx])
-            rows.append((str(uuid.uuid4()), label, source, chunk_idx, content))
+                label_array = self._np.asarray(labels, dtype=self._np.int64)
+                self.index.add(embeddings, label_array)
+                self.raw_vectors.write(label_array, embeddings)
+                self._append_log(label_array, embeddings)
+                self._label_end = max(self._label_end, int(label_array.max()) + 1)
 
-        with self._connect() as conn:
-            conn.executemany(
-                "INSERT INTO chunks (id, vector_label, source, chunk_index, content) VALUES (?, ?, ?, ?, ?)",
-                rows,
+            for label in stale:
+                self._mark_deleted(label)
+
+            with self._connect() as conn:
+                conn.executemany(
+                    "DELETE FROM chunks WHERE vector_label = ?", [(label,) for label in stale]
+                )
+                conn.executemany(
+                    "DELETE FROM free_labels WHERE label = ?", [(label,) for label in labels]
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO free_labels (label) VALUES (?)",
+                    [(label,) for label in stale],
+                )
+                conn.executemany(
+                    "UPDATE chunks SET chunk_index = ? WHERE vector_label = ?", moved
+                )
+                conn.executemany(
+                    "INSERT INTO chunks "
+                    "(id, vector_label, collection, source, chunk_index, content, content_hash) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (str(uuid.uuid4()), label, collection, source, chunk_idx, content, digest)
+                        for label, (source, chunk_idx, content, digest) in zip(labels, new_items)
+                    ],
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO files (collection, source, content_hash, chunk_count) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(collection, *row) for row in file_rows],
+                )
+                conn.commit()
+
+            used = set(labels)
+            self._free_labels = sorted(
+                {label for label in self._free_labels if label not in used} | set(stale)
             )
-            conn.commit()
+            self._collections[collection].difference_update(stale)
+            self._collections[collection].update(used)
+            if new_items or stale:
+                self._bump()
+        stats.chunks_added = len(new_items)
+        stats.chunks_deleted = len(stale)
+        if new_items or stale:
+            self._after_change()
+        return stats
+
+    def delete_source(self, source: str, collection: str = DEFAULT_COLLECTION) -> int:
+        """Remove every chunk of *source* in *collection*; returns the number deleted."""
+        with self._write_mutex:
+            with self._rw.write(), self._connect() as conn:
+                stale = [
+                    int(row["vector_label"])
+                    for row in conn.execute(
+                        "SELECT vector_label FROM chunks WHERE collection = ? AND source = ?",
+                        (collection, source),
+                    )
+                ]
+                for label in stale:
+                    self._mark_deleted(label)
+                conn.execute(
+                    "DELETE FROM chunks WHERE collection = ? AND source = ?", (collection, source)
+                )
+                conn.execute(
+                    "DELETE FROM files WHERE collection = ? AND source = ?", (collection, source)
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO free_labels (label) VALUES (?)",
+                    [(label,) for label in stale],
+                )
+                conn.commit()
+                if stale:
+                    self._free_labels = sorted(set(self._free_labels) | set(stale))
+                    self._collections[collection].difference_update(stale)
+                    self._bump()
+            if stale:
+                self._after_change()
+        return len(stale)
+
+    def _bump(self) -> None:
+        """Record an index change: new generation, stale results dropped (under the write lock)."""
+        self.generation += 1
+        self._result_cache.clear()
+
+    def _after_change(self) -> None:
+        """Re-tune ef if due, then checkpoint or save meta.
+
+        Runs after the write lock is released (the writer mutex still held),
+        so queries keep being answered meanwhile: the checkpoint only reads
+        the index, and tuning sweeps a copy of it and takes the write lock
+        just to apply the chosen ef.
+        """
+        self._maybe_tune_ef()
+        if self.log_path.exists() and self.log_path.stat().st_size >= self.checkpoint_log_bytes:
+            self.checkpoint()
+        else:
+            self._save_meta()
 
-        self.index.save_index(str(self.index_path))
+    # ------------------------------------------------------------------
+    # Maintenance (scripts/maintain_index.py)
+    # ------------------------------------------------------------------
+
+    def live_labels(self) -> Any:
+        """Sorted int64 array of the labels of all live chunks."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT vector_label FROM chunks ORDER BY vector_label").fetchall()
+        return self._np.asarray([int(row["vector_label"]) for row in rows], dtype=self._np.int64)
+
+    def collection_sizes(self) -> dict[str, int]:
+        """``{collection: live chunks}`` for every non-empty collection."""
+        return {name: len(labels) for name, labels in sorted(self._collections.items()) if labels}
+
+    def free_label_count(self) -> int:
+        return len(self._free_labels)
+
+    def rebuild_index(self, compact: bool = True, **params: Any) -> dict:
+        """Rebuild the vector index from the raw-vector sidecar, without the embedder.
+
+        Only live chunks are inserted, so the slots of deleted chunks are
+        reclaimed.  With *compact*, labels are also renumbered ``0..n-1`` (in
+        SQLite too), which shrinks the label-indexed files.  *params* override
+        the build parameters (hnsw: ``M``, ``ef_construction``); they are
+        recorded in ``index_meta.json``.
+
+        New files are staged in ``rebuild/`` and moved into place once all
+        are written; a move interrupted by a crash is finished on the next
+        start.  No other process may write to the store meanwhile.
+        """
+        with self._write_mutex:
+            return self._rebuild_index(compact, params)
+
+    def _rebuild_index(self, compact: bool, params: dict) -> dict:
+        np = self._np
+        if self.index is None:
+            raise RuntimeError("Vector index is not initialized")
+        self.checkpoint()
+        before = {"slots": self._slot_count(), "capacity": self.index.capacity()}
+        live = self.live_labels()
+        for start in range(0, len(live), _REBUILD_BLOCK):
+            block = live[start : start + _REBUILD_BLOCK]
+            empty = block[~self.raw_vectors.read(block).any(axis=1)]
+            if len(empty):
+                raise RuntimeError(
+                    f"{len(empty)}+ live chunks (e.g. label {int(empty[0])}) have no raw vector; "
+                    "re-ingest them before rebuilding"
+                )
+
+        staging = self.data_dir / _REBUILD_DIR
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir()
+        targets = np.arange(len(live), dtype=np.int64) if compact else live
+        params = {**self.index.params(), **params}  # keep current parameters by default
+        raw = RawVectors(staging, self.dimension)
+        index = self._make_backend(staging, raw, initial_capacity=max(1, len(live)), **params)
+        index.load(empty=True)
+        for start in range(0, len(live), _REBUILD_BLOCK):
+            vectors = self.raw_vectors.read(live[start : start + _REBUILD_BLOCK])
+            index.add(vectors, targets[start : start + _REBUILD_BLOCK])
+            raw.write(targets[start : start + _REBUILD_BLOCK], vectors)
+        index.save()
+        raw.flush()
+
+        if compact:
+            target = sqlite3.connect(staging / self.sqlite_path.name)
+            try:
+                with self._connect() as conn:
+                    conn.backup(target)
+                # Via negative labels, so no UPDATE collides with a not-yet-moved row
+                target.executemany(
+                    "UPDATE chunks SET vector_label = -1 - ? WHERE vector_label = ?",
+                    zip(targets.tolist(), live.tolist()),
+                )
+                target.execute("UPDATE chunks SET vector_label = -1 - vector_label")
+                target.execute("DELETE FROM free_labels")
+                target.commit()
+            finally:
+                target.close()
+
+        # New graph, new recall curve: the reload below re-tunes ef
+        self._write_meta(staging / self.meta_path.name, index, self.generation + 1, None)
+        after = {"slots": index.count(), "capacity": index.capacity(), "params": index.params()}
+        del index, raw
+        with (staging / _REBUILD_READY).open("w") as handle:
+            handle.flush()
+            os.fsync(handle.fileno())
+
+        with self._rw.write():
+            self.index = None
+            self.raw_vectors = RawVectors(self.data_dir, self.dimension)
+            self._finish_rebuild()
+            self._collections = defaultdict(set)
+            self._ensure_sqlite()
+            self._load_or_create_index()
+            self._result_cache.clear()
+        self._maybe_tune_ef()
+        return {"live": len(live), "before": before, "after": after}
+
+    def _finish_rebuild(self) -> None:
+        """Move a complete staged rebuild into place; discard an incomplete one."""
+        staging = self.data_dir / _REBUILD_DIR
+        if not staging.is_dir():
+            return
+        ready = staging / _REBUILD_READY
+        if not ready.exists():
+            logger.warning("Discarding an unfinished index rebuild in %s", staging)
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        for path in staging.iterdir():
+            if path != ready:
+                os.replace(path, self.data_dir / path.name)
+        # Everything logged before the rebuild is in the new snapshot, under old labels.
+        self.log_path.unlink(missing_ok=True)
+        ready.unlink()
+        staging.rmdir()
+        logger.info("Installed the rebuilt vector index")
+
+    def index_stats(self) -> dict:
+        """Backend, size, build/search parameters and the last ef tuning (for /health)."""
+        return {
+            "backend": self.index.name if self.index is not None else None,
+            "live": sum(len(labels) for labels in self._collections.values()),
+            "params": self.index.params() if self.index is not None else {},
+            "ef_tuning": self.ef_tuning,
+        }
+
+    def _maybe_tune_ef(self) -> None:
+        """Tune ef if it never was, the target changed, or the index grew enough."""
+        if not isinstance(self.index, HnswBackend):
+            self.ef_tuning = None  # exact backends have no ef
+            return
+        if self.target_recall <= 0:
+            return
+        live = sum(len(labels) for labels in self._collections.values())
+        if live <= self.tune_k:
+            return  # every ef finds all of them
+        tuned = self.ef_tuning
+        if (
+            tuned is not None
+            and tuned.get("target") == self.target_recall
+            and tuned.get("k") == self.tune_k
+            and tuned.get("ef") == self.index.ef
+            and live < tuned.get("live", 0) * (1 + self.retune_growth)
+        ):
+            return
+        try:
+            self.tune_ef()
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("HNSW ef tuning failed — keeping ef=%s: %s", self.index.ef, exc)
+
+    def tune_ef(
+        self, target: float | None = None, k: int | None = None, samples: int = 200
+    ) -> dict | None:
+        """Set HNSW ``ef`` to the smallest value whose recall@k reaches *target*.
+
+        Up to *samples* stored vectors are used as held-out queries (each one's
+        own chunk is excluded from both result lists), their exact neighbours
+        found by brute force over the raw-vector sidecar, and ``ef`` swept
+        upwards until the index finds enough of them.  If no value reaches
+        the target, the largest tried is kept.  The result is recorded in
+        ``index_meta.json``; returns it, plus the whole ``sweep``.
+
+        The sweep runs on an in-memory copy of the graph (briefly doubling
+        its RAM), so queries served meanwhile keep the current ``ef``; the
+        chosen value is applied once, under the write lock.
+        """
+        with self._write_mutex:
+            return self._tune_ef(target, k, samples)
+
+    def _tune_ef(self, target: float | None, k: int | None, samples: int) -> dict | None:
+        if not isinstance(self.index, HnswBackend):
+            return None
+        target = self.target_recall if target is None else target
+        k = k or self.tune_k
+        probe = self._recall_probe(k, samples)
+        if probe is None:
+            return None
+
+        trial = self.index.clone()
+        sweep: list[dict] = []
+        for ef in sorted({k, *(value for value in _EF_SWEEP if value > k)}):
+            trial.set_ef(ef)
+            recall, ms = self._probe_recall(probe, k, trial)
+            sweep.append({"ef": ef, "recall": round(recall, 4), "ms_per_query": round(ms, 3)})
+            if recall >= target:
+                break
+        else:
+            logger.warning(
+                "HNSW recall@%d stays below %.2f up to ef=%d — consider a rebuild with a larger M",
+                k, target, trial.ef,
+            )
+        del trial
+        chosen = sweep[-1]
+        with self._rw.write():
+            self.index.set_ef(chosen["ef"])
+            self.ef_tuning = {
+                **chosen,
+                "k": k,
+                "target": target,
+                "live": sum(len(labels) for labels in self._collections.values()),
+                "samples": len(probe[0]),
+                "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
         self._save_meta()
-        return len(chunk_list)
+        logger.info(
+            "HNSW ef tuned to %d: recall@%d %.3f (target %.2f), %.2f ms/query",
+            chosen["ef"], k, chosen["recall"], target, chosen["ms_per_query"],
+        )
+        return {**self.ef_tuning, "sweep": sweep}
+
+    def measure_recall(self, k: int = 10, samples: int = 200) -> dict | None:
+        """Recall@k and ms/query of the index as currently configured."""
+        probe = self._recall_probe(k, samples)
+        if probe is None:
+            return None
+        recall, ms = self._probe_recall(probe, k)
+        return {"recall": round(recall, 4), "ms_per_query": round(ms, 3), "samples": len(probe[0])}
+
+    def _recall_probe(self, k: int, samples: int) -> tuple[Any, Any, Any] | None:
+        """``(query labels, query vectors, exact k-th best score)`` for a sample of live chunks."""
+        np = self._np
+        live = self.live_labels()
+        if len(live) <= k:
+            return None
+        picked = np.sort(np.random.default_rng(0).choice(live, min(samples, len(live)), replace=False))
+        queries = self.raw_vectors.read(picked)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        best = np.full((len(picked), k), -np.inf, dtype=np.float32)
+        for start in range(0, len(live), _REBUILD_BLOCK):
+            labels = live[start : start + _REBUILD_BLOCK]
+            block = self.raw_vectors.read(labels)
+            block /= np.maximum(np.linalg.norm(block, axis=1, keepdims=True), 1e-12)
+            scores = queries @ block.T
+            scores[labels[None, :] == picked[:, None]] = -np.inf  # held out
+            merged = np.hstack([best, scores])
+            best = np.take_along_axis(merged, np.argpartition(-merged, k - 1, axis=1)[:, :k], axis=1)
+        return picked, queries, best.min(axis=1)
+
+    def _probe_recall(
+        self, probe: tuple[Any, Any, Any], k: int, index: VectorBackend | None = None
+    ) -> tuple[float, float]:
+        """Recall@k of *index* (default: the served one) for *probe*, and its mean ms/query.
+
+        A hit is any result at least as close as the exact k-th neighbour, so
+        ties between duplicate chunks do not count as misses.
+        """
+        index = index if index is not None else self.index
+        picked, queries, kth = probe
+        hits = 0
+        started = time.perf_counter()
+        for label, query, threshold in zip(picked.tolist(), queries, kth):
+            labels, distances = index.search(query, k + 1)
+            kept = [distance for found, distance in zip(labels, distances) if found != label][:k]
+            hits += sum(1.0 - distance >= threshold - 1e-5 for distance in kept)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        return float(hits) / (k * len(picked)), elapsed_ms / len(picked)
+
+    def verify(self, sample: int = 1000) -> list[str]:
+        """Cross-check SQLite, the vector index and the raw-vector sidecar.
+
+        Returns a description of every inconsistency found (empty if none).
+        Up to *sample* live vectors are compared between index and sidecar.
+        """
+        np = self._np
+        if self.index is None:
+            return ["vector index is not initialized"]
+        problems: list[str] = []
+        live = self.live_labels()
+        free = set(self._free_labels)
+        with self._connect() as conn:
+            unlabeled = conn.execute(
+                "SELECT COUNT(*) AS n FROM chunks WHERE vector_label IS NULL"
+            ).fetchone()["n"]
+            if unlabeled:
+                problems.append(f"{unlabeled} chunks have no vector label")
+            miscounted = conn.execute(
+                "SELECT COUNT(*) AS n FROM files f WHERE chunk_count != ("
+                "SELECT COUNT(*) FROM chunks c "
+                "WHERE c.collection = f.collection AND c.source = f.source)"
+            ).fetchone()["n"]
+            if miscounted:
+                problems.append(f"{miscounted} files rows disagree with their chunk count")
+            orphans = conn.execute(
+                "SELECT COUNT(*) AS n FROM chunks c WHERE NOT EXISTS ("
+                "SELECT 1 FROM files f WHERE f.collection = c.collection AND f.source = c.source)"
+            ).fetchone()["n"]
+            if orphans:
+                problems.append(f"{orphans} chunks belong to no files row")
+            if self._fts:
+                try:
+                    conn.execute(
+                        "INSERT INTO chunks_fts (chunks_fts, rank) VALUES ('integrity-check', 1)"
+                    )
+                except sqlite3.DatabaseError as exc:
+                    problems.append(f"FTS index out of sync with chunks: {exc}")
+
+        reused = free.intersection(live.tolist())
+        if reused:
+            problems.append(f"{len(reused)} labels are both live and free (e.g. {min(reused)})")
+        absent = self.index.missing(live.tolist())
+        if absent:
+            problems.append(
+                f"{len(absent)} live chunks are not searchable in the index (e.g. label {absent[0]})"
+            )
+        searchable = len(free) - len(self.index.missing(sorted(free)))
+        if searchable:
+            problems.append(f"{searchable} deleted labels are still searchable")
+
+        no_raw = 0
+        for start in range(0, len(live), _REBUILD_BLOCK):
+            block = live[start : start + _REBUILD_BLOCK]
+            no_raw += int((~self.raw_vectors.read(block).any(axis=1)).sum())
+        if no_raw:
+            problems.append(f"{no_raw} live chunks have no raw vector")
+
+        checked = np.setdiff1d(live, np.asarray(absent, dtype=np.int64))
+        if len(checked) > sample:
+            checked = np.sort(np.random.default_rng(0).choice(checked, sample, replace=False))
+        raw = self.raw_vectors.read(checked)
+        has_raw = raw.any(axis=1)
+        checked, raw = checked[has_raw], raw[has_raw]
+        if len(checked):
+            raw /= np.maximum(np.linalg.norm(raw, axis=1, keepdims=True), 1e-12)
+            indexed = self.index.vectors(checked)
+            indexed = indexed / np.maximum(np.linalg.norm(indexed, axis=1, keepdims=True), 1e-12)
+            drifted = int((np.sum(raw * indexed, axis=1) < 0.99).sum())
+            if drifted:
+                problems.append(
+                    f"{drifted} of {len(checked)} sampled index vectors differ from the raw copy"
+                )
+        return problems
+
+    def _encode(self, texts: list[str], batch_size: int) -> Any:
+        """One forward pass over *texts*; run by the batcher's worker thread."""
+        return self.embedder.encode(texts, batch_size=batch_size)
+
+    def embed(self, text: str) -> Any:
+        """Return the unit-length float32 embedding of *text* (read-only, cached)."""
+        key = _cache_key(text)
+        vector = self._embedding_cache.get(key)
+        if vector is None:
+            vector = self._batcher.encode([text])[0]
+            vector.flags.writeable = False  # shared by every caller of this key
+            self._embedding_cache.put(key, vector)
+        return vector
+
+    def cache_stats(self) -> dict:
+        """Hit/miss counters of the query-embedding and result caches."""
+        return {
+            "embeddings": self._embedding_cache.stats(),
+            "results": self._result_cache.stats(),
+            "embed_batches": self._batcher.stats(),
+        }
+
+    def prefers_lexical(self, text: str) -> bool:
+        """True if ``query(text)`` without a vector tries BM25 alone first (``auto`` mode).
 
-    def query(self, text: str, top_k: int = 3) -> list[dict]:
-        if self.index is None or self.index.get_current_count() == 0:
+        Callers that embed the message for their own purposes (the response
+        cache, the embedding router) check this first, so identifier-style
+        queries never reach the embedder.
+        """
+        return self._fts and self.retrieval_mode == "auto" and looks_like_keywords(text)
+
+    def query(
+        self,
+        text: str,
+        top_k: int = 3,
+        vector: Any = None,
+        mode: str | None = None,
+        collections: Iterable[str] | None = None,
+    ) -> list[dict]:
+        """Return the *top_k* chunks most relevant to *text*.
+
+        *mode* is ``"vector"``, ``"lexical"``, ``"hybrid"`` or ``"auto"``
+        (default: the store's ``retrieval_mode``).  Pass *vector* (from
+        :meth:`embed`) to reuse an embedding the caller already computed
+        instead of encoding *text* again.  *collections* restricts the search
+        to those collections (default: every chunk).
+
+        Each result has ``source``, ``chunk_index``, ``content``,
+        ``collection`` and ``distance`` (cosine distance, or None for a chunk
+        found only by BM25).
+        """
+        with self._rw.read():
+            return self._query(text, top_k, vector, mode, collections)
+
+    def _query(
+        self,
+        text: str,
+        top_k: int,
+        vector: Any,
+        mode: str | None,
+        collections: Iterable[str] | None,
+    ) -> list[dict]:
+        mode = mode or self.retrieval_mode
+        if not self._fts:
+            mode = "vector"
+        scope = tuple(sorted(set(collections))) if collections is not None else None
+        allowed: set[int] | None = None
+        if scope is None:
+            live = self._live_count()
+        else:
+            allowed = set().union(*(self._collections.get(name, set()) for name in scope))
+            live = len(allowed)
+        if live <= 0:
             return []
 
-        vector = self.embedder.encode([text], convert_to_numpy=True).astype(self._np.float32)
-        labels, distances = self.index.knn_query(vector, k=min(top_k, self.index.get_current_count()))
-        label_list = labels[0].tolist()
-        score_list = distances[0].tolist()
+        if mode == "lexical" or (
+            mode == "auto" and vector is None and looks_like_keywords(text)
+        ):
+            key = ("lexical", _cache_key(text), top_k, self.generation, scope)
+            cached = self._result_cache.get(key)
+            if cached is not None:
+                return [dict(item) for item in cached]
+            limit = top_k * 2 if self.collapse_adjacent else top_k
+            labels = self._lexical_labels(text, limit, scope)
+            if labels or mode == "lexical":
+                return self._finish(key, self._select(None, labels, {}, set(labels), top_k))
+        hybrid = mode != "vector"
+        diversify = self.mmr_lambda < 1 or self.collapse_adjacent
+
+        # Start BM25 first so it overlaps with the embedding forward pass.
+        candidates = max(top_k * 4, 20) if hybrid or diversify else top_k
+        lexical: Future | None = None
+        if hybrid:
+            lexical = self._lexical_pool.submit(self._lexical_labels, text, candidates, scope)
+
+        if vector is None:
+            vector = self.embed(text)
+        vector = self._np.asarray(vector, dtype=self._np.float32).reshape(1, -1)
+
+        key = (
+            hashlib.blake2b(vector.tobytes(), digest_size=16).digest(),
+            top_k,
+            self.generation,
+            hybrid,
+            scope,
+        )
+        cached = self._result_cache.get(key)
+        if cached is not None:
+            return [dict(item) for item in cached]
+
+        labels, distances = self._vector_search(vector, min(candidates, live), allowed)
+        distance_by_label = dict(zip(labels, distances))
+        # label → relevance, best first: cosine similarity, or the RRF score
+        relevance = {label: 1.0 - distance for label, distance in distance_by_label.items()}
+        lexical_hits: set[int] = set()
+        if lexical is not None:
+            lexical_labels = lexical.result()
+            lexical_hits = set(lexical_labels)
+            relevance = self._fuse(list(distance_by_label), lexical_labels)
+        return self._finish(
+            key, self._select(vector, relevance, distance_by_label, lexical_hits, top_k)
+        )
+
+    def _select(
+        self,
+        vector: Any,
+        relevance: dict[int, float] | list[int],
+        distance_by_label: dict[int, float],
+        lexical_hits: set[int],
+        top_k: int,
+    ) -> list[dict]:
+        """Pick *top_k* results from the ranked candidates, best first.
+
+        1. Drop vector hits farther than ``max_distance`` (BM25 hits matched
+           literally and are kept).
+        2. Maximal Marginal Relevance: greedily take the candidate maximising
+           ``λ·relevance − (1 − λ)·max cosine to those already taken``,
+           vectorised over the candidates' embeddings; near-duplicates of a
+           taken chunk are dropped outright.
+        3. Skip a chunk whose neighbour (same source, chunk_index ± 1) was
+           already taken — consecutive chunks mostly repeat each other.
+        """
+        np = self._np
+        ranked = list(relevance)
+        if self.max_distance > 0:
+            ranked = [
+                label
+                for label in ranked
+                if label in lexical_hits
+                or distance_by_label.get(label, 0.0) <= self.max_distance
+            ]
+        rows = self._fetch(ranked)
+        ranked = [label for label in ranked if label in rows]
+        if not ranked:
+            return []
+
+        order = list(range(len(ranked)))  # plain rank order when MMR is off
+        use_mmr = (
+            vector is not None
+            and isinstance(relevance, dict)
+            and self.mmr_lambda < 1
+            and len(ranked) > 1
+        )
+        if use_mmr and self.index is not None:
+            try:
+                embeddings = self.index.vectors(np.asarray(ranked, dtype=np.int64))
+            except RuntimeError:
+                use_mmr = False  # a candidate was deleted under us; keep rank order
+        else:
+            use_mmr = False
+        if use_mmr:
+            scores = np.asarray([relevance[label] for label in ranked], dtype=np.float32)
+            peak = float(np.abs(scores).max())
+            if peak > 0:
+                scores /= peak  # RRF scores are tiny; bring them to the similarity scale
+            similarity = embeddings @ embeddings.T
+            redundancy = np.full(len(ranked), -np.inf, dtype=np.float32)
+            available = np.ones(len(ranked), dtype=bool)
+
+        taken: list[int] = []
+        taken_positions: set[tuple[str, int]] = set()
+        while len(taken) < top_k:
+            if use_mmr:
+                if not available.any():
+                    break
+                penalty = np.where(np.isfinite(redundancy), redundancy, 0.0)
+                mmr = self.mmr_lambda * scores - (1 - self.mmr_lambda) * penalty
+                mmr[~available] = -np.inf
+                pick = int(np.argmax(mmr))
+                available[pick] = False
+                if redundancy[pick] >= _NEAR_DUPLICATE:
+                    continue
+            else:
+                if not order:
+                    break
+                pick = order.pop(0)
+            row = rows[ranked[pick]]
+            position = (row["source"], int(row["chunk_index"]))
+            if self.collapse_adjacent and (
+                (position[0], position[1] - 1) in taken_positions
+                or (position[0], position[1] + 1) in taken_positions
+            ):
+                continue
+            taken.append(pick)
+            taken_positions.add(position)
+            if use_mmr:
+                redundancy = np.maximum(redundancy, similarity[pick])
 
+        return [
+            self._result(rows[ranked[pick]], distance_by_label.get(ranked[pick]))
+            for pick in taken
+        ]
+
+    def _vector_search(
+        self, vector: Any, k: int, allowed: set[int] | None
+    ) -> tuple[list[int], list[float]]:
+        """k nearest labels, restricted to *allowed* when given."""
+        if allowed is None:
+            return self.index.search(vector, k)
+        if len(allowed) > self.exact_search_max:
+            try:
+                return self.index.search(vector, k, allowed=allowed)
+            except RuntimeError:
+                # hnswlib could not collect k filtered neighbours; scan instead.
+                pass
+        return self._exact_search(vector, k, allowed)
+
+    def _exact_search(self, vector: Any, k: int, allowed: set[int]) -> tuple[list[int], list[float]]:
+        """Brute-force cosine top-k over just the *allowed* vectors."""
+        np = self._np
+        labels = np.sort(np.fromiter(allowed, dtype=np.int64, count=len(allowed)))
+        query = vector.ravel() / max(float(np.linalg.norm(vector)), 1e-12)
+        scores = self.index.vectors(labels) @ query
+        k = min(k, len(labels))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return labels[top].tolist(), (1.0 - scores[top]).astype(float).tolist()
+
+    def _lexical_labels(
+        self, text: str, limit: int, scope: tuple[str, ...] | None = None
+    ) -> list[int]:
+        """Vector labels of the best BM25 matches for *text*, best first."""
+        match = _fts_query(text)
+        if not match:
+            return []
+        where, params = "", ()
+        if scope is not None:
+            where = f" AND chunks.collection IN ({','.join('?' for _ in scope)})"
+            params = scope
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT chunks.vector_label FROM chunks_fts "
+                "JOIN chunks ON chunks.rowid = chunks_fts.rowid "
+                f"WHERE chunks_fts MATCH ?{where} ORDER BY bm25(chunks_fts) LIMIT ?",
+                (match, *params, limit),
+            ).fetchall()
+        return [int(row["vector_label"]) for row in rows]
+
+    @staticmethod
+    def _fuse(*rankings: list[int]) -> dict[int, float]:
+        """Reciprocal-rank fusion: score(label) = sum over rankings of 1 / (k + rank).
+
+        Returns ``{label: score}`` ordered best first.
+        """
+        scores: dict[int, float] = defaultdict(float)
+        for ranking in rankings:
+            for rank, label in enumerate(ranking, start=1):
+                scores[label] += 1.0 / (_RRF_K + rank)
+        return {label: scores[label] for label in sorted(scores, key=scores.__getitem__, reverse=True)}
+
+    def _fetch(self, labels: list[int]) -> dict[int, sqlite3.Row]:
+        """Chunk rows for *labels*, keyed by label (missing labels are absent)."""
+        if not labels:
+            return {}
         with self._connect() as conn:
-            placeholders = ",".join("?" for _ in label_list)
+            placeholders = ",".join("?" for _ in labels)
             db_rows = conn.execute(
-                f"SELECT vector_label, source, chunk_index, content FROM chunks WHERE vector_label IN ({placeholders})",
-                tuple(label_list),
+                "SELECT vector_label, collection, source, chunk_index, content FROM chunks "
+                f"WHERE vector_label IN ({placeholders})",
+                tuple(labels),
             ).fetchall()
-        row_by_label = {int(row["vector_label"]): row for row in db_rows}
-
-        results: list[dict] = []
-        for label, score in zip(label_list, score_list):
-            row = row_by_label.get(int(label))
-            if row is not None:
-                results.append(
-                    {
-                        "source": row["source"],
-                        "chunk_index": row["chunk_index"],
-                        "content": row["content"],
-                        "distance": float(score),
-                    }
-                )
-        return results
+        return {int(row["vector_label"]): row for row in db_rows}
+
+    @staticmethod
+    def _result(row: sqlite3.Row, distance: float | None) -> dict:
+        return {
+            "source": row["source"],
+            "chunk_index": row["chunk_index"],
+            "content": row["content"],
+            "collection": row["collection"],
+            "distance": distance,
+        }
+
+    def _finish(self, key: Any, results: list[dict]) -> list[dict]:
+        self._result_cache.put(key, results)
+        return [dict(item) for item in results]
@@ -0,0 +1,150 @@
+"""Semantic response cache.
+
+FAQ-style questions ("what can you do?", opening hours, setup steps) arrive
+over and over in slightly different words.  ``ResponseCache`` remembers the
+replies, keyed by the embedding of the normalised message, the route that
+answered it and the RAG index generation, and serves a stored reply when a
+new message is close enough (cosine similarity ≥ ``min_similarity``).
+
+Entries expire after ``ttl_seconds`` and the least-recently-used entry is
+evicted beyond ``max_entries``.  Turns that depend on who is asking or on the
+conversation so far ("my order", "what about that one?") are never cached —
+see :func:`is_cacheable`.
+"""
+from __future__ import annotations
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+# First-person references: the answer depends on who is asking.
+_PERSONAL = re.compile(
+    r"\b(my|mine|me|myself|our|ours|us|i'm|i am|i've|i'd|i was)\b", re.IGNORECASE
+)
+# Anaphora and references to earlier turns: the answer depends on history.
+_HISTORY_DEPENDENT = re.compile(
+    r"\b(it|its|that|this|these|those|they|them|he|she|him|her|his|hers|"
+    r"above|earlier|previous|again|before|you said|last time|remember|"
+    r"did i|i said|i asked|i told|i mentioned)\b",
+    re.IGNORECASE,
+)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_message(message: str) -> str:
+    """Lower-case, collapse whitespace and strip surrounding punctuation."""
+    return _WHITESPACE.sub(" ", message.lower()).strip(" \t\n?!.,;:")
+
+
+def is_cacheable(message: str) -> bool:
+    """True if the reply to *message* could be reused for other users."""
+    return not (_PERSONAL.search(message) or _HISTORY_DEPENDENT.search(message))
+
+
+@dataclass
+class _Entry:
+    vector: Any
+    route: str
+    generation: int
+    response: str
+    expires_at: float
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        max_entries: int = 512,
+        ttl_seconds: float = 3600.0,
+        min_similarity: float = 0.95,
+    ) -> None:
+        try:
+            import numpy as _np  # type: ignore[import]
+        except ImportError as exc:
+            raise RuntimeError(
+                "numpy is not installed. Run: pip install -r requirements.txt"
+            ) from exc
+        self._np = _np
+
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.min_similarity = min_similarity
+
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self._ids = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def lookup(self, vector: Any, route: str, generation: int) -> str | None:
+        """Return a cached reply for a message embedded as *vector*, or None."""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now, generation)
+            candidates = [
+                (entry_id, entry)
+                for entry_id, entry in self._entries.items()
+                if entry.route == route and entry.generation == generation
+            ]
+            best_id, best_score = None, -1.0
+            if candidates:
+                matrix = self._np.stack([entry.vector for _, entry in candidates])
+                scores = matrix @ vector
+                idx = int(self._np.argmax(scores))
+                best_id, best_score = candidates[idx][0], float(scores[idx])
+
+            if best_id is None or best_score < self.min_similarity:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._entries.move_to_end(best_id)
+            return self._entries[best_id].response
+
+    def store(self, vector: Any, route: str, generation: int, response: str) -> None:
+        if not response:
+            return
+        with self._lock:
+            self._ids += 1
+            self._entries[self._ids] = _Entry(
+                vector=vector,
+                route=route,
+                generation=generation,
+                response=response,
+                expires_at=time.monotonic() + self.ttl_seconds,
+            )
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+            }
+
+    # ------------------------------------------------------------------
+    # Internal helpers
+    # ------------------------------------------------------------------
+
+    def _expire(self, now: float, generation: int) -> None:
+        """Drop entries past their TTL or built against an older RAG index."""
+        expired = [
+            entry_id
+            for entry_id, entry in self._entries.items()
+            if entry.expires_at <= now or entry.generation != generation
+        ]
+        for entry_id in expired:
+            del self._entries[entry_id]